@@ -0,0 +1,321 @@
+"""Composition of extracted textures into a texture map (atlas) of one or more pages."""
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from encoders import DEFAULT_COMPRESSION, encoder_pool, image_format, write_image
+from manifest import BINARY_EXTENSION, atlas_manifest, encode_manifest
+from packing import MaxRectsPacker, PackingError, Placement, pack_pages
+from profiling import PROFILER
+
+# Packing settings used when none are given; also the GUI's initial choices
+DEFAULT_ATLAS_OPTIONS = {
+    'method': 'maxrects',
+    'padding': 0,
+    'bleed': False,
+    'allow_rotation': False,
+    'power_of_two': False,
+    'fixed_size': None,
+    'max_size': 8192,  # Larger maps spill onto extra pages
+}
+
+
+def texture_image(texture):
+    """PIL image of a texture; lazily extracted ones are warped (or read from cache) on first use."""
+    materialize = getattr(texture, 'materialize', None)
+    return materialize() if materialize is not None else texture
+
+
+def paste_texture(map_image, texture, placement, padding=0, bleed=False):
+    """Paste a texture at its placement, rotating it and filling the padding if needed."""
+    if placement.rotated:
+        texture = texture.transpose(Image.Transpose.ROTATE_90)
+    if bleed and padding:
+        # Repeat the edge pixels into the padding so filtering never samples a neighbour
+        bordered = cv2.copyMakeBorder(np.asarray(texture), padding, padding, padding, padding, cv2.BORDER_REPLICATE)
+        map_image.paste(Image.fromarray(bordered), (placement.x - padding, placement.y - padding))
+    else:
+        map_image.paste(texture, (placement.x, placement.y))
+
+
+class AtlasPage:
+    """One page of a texture map: its size, the textures on it and its preview thumbnail."""
+
+    def __init__(self, width, height, allow_rotation=False):
+        self.width = width
+        self.height = height
+        self.keys = []  # Textures on this page
+        self.free_space = MaxRectsPacker(width, height, allow_rotation)  # Unused part of the page
+        self.thumbnail = None
+        self.thumbnail_stale = True
+        self.pending = []  # ('clear', rect) / ('draw', key) thumbnail updates since the last refresh
+
+
+class TextureAtlas:
+    """Texture map that keeps its placements between updates and spills onto extra pages.
+
+    Each texture owns the slot it was packed into. Re-extracting a texture that still
+    fits its slot only redraws that slot, and a new texture goes into free space when
+    there is room. The whole map is repacked only when a texture no longer fits or the
+    packing settings change.
+
+    Full-resolution pages are never kept: previews are drawn straight from the
+    textures, and ``render_page`` builds a page only while it is being saved.
+    Packing only needs texture sizes, so textures with a ``materialize()`` method
+    (see ``session.LazyTexture``) are not turned into pixels until drawn.
+    """
+
+    def __init__(self, **options):
+        self.options = {**DEFAULT_ATLAS_OPTIONS, **options}
+        self.textures = {}  # key -> PIL texture (or one materialized on demand), in the order they were added
+        self.slots = {}  # key -> (page index, Placement of the area reserved for the texture)
+        self.pages = []
+        self.repack_count = 0
+
+    @property
+    def is_empty(self):
+        return not self.pages
+
+    @property
+    def efficiency(self):
+        """Fraction of the pages covered by texture pixels."""
+        page_area = sum(page.width * page.height for page in self.pages)
+        if not page_area:
+            return 0.0
+        used = sum(texture.width * texture.height for texture in self.textures.values())
+        return used / page_area
+
+    def placement(self, key):
+        """(page index, Placement) of where a texture currently sits; its slot may be larger."""
+        page_index, slot = self.slots[key]
+        texture = self.textures[key]
+        width, height = (texture.height, texture.width) if slot.rotated else texture.size
+        return page_index, Placement(slot.x, slot.y, width, height, slot.rotated)
+
+    def configure(self, **options):
+        """Change packing settings, repacking the map if anything changed."""
+        options = {**self.options, **options}
+        if options != self.options:
+            previous, self.options = self.options, options
+            try:
+                self.repack()
+            except PackingError:
+                self.options = previous
+                raise
+
+    def set_texture(self, key, texture):
+        """Add or replace a texture, touching only its own region when possible."""
+        if key in self.slots:
+            page_index, slot = self.slots[key]
+            if self._fits(texture, slot):
+                self.textures[key] = texture
+                page = self.pages[page_index]
+                page.pending.append(('clear', self._slot_bounds(slot)))
+                page.pending.append(('draw', key))
+                return
+
+        previous = self.textures.get(key)
+        self.textures[key] = texture
+        if key not in self.slots:
+            for page_index, page in enumerate(self.pages):
+                slot = self._allocate(page, texture)
+                if slot is not None:
+                    self.slots[key] = (page_index, slot)
+                    page.keys.append(key)
+                    page.pending.append(('draw', key))
+                    return
+
+        try:
+            self.repack()
+        except PackingError:
+            # Leave the map as it was
+            if previous is None:
+                del self.textures[key]
+            else:
+                self.textures[key] = previous
+            raise
+
+    def set_textures(self, textures):
+        """Replace every texture at once ({key: texture}) and repack the map."""
+        previous = self.textures
+        self.textures = dict(textures)
+        try:
+            self.repack()
+        except PackingError:
+            self.textures = previous
+            raise
+
+    def remove(self, key):
+        """Remove a texture and free its slot for later textures."""
+        if key not in self.textures:
+            return
+        del self.textures[key]
+        if key not in self.slots:
+            return
+        page_index, slot = self.slots.pop(key)
+        page = self.pages[page_index]
+        page.keys.remove(key)
+        bounds = self._slot_bounds(slot)
+        page.free_space.release(*bounds)
+        page.pending.append(('clear', bounds))
+
+    def clear(self):
+        self.textures = {}
+        self.slots = {}
+        self.pages = []
+
+    def repack(self):
+        """Pack every texture from scratch, onto as many pages as the size limit requires.
+
+        The map is left untouched if packing raises PackingError.
+        """
+        options = self.options
+        keys = list(self.textures)
+        page_results = pack_pages([self.textures[key].size for key in keys], method=options['method'],
+                                  padding=options['padding'], allow_rotation=options['allow_rotation'],
+                                  power_of_two=options['power_of_two'], fixed_size=options['fixed_size'],
+                                  max_size=options['max_size']) if keys else []
+
+        self.slots = {}
+        self.pages = []
+        for page_index, (indices, result) in enumerate(page_results):
+            page = AtlasPage(result.width, result.height, options['allow_rotation'])
+            for index, slot in zip(indices, result.placements):
+                key = keys[index]
+                self.slots[key] = (page_index, slot)
+                page.keys.append(key)
+                page.free_space.occupy(*self._slot_bounds(slot))
+            self.pages.append(page)
+        self.repack_count += 1
+
+    def render_page(self, page_index, alpha=False):
+        """Build the full-resolution image of one page; with ``alpha`` it is RGBA with a transparent background."""
+        page = self.pages[page_index]
+        if alpha:
+            page_image = Image.new('RGBA', (page.width, page.height), color=(0, 0, 0, 0))
+        else:
+            page_image = Image.new('RGB', (page.width, page.height), color=(0, 0, 0))
+        PROFILER.count("page bytes", page.width * page.height * 4)
+        for key in page.keys:
+            paste_texture(page_image, texture_image(self.textures[key]), self.placement(key)[1],
+                          self.options['padding'], self.options['bleed'])
+        return page_image
+
+    def thumbnail(self, page_index, max_width, max_height):
+        """A page scaled to fit max_width x max_height, redrawing only the regions that changed."""
+        if not 0 <= page_index < len(self.pages):
+            return None
+        page = self.pages[page_index]
+        ratio = min(max_width / page.width, max_height / page.height)
+        size = (max(1, int(page.width * ratio)), max(1, int(page.height * ratio)))
+        scale_x = size[0] / page.width
+        scale_y = size[1] / page.height
+
+        if page.thumbnail_stale or page.thumbnail is None or page.thumbnail.size != size:
+            page.thumbnail = Image.new('RGB', size, color=(0, 0, 0))
+            for key in page.keys:
+                self._draw_thumbnail_texture(page, key, scale_x, scale_y)
+        else:
+            for action, target in page.pending:
+                if action == 'clear':
+                    page.thumbnail.paste((0, 0, 0), self._thumbnail_box(target, scale_x, scale_y))
+                elif target in page.keys:
+                    self._draw_thumbnail_texture(page, target, scale_x, scale_y)
+
+        page.pending = []
+        page.thumbnail_stale = False
+        return page.thumbnail
+
+    def _draw_thumbnail_texture(self, page, key, scale_x, scale_y):
+        """Downscale one texture straight into its spot on the page thumbnail."""
+        placement = self.placement(key)[1]
+        left, top, right, bottom = self._thumbnail_box(placement[:4], scale_x, scale_y)
+        if right <= left or bottom <= top:
+            return
+        texture = texture_image(self.textures[key])
+        if placement.rotated:
+            small = texture.resize((bottom - top, right - left), Image.LANCZOS).transpose(Image.Transpose.ROTATE_90)
+        else:
+            small = texture.resize((right - left, bottom - top), Image.LANCZOS)
+        page.thumbnail.paste(small, (left, top))
+        PROFILER.count("thumbnail resizes")
+
+    def _thumbnail_box(self, rect, scale_x, scale_y):
+        """Thumbnail pixel box covering a (x, y, width, height) page rect; neighbours never overlap."""
+        x, y, width, height = rect
+        return (int(round(x * scale_x)), int(round(y * scale_y)),
+                int(round((x + width) * scale_x)), int(round((y + height) * scale_y)))
+
+    def _fits(self, texture, slot):
+        width, height = (texture.height, texture.width) if slot.rotated else texture.size
+        return width <= slot.width and height <= slot.height
+
+    def _allocate(self, page, texture):
+        """Find room for a new texture in a page's free space, or None if it is full."""
+        padding = self.options['padding']
+        position = page.free_space.insert(texture.width + 2 * padding, texture.height + 2 * padding)
+        if position is None:
+            return None
+        x, y, rotated = position
+        width, height = (texture.height, texture.width) if rotated else texture.size
+        return Placement(x + padding, y + padding, width, height, rotated)
+
+    def _slot_bounds(self, slot):
+        """The slot including its padding, as a (x, y, width, height) rect."""
+        padding = self.options['padding']
+        return slot.x - padding, slot.y - padding, slot.width + 2 * padding, slot.height + 2 * padding
+
+
+def page_paths(path, page_count):
+    """File names for the pages of a map saved as ``path``: the path itself, or path_1, path_2, ..."""
+    if page_count == 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}_{number}{ext}" for number in range(1, page_count + 1)]
+
+
+def save_atlas(atlas, path, sources=None, binary=False, compression=DEFAULT_COMPRESSION, alpha=False):
+    """Write every page plus its manifest next to it, returning a report of what was written.
+
+    The page format follows the extension of ``path`` (see ``encoders``), at the
+    given ``compression`` effort; ``alpha`` keeps the unused space transparent.
+    Pages are rendered and written one after another, each streamed to its file
+    as it is encoded, so only one full-resolution page is in memory at any time;
+    PNG pages are compressed on every core. The JSON manifest (and with ``binary`` the compact
+    ``.atlas`` one) is written in the same pass; see ``atlas_manifest`` for ``sources``.
+
+    The report has the 'files' written, per-page 'pages' ({'path', 'bytes', 'seconds'}
+    spent encoding) and the total 'bytes' and 'seconds'.
+    """
+    start = time.perf_counter()
+    page_format = image_format(path)
+    paths = page_paths(path, len(atlas.pages))
+
+    pages = []
+    with encoder_pool() as chunk_pool:
+        for page_index, page_path in enumerate(paths):
+            page_image = atlas.render_page(page_index, alpha)
+            with PROFILER.span("encode_page"):
+                encode_start = time.perf_counter()
+                with open(page_path, "wb") as f:
+                    size = write_image(f, page_image, page_format, compression, chunk_pool)
+                encoded = time.perf_counter() - encode_start
+            del page_image
+            PROFILER.count("encoded bytes", size)
+            pages.append({'path': page_path, 'bytes': size, 'seconds': encoded})
+
+    manifest = atlas_manifest(atlas, paths, sources)
+    root = os.path.splitext(path)[0]
+    written = paths + [root + ".json"]
+    with open(root + ".json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    if binary:
+        written.append(root + BINARY_EXTENSION)
+        with open(root + BINARY_EXTENSION, "wb") as f:
+            f.write(encode_manifest(manifest))
+    return {'files': written, 'pages': pages, 'bytes': sum(page['bytes'] for page in pages),
+            'seconds': time.perf_counter() - start}
@@ -0,0 +1,306 @@
+"""Headless batch extraction: `python texture_ripper.py batch IMAGES... --quads FILE --out DIR`.
+
+Nothing in here (or in the modules it imports) touches Tk, so batch runs work on
+machines without a display and in process-pool workers.
+"""
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import re
+import sys
+import time
+
+import cv2
+from PIL import Image
+
+from atlas import DEFAULT_ATLAS_OPTIONS, TextureAtlas, save_atlas
+from encoders import COMPRESSIONS, DEFAULT_COMPRESSION, image_format
+from extraction import DEFAULT_WARP_QUALITY, WARP_QUALITIES, warp_source_quads
+from packing import PACKERS, PackingError
+from source_image import SourceImage, format_bytes
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp", ".npy")
+
+
+def load_quads(path):
+    """Read a quad file into {image path: [quad, ...]}, each quad being four (x, y) points.
+
+    JSON files map image paths to lists of quads, optionally under an "images" key;
+    a quad is either a list of four [x, y] pairs or an object with a "points" list.
+    CSV files have one quad per row: image,x1,y1,x2,y2,x3,y3,x4,y4 (a header row is allowed).
+    Relative image paths are resolved against the quad file's directory.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    quads = {}
+
+    if path.lower().endswith(".csv"):
+        with open(path, newline="") as f:
+            for line_number, row in enumerate(csv.reader(f), start=1):
+                if not row or row[0].strip().startswith("#"):
+                    continue
+                try:
+                    coords = [float(value) for value in row[1:]]
+                except ValueError:
+                    if line_number == 1:
+                        continue  # Header row
+                    raise ValueError(f"{path}:{line_number}: coordinates must be numbers")
+                if len(coords) != 8:
+                    raise ValueError(f"{path}:{line_number}: expected 8 coordinates, got {len(coords)}")
+                points = [(coords[i], coords[i + 1]) for i in range(0, 8, 2)]
+                quads.setdefault(row[0].strip(), []).append(points)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict) and isinstance(data.get("images"), dict):
+            data = data["images"]
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: expected an object mapping image paths to quads")
+        for name, entries in data.items():
+            for entry in entries:
+                points = entry["points"] if isinstance(entry, dict) else entry
+                if len(points) != 4:
+                    raise ValueError(f"{path}: quad for {name} needs exactly 4 points")
+                quads.setdefault(name, []).append([(float(x), float(y)) for x, y in points])
+
+    return {os.path.normpath(os.path.join(base_dir, name)): entries for name, entries in quads.items()}
+
+
+def collect_images(paths):
+    """Expand image files and folders from the command line into a list of image files."""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append(os.path.join(path, name))
+        else:
+            images.append(path)
+    return images
+
+
+def match_quads(images, quads):
+    """Pair each image with its quads, matching by full path first and file name second."""
+    by_name = {}
+    for quad_path, entries in quads.items():
+        by_name.setdefault(os.path.basename(quad_path), []).append(entries)
+
+    jobs = []
+    for image in images:
+        entries = quads.get(os.path.normpath(os.path.abspath(image)))
+        if entries is None:
+            candidates = by_name.get(os.path.basename(image), [])
+            entries = candidates[0] if len(candidates) == 1 else None
+        if entries:
+            jobs.append((image, entries))
+    return jobs
+
+
+def texture_name(stem, number):
+    """File name stem of an image's ``number``th texture (counting from 1), e.g. 'photo_001'."""
+    return f"{stem}_{number:03d}"
+
+
+def output_stems(jobs):
+    """Unique file name stems for the textures of each (image, quads) job, e.g. 'photo' for photo.png.
+
+    Images whose names share a stem (a/photo.png and b/photo.png, or photo.png and
+    photo.jpg) are named by their path below the folder they all share instead,
+    e.g. 'a_photo_png'. Raises ValueError if texture names still collide.
+    """
+    images = [image for image, _ in jobs]
+    stems = [os.path.splitext(os.path.basename(image))[0] for image in images]
+    paths = [os.path.abspath(image) for image in images]
+    try:
+        common_dir = os.path.commonpath([os.path.dirname(path) for path in paths])
+    except ValueError:
+        common_dir = None  # Different drives on Windows
+    shared = {stem for stem in stems if stems.count(stem) > 1}
+    for i, stem in enumerate(stems):
+        if stem in shared:
+            relative = os.path.relpath(paths[i], common_dir) if common_dir else paths[i]
+            stems[i] = re.sub(r"[^\w-]+", "_", relative).strip("_")
+
+    names = {}
+    for (image, entries), stem in zip(jobs, stems):
+        for number in range(1, len(entries) + 1):
+            name = texture_name(stem, number)
+            if name in names:
+                raise ValueError(f"{image} and {names[name]} would both write {name}.png")
+            names[name] = image
+    return stems
+
+
+def init_worker():
+    """Keep each worker process on one OpenCV thread; the pool already uses every core."""
+    cv2.setNumThreads(1)
+
+
+def extract_image(image_path, quads, out_dir, keep_textures, quality=DEFAULT_WARP_QUALITY, stem=None):
+    """Decode one image, warp all of its quads and write them out as ``{stem}_NNN.png``. Runs in a worker process."""
+    start = time.perf_counter()
+    source = SourceImage.open(image_path)
+    decoded = time.perf_counter()
+
+    # Each warp only reads the source around its quad, so memory-mapped images are never fully loaded
+    textures = warp_source_quads(source, quads, quality)
+    del source
+    warped = time.perf_counter()
+
+    if stem is None:
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+    outputs = []
+    for i, texture in enumerate(textures, start=1):
+        output_path = os.path.join(out_dir, texture_name(stem, i) + ".png")
+        Image.fromarray(texture).save(output_path)
+        outputs.append(output_path)
+    written = time.perf_counter()
+
+    return {
+        'image': image_path,
+        'outputs': outputs,
+        'textures': textures if keep_textures else None,
+        'decode': decoded - start,
+        'warp': warped - decoded,
+        'write': written - warped,
+        'total': written - start,
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="texture_ripper.py batch",
+                                     description="Extract textures from images without the GUI.")
+    parser.add_argument("images", nargs="*",
+                        help="Image files or folders (default: every image named in the quad file)")
+    parser.add_argument("-q", "--quads", required=True, help="JSON or CSV file with the quads for each image")
+    parser.add_argument("-o", "--out", required=True, help="Output folder for textures and the texture map")
+    parser.add_argument("--quality", choices=WARP_QUALITIES, default=DEFAULT_WARP_QUALITY,
+                        help="Resampling used for the warp; mipmap avoids aliasing on foreshortened quads "
+                             "(default: %(default)s)")
+    parser.add_argument("--atlas", default="texture_map.png",
+                        help="File name of the packed texture map inside --out; .png, .webp (lossless), .jpg or "
+                             ".dds (uncompressed) (default: %(default)s)")
+    parser.add_argument("--no-atlas", action="store_true", help="Only write the individual textures")
+    parser.add_argument("--packer", choices=list(PACKERS), default=DEFAULT_ATLAS_OPTIONS['method'],
+                        help="Texture map packing method (default: %(default)s)")
+    parser.add_argument("--padding", type=int, default=DEFAULT_ATLAS_OPTIONS['padding'],
+                        help="Free pixels around each texture in the texture map (default: %(default)s)")
+    parser.add_argument("--bleed", action="store_true", help="Fill the padding with repeated edge pixels")
+    parser.add_argument("--rotate", action="store_true", help="Allow textures to be rotated 90 degrees when packing")
+    size_group = parser.add_mutually_exclusive_group()
+    size_group.add_argument("--pot", action="store_true", help="Round the texture map size up to powers of two")
+    size_group.add_argument("--atlas-size", type=int, help="Use a fixed square texture map of this size")
+    parser.add_argument("--max-size", type=int, default=DEFAULT_ATLAS_OPTIONS['max_size'],
+                        help="Largest page size; bigger maps spill onto numbered pages, 0 for no limit "
+                             "(default: %(default)s)")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default=DEFAULT_COMPRESSION,
+                        help="Texture map encoding effort: fast saves quickest, smallest makes the smallest files "
+                             "(default: %(default)s)")
+    parser.add_argument("--alpha", action="store_true",
+                        help="Keep the texture map's unused space transparent (PNG, WebP and DDS)")
+    parser.add_argument("--binary-manifest", action="store_true",
+                        help="Also write the texture map manifest in compact binary form (.atlas)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: number of CPUs)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    try:
+        quads = load_quads(args.quads)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"error: failed to read quads: {e}", file=sys.stderr)
+        return 2
+
+    if not args.no_atlas:
+        try:
+            image_format(args.atlas)
+        except ValueError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+
+    images = collect_images(args.images) if args.images else sorted(quads)
+    jobs = match_quads(images, quads)
+    if not jobs:
+        print("error: no images with quads to extract", file=sys.stderr)
+        return 2
+    try:
+        stems = output_stems(jobs)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    os.makedirs(args.out, exist_ok=True)
+
+    keep_textures = not args.no_atlas
+    results = [None] * len(jobs)
+    failures = 0
+    start = time.perf_counter()
+
+    def report(index, result):
+        print(f"{os.path.basename(result['image'])}: {len(result['outputs'])} textures, "
+              f"decode {result['decode']:.2f}s, warp {result['warp']:.2f}s, "
+              f"write {result['write']:.2f}s, total {result['total']:.2f}s")
+        results[index] = result
+
+    workers = max(1, min(args.jobs, len(jobs)))
+    if workers == 1:
+        for index, (image, entries) in enumerate(jobs):
+            try:
+                report(index, extract_image(image, entries, args.out, keep_textures, args.quality, stems[index]))
+            except Exception as e:
+                failures += 1
+                print(f"{os.path.basename(image)}: failed: {e}", file=sys.stderr)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            futures = {pool.submit(extract_image, image, entries, args.out, keep_textures, args.quality,
+                                   stems[index]): index
+                       for index, (image, entries) in enumerate(jobs)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    report(index, future.result())
+                except Exception as e:
+                    failures += 1
+                    print(f"{os.path.basename(jobs[index][0])}: failed: {e}", file=sys.stderr)
+
+    extracted = [result for result in results if result is not None]
+    texture_count = sum(len(result['outputs']) for result in extracted)
+    elapsed = time.perf_counter() - start
+    print(f"Extracted {texture_count} textures from {len(extracted)} images in {elapsed:.2f}s "
+          f"({len(extracted) / elapsed:.2f} images/s, {workers} workers)")
+
+    if keep_textures and texture_count:
+        atlas_start = time.perf_counter()
+        # Keep the texture map in the same order as the quad file, whatever order workers finished in
+        textures = {}
+        sources = {}
+        for result, (image, entries) in zip(results, jobs):
+            if result is None:
+                continue
+            for output, texture, quad in zip(result['outputs'], result['textures'], entries):
+                key = os.path.splitext(os.path.basename(output))[0]
+                textures[key] = Image.fromarray(texture)
+                sources[key] = {'image': os.path.abspath(image), 'quad': quad}
+        atlas = TextureAtlas(method=args.packer, padding=args.padding, bleed=args.bleed, allow_rotation=args.rotate,
+                             power_of_two=args.pot, fixed_size=args.atlas_size, max_size=args.max_size or None)
+        try:
+            atlas.set_textures(textures)
+        except PackingError as e:
+            print(f"error: failed to pack the texture map: {e}", file=sys.stderr)
+            return 1
+        try:
+            saved = save_atlas(atlas, os.path.join(args.out, args.atlas), sources, binary=args.binary_manifest,
+                               compression=args.compression, alpha=args.alpha)
+        except ValueError as e:
+            print(f"error: failed to save the texture map: {e}", file=sys.stderr)
+            return 1
+        sizes = ", ".join(f"{page.width}x{page.height}" for page in atlas.pages)
+        manifests = ", ".join(saved['files'][len(atlas.pages):])
+        encode_time = sum(page['seconds'] for page in saved['pages'])
+        print(f"Texture map: {len(atlas.pages)} page(s) ({sizes}), {atlas.efficiency:.1%} packed, "
+              f"{format_bytes(saved['bytes'])} encoded in {encode_time:.2f}s, "
+              f"manifest {manifests} ({time.perf_counter() - atlas_start:.2f}s)")
+
+    return 1 if failures else 0
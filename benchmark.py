@@ -0,0 +1,449 @@
+"""Headless benchmarks: `python benchmark.py [NAME ...]`.
+
+Each benchmark builds its own synthetic input, so results are comparable between
+machines and runs without any test images.
+
+``suite`` times the GUI's hot paths without Tk over a grid of image sizes and
+selection counts, and can save its results as a baseline JSON or compare against
+one: `python benchmark.py suite --save-baseline base.json`, then later
+`python benchmark.py suite --baseline base.json` exits with 1 if a case got slower
+than the tolerance allows.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+
+import numpy as np
+
+from PIL import Image
+
+from atlas import TextureAtlas
+from curves import RemapCache, RemapGrid, curve_output_size, make_curve, warp_curve_preview, warp_source_curve
+from encoders import COMPRESSIONS, DEFAULT_COMPRESSION, encode_image, encoder_pool
+from extraction import (WARP_QUALITIES, _warp_supersampled, order_points, order_quads, quad_homography,
+                        quad_output_size, quad_output_sizes, warp_quad, warp_quad_preview, warp_source_quad,
+                        warp_source_quads)
+from pyramid import ImagePyramid, TileCache, TileRenderer
+from source_image import SourceImage, format_bytes, peak_rss_bytes
+
+BASELINE_VERSION = 1
+VIEWPORT = (1280, 800)  # Canvas size used for the display benchmarks
+
+
+def synthetic_image(width, height, seed=0):
+    """Fine checkerboard plus noise: the worst case for aliasing when minified."""
+    rng = np.random.default_rng(seed)
+    # Built from 8-bit row and column parities so 100 MP images do not need int64 coordinate grids
+    column_parity = (np.arange(width) // 2 % 2).astype(np.uint8)
+    row_parity = (np.arange(height) // 2 % 2).astype(np.uint8)
+    checker = (row_parity[:, None] ^ column_parity[None, :]) * np.uint8(160) + np.uint8(40)
+    pixels = np.repeat(checker[..., None], 3, axis=2)
+    pixels += rng.integers(0, 40, pixels.shape, dtype=np.uint8)
+    return pixels
+
+
+def foreshortened_quad(width, height):
+    """A floor-like trapezoid: wide at the bottom, narrow and far away at the top."""
+    return [(width * 0.42, height * 0.05), (width * 0.58, height * 0.05),
+            (width * 0.98, height * 0.95), (width * 0.02, height * 0.95)]
+
+
+def random_quads(width, height, count, seed=0, min_size=64, max_size=512):
+    """``count`` convex selections of 64-512 px, with jittered corners listed in a random order."""
+    rng = np.random.default_rng(seed)
+    quads = []
+    for _ in range(count):
+        quad_width = min(width - 2, rng.uniform(min_size, max_size))
+        quad_height = min(height - 2, rng.uniform(min_size, max_size))
+        x = rng.uniform(1, width - quad_width - 1)
+        y = rng.uniform(1, height - quad_height - 1)
+        corners = np.array([(x, y), (x + quad_width, y), (x + quad_width, y + quad_height), (x, y + quad_height)])
+        # Pull each corner inwards by up to 20% of the size, keeping the quad convex
+        inwards = np.array([(1, 1), (-1, 1), (-1, -1), (1, -1)])
+        corners += inwards * rng.uniform(0, 0.2, (4, 2)) * (quad_width, quad_height)
+        quads.append([tuple(point) for point in corners[rng.permutation(4)]])
+    return quads
+
+
+def time_call(function, repeat):
+    """Run ``function`` ``repeat`` times; returns (last result, list of seconds)."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def peak_allocation(function):
+    """Peak bytes allocated (numpy and OpenCV arrays included) while running ``function``."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_warp(args):
+    """Cost and accuracy of each warp quality on a strongly foreshortened quad."""
+    pixels = synthetic_image(args.width, args.height)
+    quad = foreshortened_quad(args.width, args.height)
+    pyramid_start = time.perf_counter()
+    levels = ImagePyramid(pixels).levels
+    pyramid_time = time.perf_counter() - pyramid_start
+
+    # Reference: heavy supersampling of the same quad
+    rect = order_points(np.array(quad, dtype=np.float32))
+    width, height = quad_output_size(rect)
+    inverse = np.linalg.inv(quad_homography(rect, width, height))
+    reference = _warp_supersampled(pixels, inverse, width, height, max_factor=8).astype(np.float32)
+
+    print(f"warp: {args.width}x{args.height} source -> {width}x{height} texture, "
+          f"pyramid built once in {pyramid_time * 1000:.0f} ms")
+    print(f"{'quality':<12} {'median ms':>10} {'min ms':>8} {'RMSE':>7}")
+    for quality in WARP_QUALITIES:
+        texture, times = time_call(lambda: warp_quad(pixels, quad, quality, levels), args.repeat)
+        error = np.sqrt(np.mean((texture.astype(np.float32) - reference) ** 2))
+        print(f"{quality:<12} {statistics.median(times) * 1000:>10.1f} {min(times) * 1000:>8.1f} {error:>7.2f}")
+
+
+def bench_preview(args, frames=200, budget_ms=16.0):
+    """Per-frame cost of the live drag preview against the one-frame budget."""
+    pixels = synthetic_image(args.width, args.height)
+    levels = ImagePyramid(pixels).levels
+    quad = [(args.width * 0.1, args.height * 0.1), (args.width * 0.9, args.height * 0.15),
+            (args.width * 0.85, args.height * 0.9), (args.width * 0.15, args.height * 0.85)]
+    _, full_times = time_call(lambda: warp_quad(pixels, quad), args.repeat)
+
+    # Sweep one corner around like a drag
+    times = []
+    for frame in range(frames):
+        angle = 2 * np.pi * frame / frames
+        dragged = list(quad)
+        dragged[2] = (quad[2][0] + np.cos(angle) * args.width * 0.05, quad[2][1] + np.sin(angle) * args.height * 0.05)
+        start = time.perf_counter()
+        warp_quad_preview(levels, dragged, 200, 200)
+        times.append(time.perf_counter() - start)
+
+    times_ms = np.array(times) * 1000
+    print(f"preview: {args.width}x{args.height} source, {frames} drag frames into 200x200")
+    print(f"  median {np.median(times_ms):.2f} ms, p95 {np.percentile(times_ms, 95):.2f} ms, "
+          f"max {times_ms.max():.2f} ms (budget {budget_ms:.0f} ms); "
+          f"full-resolution warp {statistics.median(full_times) * 1000:.0f} ms")
+
+
+def bench_roi(args, coverages=(0.01, 0.05, 0.25, 1.0)):
+    """Full-frame extraction (convert the whole photo to RGB, warp it all) against warping only the quad's window."""
+    # Decoded photos are BGR, as cv2.imdecode returns them
+    source = SourceImage(synthetic_image(args.width, args.height), bgr=True)
+
+    def full_frame(quad):
+        return warp_quad(cv2.cvtColor(source.pixels, cv2.COLOR_BGR2RGB), quad)
+
+    print(f"roi: {args.width}x{args.height} source, bilinear")
+    print(f"{'coverage':>8} {'texture':>11} {'full ms':>8} {'roi ms':>7} {'speedup':>8} {'full peak':>10} {'roi peak':>10}")
+    for coverage in coverages:
+        # Centred quad, slightly skewed, covering about ``coverage`` of the photo
+        half_w, half_h = args.width * coverage ** 0.5 / 2, args.height * coverage ** 0.5 / 2
+        cx, cy = args.width / 2, args.height / 2
+        quad = [(cx - half_w * 0.9, cy - half_h), (cx + half_w * 0.9, cy - half_h * 0.95),
+                (cx + half_w - 1, cy + half_h - 1), (cx - half_w, cy + half_h - 1)]
+        texture, full_times = time_call(lambda: full_frame(quad), args.repeat)
+        _, roi_times = time_call(lambda: warp_source_quad(source, quad), args.repeat)
+        full_ms, roi_ms = statistics.median(full_times) * 1000, statistics.median(roi_times) * 1000
+        full_peak = peak_allocation(lambda: full_frame(quad))
+        roi_peak = peak_allocation(lambda: warp_source_quad(source, quad))
+        size = f"{texture.shape[1]}x{texture.shape[0]}"
+        print(f"{coverage:>8.0%} {size:>11} {full_ms:>8.1f} {roi_ms:>7.1f} {full_ms / roi_ms:>7.1f}x "
+              f"{format_bytes(full_peak):>10} {format_bytes(roi_peak):>10}")
+
+
+def bench_curves(args, shapes=('straight', 'bezier', 'mesh 4x1', 'mesh 4x4')):
+    """Curved selections: building the lookup grid, warping through the cached grid, and the drag preview."""
+    source = SourceImage(synthetic_image(args.width, args.height), bgr=True)
+    pyramid = ImagePyramid(source.pixels, bgr=True)
+    quad = foreshortened_quad(args.width, args.height)
+
+    print(f"curves: {args.width}x{args.height} source, bilinear")
+    print(f"{'shape':>10} {'texture':>11} {'grid ms':>8} {'cached ms':>10} {'preview ms':>11} {'grid size':>10}")
+    for shape in shapes:
+        points, curve = make_curve(quad, None, shape)
+        size = curve_output_size(points, curve)
+        grids, grid_times = time_call(lambda: RemapGrid(points, curve, *size), args.repeat)
+        cache = RemapCache()
+        warp_source_curve(source, points, curve, cache=cache, owner=0)
+        _, cached_times = time_call(lambda: warp_source_curve(source, points, curve, cache=cache, owner=0),
+                                    args.repeat)
+        _, preview_times = time_call(lambda: warp_curve_preview(pyramid.levels, points, curve, 200, 200, True),
+                                     args.repeat * 10)
+        print(f"{shape:>10} {f'{size[0]}x{size[1]}':>11} {statistics.median(grid_times) * 1000:>8.1f} "
+              f"{statistics.median(cached_times) * 1000:>10.1f} {statistics.median(preview_times) * 1000:>11.2f} "
+              f"{format_bytes(grids.nbytes):>10}")
+
+
+def bench_encode(args, count=200):
+    """Saving a texture map page: Pillow's default PNG save against each format and compression setting."""
+    source = SourceImage(synthetic_image(args.width, args.height), bgr=True)
+    textures = {key: Image.fromarray(warp_source_quad(source, quad))
+                for key, quad in enumerate(random_quads(args.width, args.height, count))}
+    atlas = TextureAtlas()
+    atlas.set_textures(textures)
+    page = atlas.render_page(0)
+    raw_bytes = page.width * page.height * 3
+
+    def pillow_png():
+        output = io.BytesIO()
+        page.save(output, format='PNG')
+        return output.getvalue()
+
+    cases = [("pillow png", pillow_png)]
+    with encoder_pool() as pool:
+        for image_format in ('png', 'webp', 'jpeg', 'dds'):
+            for compression in COMPRESSIONS if image_format != 'dds' else [DEFAULT_COMPRESSION]:
+                cases.append((f"{image_format} {compression}" if image_format != 'dds' else "dds",
+                              lambda image_format=image_format, compression=compression:
+                              encode_image(page, image_format, compression, pool)))
+
+        print(f"encode: {page.width}x{page.height} page of {count} textures, {os.cpu_count() or 1} threads")
+        print(f"{'encoder':>18} {'ms':>8} {'MB/s':>7} {'size':>10} {'ratio':>6}")
+        for name, encode in cases:
+            data, times = time_call(encode, args.repeat)
+            seconds = statistics.median(times)
+            print(f"{name:>18} {seconds * 1000:>8.1f} {raw_bytes / seconds / 1e6:>7.1f} "
+                  f"{format_bytes(len(data)):>10} {raw_bytes / len(data):>5.2f}x")
+
+
+def reset_peak_rss():
+    """Restart the process's peak RSS count (Linux only), so each suite case reports its own peak."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def case_peak_rss():
+    """Peak RSS since the last ``reset_peak_rss``, or of the whole process where it cannot be reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return peak_rss_bytes()
+
+
+def run_case(results, name, calls, rounds, unit, per_call=1, setup=None):
+    """Time every function in ``calls`` for ``rounds`` rounds and record the case in ``results``.
+
+    Each call handles ``per_call`` ``unit``s; ``setup`` runs untimed before every call.
+    Latency percentiles are per call, throughput is units per second of timed work.
+    """
+    reset_peak_rss()
+    times = []
+    for _ in range(rounds):
+        for call in calls:
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+
+    times_ms = np.array(times) * 1000
+    results[name] = {
+        'unit': unit,
+        'samples': len(times),
+        'throughput': len(times) * per_call / max(sum(times), 1e-9),
+        'p50_ms': float(np.percentile(times_ms, 50)),
+        'p95_ms': float(np.percentile(times_ms, 95)),
+        'p99_ms': float(np.percentile(times_ms, 99)),
+        'peak_rss': case_peak_rss(),
+    }
+    case = results[name]
+    print(f"{name:<28} {case['samples']:>7} {case['throughput']:>11.1f} {unit + '/s':<9} {case['p50_ms']:>9.2f} "
+          f"{case['p95_ms']:>9.2f} {case['p99_ms']:>9.2f} {format_bytes(case['peak_rss']):>10}", flush=True)
+
+
+def render_viewport(pyramid, scale):
+    """Render every tile a VIEWPORT-sized canvas shows at ``scale``, from a cold tile cache, like display_image."""
+    renderer = TileRenderer(pyramid, TileCache())
+    for tx, ty in renderer.visible_tiles(scale, 0, 0, *VIEWPORT):
+        renderer.render_tile(scale, tx, ty)
+
+
+def suite_textures(count, seed=0):
+    """Flat-colour textures the size of ``count`` random selections, standing in for extracted ones."""
+    rng = np.random.default_rng(seed)
+    textures = {}
+    for key, quad in enumerate(random_quads(4000, 3000, count, seed)):
+        size = quad_output_size(order_points(np.array(quad, dtype=np.float32)))
+        textures[key] = Image.new('RGB', size, tuple(int(value) for value in rng.integers(0, 256, 3)))
+    return textures
+
+
+def image_cases(results, args, megapixels):
+    """Loading, display and extraction on one synthetic image."""
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(width * 3 / 4))
+    source = SourceImage(synthetic_image(width, height), bgr=True)
+    label = f"{megapixels:g}MP"
+
+    pyramids = []
+    run_case(results, f"load/{label}", [lambda: pyramids.append(ImagePyramid(source.pixels, bgr=True))],
+             args.repeat, "images", setup=pyramids.clear)
+    pyramid = pyramids[-1]
+    fit_scale = min(VIEWPORT[0] / width, VIEWPORT[1] / height)
+    run_case(results, f"display_image/{label}/fit", [lambda: render_viewport(pyramid, fit_scale)],
+             args.repeat, "frames")
+    run_case(results, f"display_image/{label}/1:1", [lambda: render_viewport(pyramid, 1.0)], args.repeat, "frames")
+
+    for count in args.quads:
+        quads = random_quads(width, height, count)
+        run_case(results, f"extract/{label}/{count}q", [lambda quad=quad: warp_source_quad(source, quad)
+                                                        for quad in quads], args.repeat, "quads")
+        # Extract All: every quad in one call, warped on a thread per core
+        with ThreadPoolExecutor() as pool:
+            run_case(results, f"extract_all/{label}/{count}q",
+                     [lambda: warp_source_quads(source, quads, executor=pool)], args.repeat, "quads", per_call=count)
+
+
+def map_cases(results, args, count):
+    """Ordering points, packing the map and drawing its preview for ``count`` selections."""
+    quads = [np.array(quad, dtype=np.float32) for quad in random_quads(4000, 3000, count)]
+    run_case(results, f"order_points/{count}q", [lambda: [order_points(quad) for quad in quads]],
+             max(args.repeat, 1000 // count), "quads", per_call=count)
+    run_case(results, f"order_quads/{count}q", [lambda: quad_output_sizes(order_quads(quads))],
+             max(args.repeat, 1000 // count), "quads", per_call=count)
+
+    textures = suite_textures(count)
+    atlas = TextureAtlas()
+    run_case(results, f"update_map/{count}q", [lambda: atlas.set_textures(textures)], args.repeat, "maps")
+    run_case(results, f"display_map/{count}q", [lambda: atlas.thumbnail(0, 400, 400)], args.repeat, "maps",
+             setup=atlas.repack)
+
+    # Re-extracting one selection: it keeps its slot, and only its region of the preview is redrawn
+    key = count // 2
+    atlas.thumbnail(0, 400, 400)
+    page_index = atlas.slots[key][0]
+
+    def update_one():
+        atlas.set_texture(key, textures[key].copy())
+        atlas.thumbnail(page_index, 400, 400)
+
+    run_case(results, f"update_one/{count}q", [update_one], max(args.repeat, 20), "maps")
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def compare_baseline(results, baseline, tolerance):
+    """Print each case's median latency against the baseline; returns the names of cases that got slower."""
+    if baseline.get('machine') != machine_info():
+        print("note: the baseline was recorded on a different machine or library versions")
+    print(f"\n{'case':<28} {'baseline ms':>12} {'now ms':>9} {'change':>8}")
+    regressions = []
+    for name, case in results.items():
+        before = baseline.get('cases', {}).get(name)
+        if before is None:
+            print(f"{name:<28} {'-':>12} {case['p50_ms']:>9.2f}      new")
+            continue
+        change = case['p50_ms'] / max(before['p50_ms'], 1e-9) - 1
+        verdict = ""
+        if change > tolerance:
+            verdict = "  SLOWER"
+            regressions.append(name)
+        print(f"{name:<28} {before['p50_ms']:>12.2f} {case['p50_ms']:>9.2f} {change:>+8.0%}{verdict}")
+    return regressions
+
+
+def bench_suite(args):
+    """Headless timings of the GUI's hot paths, optionally saved as or checked against a baseline."""
+    print(f"suite: {', '.join(f'{mp:g} MP' for mp in args.megapixels)} images, "
+          f"{', '.join(map(str, args.quads))} selections, {args.repeat} rounds")
+    print(f"{'case':<28} {'samples':>7} {'throughput':>21} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak RSS':>10}")
+    results = {}
+    for megapixels in args.megapixels:
+        image_cases(results, args, megapixels)
+    for count in args.quads:
+        map_cases(results, args, count)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != BASELINE_VERSION:
+            print(f"error: unsupported baseline version {baseline.get('version')!r}", file=sys.stderr)
+            return 2
+        regressions = compare_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} case(s) more than {args.tolerance:.0%} slower than the baseline")
+            status = 1
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({'version': BASELINE_VERSION, 'machine': machine_info(), 'repeat': args.repeat,
+                       'cases': results}, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    return status
+
+
+BENCHMARKS = {
+    'warp': bench_warp,
+    'preview': bench_preview,
+    'roi': bench_roi,
+    'curves': bench_curves,
+    'encode': bench_encode,
+    'suite': bench_suite,
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark Texture Ripper's hot paths without the GUI.")
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--width", type=int, default=4000, help="Synthetic source width (default: %(default)s)")
+    parser.add_argument("--height", type=int, default=3000, help="Synthetic source height (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (default: %(default)s)")
+    suite = parser.add_argument_group("suite")
+    suite.add_argument("--megapixels", type=float, nargs="+", default=[1, 12],
+                       help="Synthetic image sizes, e.g. 1 12 100 (default: %(default)s)")
+    suite.add_argument("--quads", type=int, nargs="+", default=[1, 50, 500],
+                       help="Selection counts (default: %(default)s)")
+    suite.add_argument("--baseline", help="Compare against a baseline saved with --save-baseline; "
+                                          "exits with 1 if a case is slower than --tolerance allows")
+    suite.add_argument("--save-baseline", metavar="FILE", help="Save the results as a baseline JSON")
+    suite.add_argument("--tolerance", type=float, default=0.25,
+                       help="Allowed median slowdown against the baseline (default: %(default)s, i.e. 25%%)")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark {unknown[0]!r}, expected one of {', '.join(BENCHMARKS)}")
+    if min(args.megapixels) <= 0 or min(args.quads) < 1:
+        parser.error("--megapixels and --quads must be positive")
+
+    status = 0
+    for name in args.names or BENCHMARKS:
+        status = max(status, BENCHMARKS[name](args) or 0)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,395 @@
+"""Curved selections: quads whose edges are Bezier curves, or NxM control meshes.
+
+A curved selection keeps its four corners in the selection set's 'points', in the
+order top-left, top-right, bottom-right, bottom-left, and the rest in a 'curve' dict:
+
+- {'kind': 'bezier', 'handles': 8 points}: two cubic Bezier handles per edge, going
+  around the quad (top left to right, right top to bottom, bottom right to left,
+  left bottom to top). The inside is the Coons patch of the four edge curves.
+- {'kind': 'mesh', 'columns': C, 'rows': R, 'points': (R + 1) * (C + 1) points}: a
+  grid of points on the surface, row by row, whose corners are the set's 'points'.
+  The surface passes through every grid point (Catmull-Rom in both directions).
+
+Extraction maps every texture pixel to a source position through a dense lookup
+grid and samples the source with one cv2.remap. Building the grid is most of the
+cost, so grids are cached (``RemapCache``) and only rebuilt when a control point moves.
+"""
+from collections import OrderedDict
+import threading
+
+import cv2
+import numpy as np
+
+from extraction import INTERPOLATION_FLAGS, ROI_MARGINS, WARP_QUALITIES, order_points
+from profiling import PROFILER
+
+# Shapes offered for a selection; meshes are columns x rows
+CURVE_SHAPES = ['straight', 'bezier', 'mesh 2x1', 'mesh 3x1', 'mesh 4x1', 'mesh 1x2', 'mesh 2x2', 'mesh 3x3',
+                'mesh 4x4']
+EDGE_SAMPLES = 64  # Points sampled along each edge to measure its length
+GRID_BAND_PIXELS = 1 << 20  # Texture pixels evaluated at a time while building a grid, to bound temporaries
+MAX_SUPERSAMPLE = 4  # Largest factor 'mipmap' and 'supersample' render curved selections at
+REMAP_CACHE_BYTES = 256 * 1024 * 1024
+
+_UNIT_SQUARE = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float32)
+
+
+def parse_shape(shape):
+    """(kind, columns, rows) of a shape name like those in CURVE_SHAPES, e.g. ('mesh', 3, 1) for 'mesh 3x1'.
+
+    Kind is None for 'straight'; meshes may have any number of columns and rows.
+    """
+    if shape in ('straight', 'bezier'):
+        return (None if shape == 'straight' else shape), 1, 1
+    try:
+        columns, rows = (int(value) for value in shape[len('mesh '):].split('x'))
+    except ValueError:
+        columns = rows = 0
+    if not shape.startswith('mesh ') or columns < 1 or rows < 1:
+        raise ValueError(f"Unknown shape {shape!r}, expected one of {', '.join(CURVE_SHAPES)}")
+    return 'mesh', columns, rows
+
+
+def curve_shape(curve):
+    """CURVE_SHAPES name of a set's 'curve'."""
+    if curve is None:
+        return 'straight'
+    if curve['kind'] == 'mesh':
+        return f"mesh {curve['columns']}x{curve['rows']}"
+    return curve['kind']
+
+
+def curve_handles(curve):
+    """The curve's own control points, which the GUI lets the user drag (corners excluded).
+
+    Returns (index into the curve's point list, point) pairs.
+    """
+    if curve is None:
+        return []
+    if curve['kind'] == 'bezier':
+        return list(enumerate(curve['handles']))
+    columns = curve['columns']
+    corners = {0, columns, len(curve['points']) - 1 - columns, len(curve['points']) - 1}
+    return [(i, point) for i, point in enumerate(curve['points']) if i not in corners]
+
+
+def move_handle(curve, i, point):
+    """Move control point ``i`` of a curve (see ``curve_handles``)."""
+    curve['handles' if curve['kind'] == 'bezier' else 'points'][i] = tuple(point)
+
+
+def copy_curve(curve):
+    """Copy of a curve whose point lists can be edited without touching the original."""
+    if curve is None:
+        return None
+    return {name: list(value) if isinstance(value, list) else value for name, value in curve.items()}
+
+
+def curve_key(points, curve):
+    """Hashable description of a selection's geometry, for caches."""
+    values = tuple(value for point in points for value in point)
+    if curve is None:
+        return values
+    control = curve['handles'] if curve['kind'] == 'bezier' else curve['points']
+    return (curve_shape(curve),) + values + tuple(value for point in control for value in point)
+
+
+def _bezier(p0, p1, p2, p3, t):
+    """Points of a cubic Bezier curve at parameters ``t`` (N,) as an (N, 2) array."""
+    t = t[:, None]
+    s = 1 - t
+    return s ** 3 * p0 + 3 * s * s * t * p1 + 3 * s * t * t * p2 + t ** 3 * p3
+
+
+def _catmull_rom_weights(t, count):
+    """(N, count) weights of ``count`` control points for a Catmull-Rom curve through them at ``t`` in [0, 1].
+
+    The curve is extended past its ends by mirroring the neighbouring point, so two
+    control points give a straight line.
+    """
+    s = np.asarray(t, dtype=np.float64) * (count - 1)
+    segment = np.clip(np.floor(s).astype(int), 0, count - 2)
+    f = s - segment
+    f2, f3 = f * f, f * f * f
+    basis = [(-f3 + 2 * f2 - f) / 2, (3 * f3 - 5 * f2 + 2) / 2, (-3 * f3 + 4 * f2 + f) / 2, (f3 - f2) / 2]
+
+    weights = np.zeros((len(s), count))
+    rows = np.arange(len(s))
+    for offset, weight in zip((-1, 0, 1, 2), basis):
+        index = segment + offset
+        # Mirrored points outside the grid: P[-1] = 2 P[0] - P[1] and P[n + 1] = 2 P[n] - P[n - 1]
+        before, after = index < 0, index >= count
+        inside = ~(before | after)
+        np.add.at(weights, (rows[inside], index[inside]), weight[inside])
+        np.add.at(weights, (rows[before], 0), 2 * weight[before])
+        np.add.at(weights, (rows[before], 1), -weight[before])
+        np.add.at(weights, (rows[after], count - 1), 2 * weight[after])
+        np.add.at(weights, (rows[after], count - 2), -weight[after])
+    return weights
+
+
+def mesh_grid(points, curve):
+    """(rows + 1, columns + 1, 2) control grid of a mesh, with its corners taken from ``points``."""
+    columns, rows = curve['columns'], curve['rows']
+    grid = np.array(curve['points'], dtype=np.float64).reshape(rows + 1, columns + 1, 2)
+    grid[0, 0], grid[0, columns], grid[rows, columns], grid[rows, 0] = np.array(points, dtype=np.float64)
+    return grid
+
+
+def surface_planes(points, curve, u, v):
+    """Source x and y of the selection at texture coordinates ``u`` (W,) x ``v`` (H,) in [0, 1], each (H, W).
+
+    Straight selections follow the perspective of the quad; curved ones their patch.
+    Every patch is a sum of products of a function of v and a function of u, so each
+    plane is one small matrix product rather than a pass per term over every pixel.
+    """
+    u = np.asarray(u, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    if curve is None:
+        rect = order_points(np.array(points, dtype=np.float32))
+        M = cv2.getPerspectiveTransform(_UNIT_SQUARE, rect)
+        w = np.add.outer(M[2, 1] * v, M[2, 0] * u) + M[2, 2]
+        return tuple((np.add.outer(M[row, 1] * v, M[row, 0] * u) + M[row, 2]) / w for row in (0, 1))
+
+    if curve['kind'] == 'mesh':
+        grid = mesh_grid(points, curve)
+        across = _catmull_rom_weights(u, curve['columns'] + 1)  # (W, C + 1)
+        down = _catmull_rom_weights(v, curve['rows'] + 1)  # (H, R + 1)
+        return tuple(down @ grid[..., axis] @ across.T for axis in (0, 1))
+
+    # Coons patch: blend opposite edge curves, minus the bilinear blend of the corners
+    tl, tr, br, bl = np.array(points, dtype=np.float64)
+    h = np.array(curve['handles'], dtype=np.float64)
+    top = _bezier(tl, h[0], h[1], tr, u)
+    bottom = _bezier(br, h[4], h[5], bl, 1 - u)
+    right = _bezier(tr, h[2], h[3], br, v)
+    left = _bezier(bl, h[6], h[7], tl, 1 - v)
+    planes = []
+    for axis in (0, 1):
+        of_v = np.stack([1 - v, v, left[:, axis], right[:, axis], 1 - v, v], axis=1)
+        of_u = np.stack([top[:, axis], bottom[:, axis], 1 - u, u,
+                         -(1 - u) * tl[axis] - u * tr[axis], -(1 - u) * bl[axis] - u * br[axis]])
+        planes.append(of_v @ of_u)
+    return tuple(planes)
+
+
+def surface_points(points, curve, u, v):
+    """``surface_planes`` as one (H, W, 2) array of source positions."""
+    return np.stack(surface_planes(points, curve, u, v), axis=-1)
+
+
+def make_curve(points, curve, shape):
+    """Reshape a selection as ``shape`` (a CURVE_SHAPES name), keeping its current outline.
+
+    Returns the new (points, curve); a straight selection's corners are put in
+    top-left, top-right, bottom-right, bottom-left order first.
+    """
+    kind, columns, rows = parse_shape(shape)
+    if curve is None:
+        points = [tuple(float(value) for value in point) for point in order_points(np.array(points, dtype=np.float32))]
+    if kind is None:
+        return points, None
+
+    if kind == 'mesh':
+        grid = surface_points(points, curve, np.linspace(0, 1, columns + 1), np.linspace(0, 1, rows + 1))
+        return points, {'kind': 'mesh', 'columns': columns, 'rows': rows,
+                        'points': [tuple(point) for point in grid.reshape(-1, 2).tolist()]}
+
+    # Bezier handles that make each edge pass through the current edge at 1/3 and 2/3 of the way
+    thirds = np.array([1 / 3, 2 / 3])
+    edges = [surface_points(points, curve, thirds, [0])[0], surface_points(points, curve, [1], thirds)[:, 0],
+             surface_points(points, curve, thirds[::-1], [1])[0], surface_points(points, curve, [0], thirds[::-1])[:, 0]]
+    corners = np.array(points, dtype=np.float64)
+    handles = []
+    for edge, (q1, q2) in enumerate(edges):
+        p0, p3 = corners[edge], corners[(edge + 1) % 4]
+        handles.append(tuple(((-5 * p0 + 18 * q1 - 9 * q2 + 2 * p3) / 6).tolist()))
+        handles.append(tuple(((2 * p0 - 9 * q1 + 18 * q2 - 5 * p3) / 6).tolist()))
+    return points, {'kind': 'bezier', 'handles': handles}
+
+
+def curve_output_size(points, curve):
+    """Size of the texture for a selection: the lengths of its longest opposing edges."""
+    t = np.linspace(0, 1, EDGE_SAMPLES)
+
+    def length(edge):
+        return np.sqrt(((edge[1:] - edge[:-1]) ** 2).sum(axis=-1)).sum()
+
+    top, bottom = surface_points(points, curve, t, [0, 1])
+    left, right = surface_points(points, curve, [0, 1], t).transpose(1, 0, 2)
+    return max(1, int(max(length(top), length(bottom)))), max(1, int(max(length(left), length(right))))
+
+
+def curve_outline(points, curve, samples=EDGE_SAMPLES):
+    """Source positions around the selection's edge, clockwise from the top-left corner."""
+    t = np.linspace(0, 1, samples)
+    top, bottom = surface_points(points, curve, t, [0, 1])
+    left, right = surface_points(points, curve, [0, 1], t).transpose(1, 0, 2)
+    return np.concatenate([top, right[1:], bottom[::-1][1:], left[::-1][1:]])
+
+
+def curve_polylines(points, curve, samples=EDGE_SAMPLES):
+    """Source-space polylines that draw a curved selection: its outline, then its inner
+    mesh lines or the arms from corners to Bezier handles."""
+    lines = [curve_outline(points, curve, samples)]
+    t = np.linspace(0, 1, samples)
+    if curve['kind'] == 'mesh':
+        columns, rows = curve['columns'], curve['rows']
+        for column in range(1, columns):
+            lines.append(surface_points(points, curve, [column / columns], t)[:, 0])
+        for row in range(1, rows):
+            lines.append(surface_points(points, curve, t, [row / rows])[0])
+    else:
+        for edge in range(4):
+            start, end = np.array(points[edge]), np.array(points[(edge + 1) % 4])
+            lines.append(np.array([start, curve['handles'][2 * edge]]))
+            lines.append(np.array([end, curve['handles'][2 * edge + 1]]))
+    return lines
+
+
+def _supersample_factor(points, curve, width, height):
+    """How much finer than the texture to sample a curved selection so minified areas do not alias."""
+    grid = surface_points(points, curve, np.linspace(0, 1, 17), np.linspace(0, 1, 17))
+    step_x = np.sqrt((np.diff(grid, axis=1) ** 2).sum(axis=-1)).max() * 16 / max(width - 1, 1)
+    step_y = np.sqrt((np.diff(grid, axis=0) ** 2).sum(axis=-1)).max() * 16 / max(height - 1, 1)
+    footprint = max(step_x, step_y, 1.0)
+    return int(min(MAX_SUPERSAMPLE, 2 ** int(np.ceil(np.log2(footprint)))))
+
+
+class RemapGrid:
+    """Lookup grid of a selection: for each texture pixel, where to sample the source window.
+
+    ``window`` is the (x0, y0, x1, y1) source area the grid reads; the maps are
+    relative to its top-left corner, in OpenCV's fixed-point form for a faster remap.
+    """
+
+    def __init__(self, points, curve, width, height, quality='bilinear'):
+        self.width, self.height = width, height
+        self.factor = _supersample_factor(points, curve, width, height) if quality not in INTERPOLATION_FLAGS else 1
+        grid_width, grid_height = width * self.factor, height * self.factor
+        # Sample positions at texture pixel centres, the texture's outer pixels on the selection's edges
+        k = self.factor
+        u = np.clip((np.arange(grid_width) + 0.5) / k - 0.5, 0, width - 1) / max(width - 1, 1)
+        v = np.clip((np.arange(grid_height) + 0.5) / k - 0.5, 0, height - 1) / max(height - 1, 1)
+
+        map_x = np.empty((grid_height, grid_width), dtype=np.float32)
+        map_y = np.empty((grid_height, grid_width), dtype=np.float32)
+        band = max(1, GRID_BAND_PIXELS // grid_width)
+        for start in range(0, grid_height, band):
+            map_x[start:start + band], map_y[start:start + band] = surface_planes(points, curve, u,
+                                                                                  v[start:start + band])
+
+        margin = ROI_MARGINS.get(quality, 2)
+        x0 = max(0, int(np.floor(map_x.min())) - margin)
+        y0 = max(0, int(np.floor(map_y.min())) - margin)
+        self.window = (x0, y0, int(np.ceil(map_x.max())) + margin + 1, int(np.ceil(map_y.max())) + margin + 1)
+        map_x -= x0
+        map_y -= y0
+        # Nearest sampling needs no sub-pixel table, so its second map is None
+        self.maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=quality == 'nearest')
+        self.nbytes = sum(part.nbytes for part in self.maps if part is not None)
+
+    def warp(self, pixels, quality='bilinear'):
+        """Sample the source window ``pixels`` (read at ``window``) into the texture."""
+        if pixels.size == 0:
+            return np.zeros((self.height, self.width, 3), dtype=np.uint8)  # The selection is outside the image
+        flags = INTERPOLATION_FLAGS.get(quality, cv2.INTER_LINEAR)
+        texture = cv2.remap(pixels, self.maps[0], self.maps[1], flags)
+        if self.factor > 1:
+            texture = cv2.resize(texture, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        return texture
+
+
+class RemapCache:
+    """Lookup grids by owner (e.g. a selection set), each rebuilt only when its geometry changes.
+
+    Holds one grid per owner; the least recently used are dropped beyond a memory
+    budget. Safe to use from several threads.
+    """
+
+    def __init__(self, max_bytes=REMAP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.grids = OrderedDict()  # owner -> (key, RemapGrid), least recently used first
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.grids)
+
+    def get(self, owner, points, curve, width, height, quality):
+        """The owner's grid for this geometry, building it if the cached one is for other control points."""
+        key = (curve_key(points, curve), width, height, quality)
+        with self.lock:
+            entry = self.grids.get(owner)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                self.grids.move_to_end(owner)
+                return entry[1]
+        # Build outside the lock so other selections can be extracted meanwhile
+        grid = RemapGrid(points, curve, width, height, quality)
+        with self.lock:
+            self.misses += 1
+            previous = self.grids.pop(owner, None)
+            if previous is not None:
+                self.nbytes -= previous[1].nbytes
+            self.grids[owner] = (key, grid)
+            self.nbytes += grid.nbytes
+            while self.nbytes > self.max_bytes and len(self.grids) > 1:
+                _, (_, evicted) = self.grids.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return grid
+
+    def clear(self):
+        with self.lock:
+            self.grids.clear()
+            self.nbytes = 0
+
+
+def warp_source_curve(source, points, curve, quality='bilinear', cache=None, owner=None):
+    """Extract a curved selection from a SourceImage, reading only the source window around it.
+
+    With a ``cache``, the lookup grid is kept under ``owner`` and reused until the
+    selection's control points move.
+    """
+    if quality not in WARP_QUALITIES:
+        raise ValueError(f"Unknown warp quality {quality!r}, expected one of {', '.join(WARP_QUALITIES)}")
+    width, height = curve_output_size(points, curve)
+    if cache is not None:
+        grid = cache.get(owner, points, curve, width, height, quality)
+    else:
+        grid = RemapGrid(points, curve, width, height, quality)
+    region = source.read_region(*grid.window)
+    texture = grid.warp(region, quality)
+    PROFILER.count("warp bytes", region.nbytes + texture.nbytes)
+    return texture
+
+
+def warp_curve_preview(levels, points, curve, max_width, max_height, bgr=False):
+    """Quick low-resolution RGB warp of a curved selection, fitted into max_width x max_height.
+
+    Like ``warp_quad_preview``, samples the coarsest pyramid level that still has a
+    pixel per preview pixel; the small grid is cheap enough to build on every frame.
+    """
+    width, height = curve_output_size(points, curve)
+    scale = min(max_width / width, max_height / height, 1.0)
+    out_width, out_height = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    level = 0 if scale >= 1 else min(int(np.floor(np.log2(1 / scale))), len(levels) - 1)
+
+    x, y = surface_planes(points, curve, np.linspace(0, 1, out_width), np.linspace(0, 1, out_height))
+    # Level pixel centres: full-image pixel x lands at (x + 0.5) / 2**level - 0.5
+    scale = 0.5 ** level
+    x = ((x + 0.5) * scale - 0.5).astype(np.float32)
+    y = ((y + 0.5) * scale - 0.5).astype(np.float32)
+
+    # Only read the part of the level under the selection
+    pixels = levels[level]
+    height, width = pixels.shape[:2]
+    x0 = int(np.clip(np.floor(x.min()) - 2, 0, width - 1))
+    y0 = int(np.clip(np.floor(y.min()) - 2, 0, height - 1))
+    x1 = int(np.clip(np.ceil(x.max()) + 3, x0 + 1, width))
+    y1 = int(np.clip(np.ceil(y.max()) + 3, y0 + 1, height))
+    window = np.ascontiguousarray(pixels[y0:y1, x0:x1])
+    preview = cv2.remap(window, x - x0, y - y0, cv2.INTER_LINEAR)
+    return cv2.cvtColor(preview, cv2.COLOR_BGR2RGB) if bgr else preview
@@ -0,0 +1,218 @@
+"""Encoding texture map pages to files, with a choice of format, compression effort and alpha.
+
+The format follows the file extension: PNG, lossless WebP, JPEG or an uncompressed
+DDS (32-bit BGRA, readable by most engines and texture tools as is). Compression
+is 'fast', 'balanced' or 'smallest'; what that means depends on the format.
+
+Large PNGs are compressed on several cores, the way pigz does it: the rows are
+cut into chunks that are filtered and deflated independently (each primed with
+the end of the previous chunk so little compression is lost) and flushed to a
+byte boundary, so their output concatenates into a single valid zlib stream.
+Pages are written to the file chunk by chunk, so encoding needs little memory
+beyond the page itself.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+SAVE_FORMATS = {'.png': 'png', '.webp': 'webp', '.jpg': 'jpeg', '.jpeg': 'jpeg', '.dds': 'dds'}
+SAVE_FILETYPES = [("PNG Files", "*.png"), ("WebP Files (lossless)", "*.webp"), ("JPEG Files", "*.jpg;*.jpeg"),
+                  ("DDS Files (uncompressed)", "*.dds")]
+COMPRESSIONS = ['fast', 'balanced', 'smallest']
+DEFAULT_COMPRESSION = 'balanced'
+
+PNG_LEVELS = {'fast': 1, 'balanced': 6, 'smallest': 9}  # zlib levels
+WEBP_EFFORT = {'fast': (0, 0), 'balanced': (4, 75), 'smallest': (6, 100)}  # (method, quality) for lossless WebP
+JPEG_QUALITY = {'fast': 95, 'balanced': 92, 'smallest': 85}  # JPEG is lossy: smaller files cost detail
+WEBP_MAX_SIZE = 16383  # Largest width or height WebP can store
+FORMATS_WITH_ALPHA = ('png', 'webp', 'dds')
+
+PNG_CHUNK_BYTES = 1024 * 1024  # Image bytes filtered and deflated per parallel job
+ZLIB_WINDOW = 32 * 1024  # Bytes of the previous chunk each chunk is primed with
+
+_DDS_HEADER = struct.Struct("<4s7I44x8I5I")
+_DDS_FLAGS = 0x1 | 0x2 | 0x4 | 0x8 | 0x1000  # caps, height, width, pitch, pixel format
+_DDPF_RGB_ALPHA = 0x40 | 0x1
+_DDSCAPS_TEXTURE = 0x1000
+
+
+def image_format(path):
+    """Format name for a file path's extension, e.g. 'png'."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SAVE_FORMATS:
+        raise ValueError(f"Unsupported texture map format {extension!r}, "
+                         f"expected one of {', '.join(sorted(SAVE_FORMATS))}")
+    return SAVE_FORMATS[extension]
+
+
+def _filter_rows(flat, previous_row, channels):
+    """PNG-filter rows of bytes, picking None, Sub or Up per row by the smallest sum of absolute values.
+
+    That is libpng's heuristic, minus the costly Average and Paeth filters.
+    """
+    sub = flat.copy()
+    sub[:, channels:] -= flat[:, :-channels]
+    up = flat.copy()
+    up[0] -= previous_row
+    up[1:] -= flat[:-1]
+    candidates = (flat, sub, up)
+    costs = np.stack([np.abs(candidate.view(np.int8).astype(np.int16)).sum(axis=1) for candidate in candidates])
+    choice = costs.argmin(axis=0)
+
+    filtered = np.empty((flat.shape[0], flat.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = choice  # Filter type bytes: 0 None, 1 Sub, 2 Up
+    for filter_type, candidate in enumerate(candidates):
+        rows = choice == filter_type
+        filtered[rows, 1:] = candidate[rows]
+    return filtered.tobytes()
+
+
+def _deflate_chunk(data, level, dictionary, last):
+    """Raw deflate of one chunk, primed with ``dictionary``; only the last chunk ends the stream."""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _adler32_combine(adler1, adler2, length2):
+    """Adler-32 of two byte strings joined, from their own checksums (zlib's adler32_combine)."""
+    base = 65521
+    remainder = length2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = remainder * sum1 % base
+    sum1 += (adler2 & 0xFFFF) + base - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + base - remainder
+    return sum1 % base | (sum2 % base) << 16
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+
+
+def write_png(f, image, level=6, executor=None):
+    """Write an RGB or RGBA PIL image to the file ``f`` as PNG, returning the bytes written.
+
+    Row chunks are filtered and deflated on ``executor`` if given and written as
+    they finish, in order; only a few chunks are held at once, never the whole
+    filtered or compressed image.
+    """
+    width, height = image.size
+    channels = len(image.getbands())
+    row_bytes = width * channels
+    rows_per_chunk = max(1, PNG_CHUNK_BYTES // (row_bytes + 1))
+    dictionary_rows = -(-ZLIB_WINDOW // (row_bytes + 1))  # Rows whose filtered bytes fill the zlib window
+    starts = range(0, height, rows_per_chunk)
+    zero_row = np.zeros(row_bytes, dtype=np.uint8)
+
+    def dictionary_start(y):
+        # First row whose filtered bytes go into chunk ``y``'s dictionary: the end of the previous chunk
+        return max(y - dictionary_rows, y - rows_per_chunk)
+
+    def compress(rows, first, y):
+        # ``rows`` starts at image row ``first``: the dictionary rows and the row before them, then the chunk
+        previous_row = rows[y - first - 1] if y else zero_row
+        filtered = _filter_rows(rows[y - first:], previous_row, channels)
+        dictionary = b""
+        if y:
+            start = dictionary_start(y)
+            dictionary = _filter_rows(rows[start - first:y - first],
+                                      rows[start - first - 1] if start else zero_row, channels)[-ZLIB_WINDOW:]
+        return _deflate_chunk(filtered, level, dictionary, y == starts[-1]), zlib.adler32(filtered), len(filtered)
+
+    # zlib header for the level; the checksum of all the uncompressed data goes after the chunks
+    flags = (0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3) << 6
+    flags += 31 - (0x78 * 256 + flags) % 31
+    color_type = 6 if channels == 4 else 2
+    header = (b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+              + _png_chunk(b"IDAT", bytes((0x78, flags))))
+    f.write(header)
+    written = len(header)
+    adler = 1
+
+    # Chunks are compressed in parallel but written in order, with at most ``limit`` held at once
+    limit = (os.cpu_count() or 1) + 1 if executor is not None else 1
+    in_flight = deque()
+    for y in starts:
+        first = max(dictionary_start(y) - 1, 0) if y else 0
+        rows = np.asarray(image.crop((0, first, width, min(y + rows_per_chunk, height)))).reshape(-1, row_bytes)
+        if executor is not None:
+            in_flight.append(executor.submit(compress, rows, first, y))
+        else:
+            in_flight.append(compress(rows, first, y))
+        del rows
+        while in_flight and (len(in_flight) >= limit or y == starts[-1]):
+            result = in_flight.popleft()
+            deflated, chunk_adler, length = result.result() if executor is not None else result
+            chunk = _png_chunk(b"IDAT", deflated)
+            f.write(chunk)
+            written += len(chunk)
+            adler = _adler32_combine(adler, chunk_adler, length)
+
+    trailer = _png_chunk(b"IDAT", struct.pack(">I", adler)) + _png_chunk(b"IEND", b"")
+    f.write(trailer)
+    return written + len(trailer)
+
+
+def write_dds(f, image):
+    """Write an RGB or RGBA PIL image to the file ``f`` as uncompressed 32-bit BGRA DDS (opaque alpha for RGB)."""
+    width, height = image.size
+    conversion = cv2.COLOR_RGBA2BGRA if image.mode == 'RGBA' else cv2.COLOR_RGB2BGRA
+    header = _DDS_HEADER.pack(b"DDS ", 124, _DDS_FLAGS, height, width, width * 4, 0, 0,
+                              32, _DDPF_RGB_ALPHA, 0, 32, 0x00FF0000, 0x0000FF00, 0x000000FF, 0xFF000000,
+                              _DDSCAPS_TEXTURE, 0, 0, 0, 0)
+    f.write(header)
+    rows_per_chunk = max(1, PNG_CHUNK_BYTES // (width * 4))
+    for y in range(0, height, rows_per_chunk):
+        rows = np.asarray(image.crop((0, y, width, min(y + rows_per_chunk, height))))
+        f.write(cv2.cvtColor(rows, conversion).tobytes())
+    return len(header) + width * height * 4
+
+
+def write_image(f, image, image_format, compression=DEFAULT_COMPRESSION, executor=None):
+    """Write a PIL image (RGB, or RGBA to keep alpha) to the file ``f`` in ``image_format`` at a
+    ``compression`` effort, returning the bytes written.
+
+    Formats without alpha drop it. ``executor`` lets PNG compress on several threads.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+    if image.mode not in ('RGB', 'RGBA') or image_format not in FORMATS_WITH_ALPHA:
+        image = image.convert('RGBA' if image.mode == 'RGBA' and image_format in FORMATS_WITH_ALPHA else 'RGB')
+
+    if image_format == 'png':
+        return write_png(f, image, PNG_LEVELS[compression], executor)
+    if image_format == 'dds':
+        return write_dds(f, image)
+
+    start = f.tell()
+    if image_format == 'webp':
+        if max(image.size) > WEBP_MAX_SIZE:
+            raise ValueError(f"WebP images can be at most {WEBP_MAX_SIZE} pixels wide and high; "
+                             f"lower the max page size or save as PNG")
+        method, quality = WEBP_EFFORT[compression]
+        image.save(f, format='WEBP', lossless=True, method=method, quality=quality, exact=True)
+    elif image_format == 'jpeg':
+        image.save(f, format='JPEG', quality=JPEG_QUALITY[compression], optimize=compression == 'smallest')
+    else:
+        raise ValueError(f"Unknown image format {image_format!r}")
+    return f.tell() - start
+
+
+def encode_image(image, image_format, compression=DEFAULT_COMPRESSION, executor=None):
+    """``write_image`` into memory, returning the encoded bytes."""
+    output = io.BytesIO()
+    write_image(output, image, image_format, compression, executor)
+    return output.getvalue()
+
+
+def encoder_pool():
+    """Thread pool for compressing pages and PNG chunks; zlib, OpenCV and Pillow's encoders release the GIL."""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="texture-ripper-encode")
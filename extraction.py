@@ -0,0 +1,289 @@
+"""Perspective extraction of quadrilateral selections, shared by the GUI and batch mode."""
+import cv2
+import numpy as np
+
+from profiling import PROFILER
+from pyramid import halve
+
+# Ways to resample the source when warping a quad, fastest first. 'mipmap' blends
+# area-averaged pyramid levels where the quad is minified; 'supersample' warps at a
+# higher resolution and averages down, the slowest but most accurate.
+WARP_QUALITIES = ['nearest', 'bilinear', 'bicubic', 'lanczos', 'mipmap', 'supersample']
+DEFAULT_WARP_QUALITY = 'bilinear'
+
+# Source pixels read around a quad's bounding box: how far each kernel reaches past
+# the sample point (Lanczos4 uses an 8x8 window). 'mipmap' depends on the quad.
+ROI_MARGINS = {
+    'nearest': 1,
+    'bilinear': 2,
+    'bicubic': 3,
+    'lanczos': 5,
+    'supersample': 2,
+}
+
+INTERPOLATION_FLAGS = {
+    'nearest': cv2.INTER_NEAREST,
+    'bilinear': cv2.INTER_LINEAR,
+    'bicubic': cv2.INTER_CUBIC,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+
+
+def order_quads(quads):
+    """Order the corners of many quads at once: top-left, top-right, bottom-right, bottom-left.
+
+    ``quads`` holds N sets of four (x, y) points; returns an (N, 4, 2) float32 array.
+    """
+    quads = np.asarray(quads, dtype=np.float32).reshape(-1, 4, 2)
+
+    # Sum and diff of points
+    s = quads.sum(axis=2)
+    diff = quads[:, :, 1] - quads[:, :, 0]
+
+    # Top-left has the smallest sum, top-right the smallest difference,
+    # bottom-right the largest sum and bottom-left the largest difference
+    corners = np.stack([s.argmin(axis=1), diff.argmin(axis=1), s.argmax(axis=1), diff.argmax(axis=1)], axis=1)
+    return np.take_along_axis(quads, corners[:, :, None], axis=1)
+
+
+def quad_output_sizes(rects):
+    """(N, 2) array of texture widths and heights for ordered quads: their longest opposing edges."""
+    rects = np.asarray(rects, dtype=np.float32).reshape(-1, 4, 2)
+    # Top, bottom, left and right edges
+    edges = rects[:, [1, 2, 3, 2]] - rects[:, [0, 3, 0, 1]]
+    lengths = np.sqrt((edges * edges).sum(axis=2))
+    sizes = np.stack([lengths[:, :2].max(axis=1), lengths[:, 2:].max(axis=1)], axis=1)
+    return np.maximum(1, sizes.astype(int))
+
+
+def order_points(pts):
+    """Order points in the following order: top-left, top-right, bottom-right, bottom-left."""
+    return order_quads(pts)[0]
+
+
+def quad_output_size(rect):
+    """Size of the extracted texture for an ordered quad: its longest opposing edges."""
+    width, height = quad_output_sizes(rect)[0]
+    return int(width), int(height)
+
+
+def quad_homography(rect, width, height):
+    """Perspective transform mapping an ordered quad onto a width x height rectangle."""
+    dst_pts = np.array([
+        [0, 0],
+        [width - 1, 0],
+        [width - 1, height - 1],
+        [0, height - 1]
+    ], dtype=np.float32)
+    return cv2.getPerspectiveTransform(rect, dst_pts)
+
+
+def source_footprint_lod(inverse, width, height, step=8):
+    """Mip level of detail for each texture pixel: log2 of the source pixels it spans.
+
+    ``inverse`` maps texture pixels to source pixels. Uses the larger of the two
+    Jacobian column lengths, like GPU texture filtering, so strongly foreshortened
+    areas blur rather than alias. The lod changes smoothly across a quad, so it is
+    evaluated every ``step`` pixels and interpolated in between.
+    """
+    grid_width = max(2, -(-width // step) + 1)
+    grid_height = max(2, -(-height // step) + 1)
+    u, v = np.meshgrid(np.linspace(0, width - 1, grid_width), np.linspace(0, height - 1, grid_height))
+    (a, b, c), (d, e, f), (g, h, i) = inverse
+    w = g * u + h * v + i
+    x = (a * u + b * v + c) / w
+    y = (d * u + e * v + f) / w
+    # Derivatives of x = (a u + b v + c) / w and y likewise, along u and v
+    dx_du, dy_du = (a - g * x) / w, (d - g * y) / w
+    dx_dv, dy_dv = (b - h * x) / w, (e - h * y) / w
+    rho_sq = np.maximum(dx_du ** 2 + dy_du ** 2, dx_dv ** 2 + dy_dv ** 2)
+    lod = (0.5 * np.log2(np.maximum(rho_sq, 1e-12))).astype(np.float32)
+    return cv2.resize(lod, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def _level_matrix(inverse, level, x0=0, y0=0):
+    """Texture-to-level pixel transform for one pyramid level (pixel centres line up).
+
+    (x0, y0) is the texture pixel that lands at the top-left of the warped output.
+    """
+    sx = sy = 0.5 ** level
+    to_level = np.array([[sx, 0, 0.5 * sx - 0.5], [0, sy, 0.5 * sy - 0.5], [0, 0, 1]])
+    offset = np.array([[1, 0, x0], [0, 1, y0], [0, 0, 1]])
+    return to_level @ inverse @ offset
+
+
+def _bounding_box(mask):
+    """(x0, y0, x1, y1) around the True pixels of a mask, or None if there are none."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    columns = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+
+
+def _warp_mipmap(levels, inverse, width, height):
+    """Trilinear warp: bilinear samples from the two pyramid levels around each pixel's lod, blended.
+
+    Levels are blended in from fine to coarse: after level L every pixel with
+    lod <= L holds its final value. Each level is only warped over the part of
+    the texture that uses it.
+    """
+    coarsest = max(0, int(np.log2(max(levels[0].shape[:2]))))
+    lod = np.clip(source_footprint_lod(inverse, width, height), 0, coarsest)
+    first, last = int(np.floor(lod.min())), int(np.ceil(lod.max()))
+    # Add any levels the pyramid stops short of (only as many as this quad needs)
+    levels = list(levels)
+    while len(levels) <= last:
+        levels.append(halve(levels[-1]))
+
+    def warp_level(level, box):
+        x0, y0, x1, y1 = box
+        return cv2.warpPerspective(levels[level], _level_matrix(inverse, level, x0, y0), (x1 - x0, y1 - y0),
+                                   flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+
+    if first == last:
+        return warp_level(first, (0, 0, width, height))
+
+    # Pixels at lod >= first + 1 are fully replaced by coarser levels below
+    result = np.zeros((height, width, levels[0].shape[2]), dtype=levels[0].dtype)
+    x0, y0, x1, y1 = box = _bounding_box(lod < first + 1)
+    result[y0:y1, x0:x1] = warp_level(first, box)
+    for level in range(first + 1, last + 1):
+        box = _bounding_box(lod > level - 1)
+        if box is None:
+            break
+        x0, y0, x1, y1 = box
+        blend = np.clip(lod[y0:y1, x0:x1] - (level - 1), 0, 1)
+        result[y0:y1, x0:x1] = cv2.blendLinear(result[y0:y1, x0:x1], warp_level(level, box), 1 - blend, blend)
+    return result
+
+
+def _warp_supersampled(pixels, inverse, width, height, max_factor=4):
+    """Warp at up to ``max_factor``x the output size, enough for the most minified area, then average down."""
+    lod = source_footprint_lod(inverse, width, height)
+    factor = int(min(max_factor, 2 ** max(0, int(np.ceil(lod.max())))))
+    if factor == 1:
+        return cv2.warpPerspective(pixels, inverse, (width, height), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+    # Sub-pixel (k x, k y) of the big image covers texture pixel ((x + 0.5) / k - 0.5, ...)
+    to_texture = np.array([[1 / factor, 0, 0.5 / factor - 0.5], [0, 1 / factor, 0.5 / factor - 0.5], [0, 0, 1]])
+    big = cv2.warpPerspective(pixels, inverse @ to_texture, (width * factor, height * factor),
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+    return cv2.resize(big, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def warp_quad(pixels, points, quality='bilinear', levels=None, origin=(0, 0)):
+    """Extract the area under four points of ``pixels`` as a rectified texture array.
+
+    ``pixels`` may be a window of a larger image whose top-left corner is at
+    ``origin``; ``points`` are always in full-image coordinates.
+
+    ``quality`` is one of WARP_QUALITIES. 'mipmap' samples from pre-downscaled
+    ``levels`` (an ImagePyramid's levels, level 0 being ``pixels``; missing levels
+    are built as needed) wherever the quad is minified; 'supersample' is the slow
+    reference.
+    """
+    if quality not in WARP_QUALITIES:
+        raise ValueError(f"Unknown warp quality {quality!r}, expected one of {', '.join(WARP_QUALITIES)}")
+    rect = order_points(np.array(points, dtype=np.float32))
+    width, height = quad_output_size(rect)
+    return _warp_rect(pixels, rect, width, height, quality, levels, origin)
+
+
+def _warp_rect(pixels, rect, width, height, quality, levels=None, origin=(0, 0)):
+    """``warp_quad`` of an already ordered quad whose texture size is known."""
+    M = quad_homography(rect, width, height)
+    if origin != (0, 0):
+        M = M @ np.array([[1, 0, origin[0]], [0, 1, origin[1]], [0, 0, 1]], dtype=np.float64)
+
+    if quality in INTERPOLATION_FLAGS:
+        return cv2.warpPerspective(pixels, M, (width, height), flags=INTERPOLATION_FLAGS[quality])
+
+    inverse = np.linalg.inv(M)
+    if quality == 'supersample':
+        return _warp_supersampled(pixels, inverse, width, height)
+    return _warp_mipmap(levels or [pixels], inverse, width, height)
+
+
+def source_window(points, quality='bilinear'):
+    """(x0, y0, x1, y1) of the source pixels a warp of ``points`` reads, before clipping to the image.
+
+    For 'mipmap' the margin covers the coarsest level the quad samples, and the
+    window starts on a multiple of that level's scale so the levels built from it
+    line up with the full image's pyramid.
+    """
+    rect = order_points(np.array(points, dtype=np.float32))
+    width, height = quad_output_size(rect)
+    return _rect_window(rect, width, height, quality)
+
+
+def _rect_window(rect, width, height, quality):
+    """``source_window`` of an already ordered quad whose texture size is known."""
+    margin, align = ROI_MARGINS.get(quality, 2), 1
+    if quality == 'mipmap':
+        inverse = np.linalg.inv(quad_homography(rect, width, height))
+        align = 2 ** max(0, int(np.ceil(source_footprint_lod(inverse, width, height).max())))
+        margin = 2 * align
+    x0, y0 = np.maximum(np.floor(rect.min(axis=0)).astype(int) - margin, 0) // align * align
+    x1, y1 = np.ceil(rect.max(axis=0)).astype(int) + margin + 1
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def warp_source_quad(source, points, quality='bilinear'):
+    """Extract a quad from a SourceImage, reading only the source window around the quad.
+
+    The cost then follows the size of the selection, not of the image, and
+    memory-mapped sources only page in that window.
+    """
+    return warp_source_quads(source, [points], quality)[0]
+
+
+def warp_source_quads(source, quads, quality='bilinear', executor=None):
+    """Extract many quads from one SourceImage, as a list of texture arrays in the same order.
+
+    Corners are ordered and texture sizes computed for all quads in one NumPy pass;
+    ``executor`` (e.g. a thread pool) warps them in parallel, as OpenCV releases the
+    GIL while warping.
+    """
+    if quality not in WARP_QUALITIES:
+        raise ValueError(f"Unknown warp quality {quality!r}, expected one of {', '.join(WARP_QUALITIES)}")
+    rects = order_quads(quads)
+    sizes = quad_output_sizes(rects)
+
+    def warp(rect, size):
+        width, height = int(size[0]), int(size[1])
+        x0, y0, x1, y1 = _rect_window(rect, width, height, quality)
+        region = source.read_region(x0, y0, x1, y1)
+        texture = _warp_rect(region, rect, width, height, quality, origin=(x0, y0))
+        PROFILER.count("warp bytes", region.nbytes + texture.nbytes)
+        return texture
+
+    run = executor.map if executor is not None else map
+    return list(run(warp, rects, sizes))
+
+
+def warp_quad_preview(levels, points, max_width, max_height, bgr=False):
+    """Quick low-resolution RGB warp of a quad, fitted into max_width x max_height, for live previews.
+
+    Samples the coarsest pyramid level that still has a pixel per preview pixel, so
+    the cost depends on the preview size, not the source size. ``bgr`` says the
+    levels are in BGR order.
+    """
+    rect = order_points(np.array(points, dtype=np.float32))
+    width, height = quad_output_size(rect)
+    scale = min(max_width / width, max_height / height, 1.0)
+    out_width, out_height = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+    level = 0 if scale >= 1 else min(int(np.floor(np.log2(1 / scale))), len(levels) - 1)
+    level_scale = 0.5 ** level
+    level_rect = rect * level_scale + (0.5 * level_scale - 0.5)
+
+    # Only read the part of the level under the quad
+    pixels = levels[level]
+    x0, y0 = np.maximum(np.floor(level_rect.min(axis=0)).astype(int) - 2, 0)
+    x1, y1 = np.ceil(level_rect.max(axis=0)).astype(int) + 2
+    window = np.ascontiguousarray(pixels[y0:y1, x0:x1])
+    M = quad_homography(level_rect - np.array([x0, y0], dtype=np.float32), out_width, out_height)
+    preview = cv2.warpPerspective(window, M, (out_width, out_height), flags=cv2.INTER_LINEAR)
+    if bgr:
+        cv2.cvtColor(preview, cv2.COLOR_BGR2RGB, dst=preview)
+    return preview
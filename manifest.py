@@ -0,0 +1,157 @@
+"""Texture map manifests: where each texture landed and where it came from.
+
+The manifest is written next to the map pages as JSON and, optionally, in a compact
+binary form (``.atlas``) for pipelines that load many maps. Both hold the same data:
+
+- per page: file name, width, height
+- per texture: key, page, pixel rect, rotated flag, normalized UV rect
+  (u0, v0, u1, v1 with v = 0 at the top of the page), and when known the source
+  image, the ordered source quad (top-left, top-right, bottom-right, bottom-left)
+  and the 3x3 homography mapping source pixels onto texture pixels.
+
+For curved selections (see ``curves``) the homography only maps the corners; the
+JSON manifest adds the selection's 'curve', and the binary one sets a flag.
+"""
+import os
+import struct
+
+import numpy as np
+
+from extraction import order_points, quad_homography, quad_output_size
+
+BINARY_MAGIC = b"TRAT"
+BINARY_VERSION = 1
+BINARY_EXTENSION = ".atlas"
+
+# Binary layout, little-endian:
+#   header:  magic, version, page count, texture count
+#   page:    width, height, file name
+#   texture: page, flags, x, y, width, height, u0, v0, u1, v1, quad (8 floats),
+#            homography (9 doubles), key, source image
+# Strings are a u16 byte length followed by UTF-8. Textures without a quad store
+# NaNs there (flag bit 1 clear); flag bit 2 marks curved selections.
+_HEADER = struct.Struct("<4sHHI")
+_PAGE = struct.Struct("<II")
+_TEXTURE = struct.Struct("<HBIIII4f8f9d")
+_STRING = struct.Struct("<H")
+_FLAG_ROTATED = 1
+_FLAG_HAS_QUAD = 2
+_FLAG_CURVED = 4
+
+
+def source_transform(points):
+    """Ordered source quad and the homography from source pixels to texture pixels."""
+    rect = order_points(np.array(points, dtype=np.float32))
+    width, height = quad_output_size(rect)
+    return rect, quad_homography(rect, width, height)
+
+
+def atlas_manifest(atlas, paths, sources=None):
+    """Describe the pages and where each texture landed, for tools that consume the map.
+
+    ``sources`` optionally maps texture keys to {'quad': four points, 'image': path}
+    describing where in which photo each texture was extracted from, plus the
+    'curve' of curved selections.
+    """
+    sources = sources or {}
+    pages = [{'file': os.path.basename(path), 'width': page.width, 'height': page.height}
+             for path, page in zip(paths, atlas.pages)]
+    textures = []
+    for key in atlas.textures:
+        page_index, placement = atlas.placement(key)
+        page = atlas.pages[page_index]
+        entry = {
+            'key': key,
+            'page': page_index,
+            'x': placement.x,
+            'y': placement.y,
+            'width': placement.width,
+            'height': placement.height,
+            'rotated': placement.rotated,
+            'uv': [placement.x / page.width, placement.y / page.height,
+                   (placement.x + placement.width) / page.width, (placement.y + placement.height) / page.height],
+        }
+        source = sources.get(key)
+        if source and source.get('quad') is not None:
+            rect, homography = source_transform(source['quad'])
+            if source.get('image'):
+                entry['image'] = source['image']
+            entry['quad'] = rect.tolist()
+            entry['homography'] = homography.tolist()
+            if source.get('curve') is not None:
+                entry['curve'] = source['curve']
+        textures.append(entry)
+    return {'pages': pages, 'textures': textures}
+
+
+def _pack_string(value):
+    data = str(value).encode("utf-8")
+    return _STRING.pack(len(data)) + data
+
+
+def _unpack_string(data, offset):
+    (length,) = _STRING.unpack_from(data, offset)
+    offset += _STRING.size
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+def encode_manifest(manifest):
+    """Pack a manifest into the compact binary form. Keys are stored as strings."""
+    pages = manifest['pages']
+    textures = manifest['textures']
+    chunks = [_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(pages), len(textures))]
+    for page in pages:
+        chunks.append(_PAGE.pack(page['width'], page['height']))
+        chunks.append(_pack_string(page['file']))
+
+    nan = float("nan")
+    for entry in textures:
+        flags = _FLAG_ROTATED if entry['rotated'] else 0
+        if 'quad' in entry:
+            flags |= _FLAG_HAS_QUAD
+            if 'curve' in entry:
+                flags |= _FLAG_CURVED
+            quad = [value for point in entry['quad'] for value in point]
+            homography = [value for row in entry['homography'] for value in row]
+        else:
+            quad = [nan] * 8
+            homography = [nan] * 9
+        chunks.append(_TEXTURE.pack(entry['page'], flags, entry['x'], entry['y'], entry['width'], entry['height'],
+                                    *entry['uv'], *quad, *homography))
+        chunks.append(_pack_string(entry['key']))
+        chunks.append(_pack_string(entry.get('image', "")))
+    return b"".join(chunks)
+
+
+def decode_manifest(data):
+    """Read a manifest back from its binary form."""
+    magic, version, page_count, texture_count = _HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a texture map manifest")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported manifest version {version}")
+    offset = _HEADER.size
+
+    pages = []
+    for _ in range(page_count):
+        width, height = _PAGE.unpack_from(data, offset)
+        file_name, offset = _unpack_string(data, offset + _PAGE.size)
+        pages.append({'file': file_name, 'width': width, 'height': height})
+
+    textures = []
+    for _ in range(texture_count):
+        values = _TEXTURE.unpack_from(data, offset)
+        key, offset = _unpack_string(data, offset + _TEXTURE.size)
+        image, offset = _unpack_string(data, offset)
+        page_index, flags, x, y, width, height = values[:6]
+        entry = {'key': key, 'page': page_index, 'x': x, 'y': y, 'width': width, 'height': height,
+                 'rotated': bool(flags & _FLAG_ROTATED), 'uv': list(values[6:10])}
+        if flags & _FLAG_CURVED:
+            entry['curved'] = True
+        if flags & _FLAG_HAS_QUAD:
+            if image:
+                entry['image'] = image
+            entry['quad'] = [list(values[10 + i:12 + i]) for i in range(0, 8, 2)]
+            entry['homography'] = [list(values[18 + i:21 + i]) for i in range(0, 9, 3)]
+        textures.append(entry)
+    return {'pages': pages, 'textures': textures}
@@ -0,0 +1,330 @@
+"""Rectangle bin packing for texture atlases.
+
+Packers place rectangles one at a time into a fixed-size bin. ``pack`` drives
+them: it tries a few bin shapes and keeps the smallest atlas that holds every
+rectangle, honouring padding, rotation and power-of-two / fixed-size constraints.
+"""
+from collections import namedtuple
+import math
+
+# Position of one texture in the atlas. width/height are the size as stored in the
+# atlas, i.e. already swapped when the texture was rotated 90 degrees.
+Placement = namedtuple("Placement", "x y width height rotated")
+
+
+class PackingError(ValueError):
+    """Raised when textures cannot fit in the requested atlas size."""
+
+
+class MaxRectsPacker:
+    """MaxRects bin packer using the best-short-side-fit heuristic."""
+
+    def __init__(self, width, height, allow_rotation=False):
+        self.width = width
+        self.height = height
+        self.allow_rotation = allow_rotation
+        self.free_rects = [(0, 0, width, height)]
+
+    def insert(self, width, height):
+        """Place a width x height rectangle; returns (x, y, rotated) or None if it does not fit."""
+        best = None
+        best_score = (math.inf, math.inf)
+        orientations = [(width, height, False)]
+        if self.allow_rotation and width != height:
+            orientations.append((height, width, True))
+
+        for free_x, free_y, free_width, free_height in self.free_rects:
+            for w, h, rotated in orientations:
+                if w <= free_width and h <= free_height:
+                    leftover_x = free_width - w
+                    leftover_y = free_height - h
+                    score = (min(leftover_x, leftover_y), max(leftover_x, leftover_y))
+                    if score < best_score:
+                        best_score = score
+                        best = (free_x, free_y, w, h, rotated)
+
+        if best is None:
+            return None
+        x, y, w, h, rotated = best
+        self._split_free_rects(x, y, w, h)
+        return x, y, rotated
+
+    def occupy(self, x, y, w, h):
+        """Mark an area that was packed elsewhere as used."""
+        self._split_free_rects(x, y, w, h)
+
+    def release(self, x, y, w, h):
+        """Return a previously used area to the free space."""
+        if any(fx <= x and fy <= y and x + w <= fx + fw and y + h <= fy + fh for fx, fy, fw, fh in self.free_rects):
+            return
+        self.free_rects = [(fx, fy, fw, fh) for fx, fy, fw, fh in self.free_rects
+                           if not (x <= fx and y <= fy and fx + fw <= x + w and fy + fh <= y + h)]
+        self.free_rects.append((x, y, w, h))
+
+    def _split_free_rects(self, x, y, w, h):
+        """Carve the placed rectangle out of every free rectangle it overlaps."""
+        kept = []
+        split = []
+        for free in self.free_rects:
+            free_x, free_y, free_width, free_height = free
+            if x >= free_x + free_width or x + w <= free_x or y >= free_y + free_height or y + h <= free_y:
+                kept.append(free)
+                continue
+            # Keep the maximal free areas left, right, above and below the placed rectangle
+            if x > free_x:
+                split.append((free_x, free_y, x - free_x, free_height))
+            if x + w < free_x + free_width:
+                split.append((x + w, free_y, free_x + free_width - x - w, free_height))
+            if y > free_y:
+                split.append((free_x, free_y, free_width, y - free_y))
+            if y + h < free_y + free_height:
+                split.append((free_x, y + h, free_width, free_y + free_height - y - h))
+
+        # Drop new rectangles contained in another free rectangle. Untouched ones never need
+        # checking: they were not contained before, and every new rectangle is smaller.
+        split.sort(key=lambda r: r[2] * r[3], reverse=True)
+        for rect in split:
+            rx, ry, rw, rh = rect
+            if not any(px <= rx and py <= ry and rx + rw <= px + pw and ry + rh <= py + ph
+                       for px, py, pw, ph in kept):
+                kept.append(rect)
+        self.free_rects = kept
+
+
+class SkylinePacker:
+    """Skyline bin packer using the bottom-left heuristic; faster than MaxRects, a little less tight."""
+
+    def __init__(self, width, height, allow_rotation=False):
+        self.width = width
+        self.height = height
+        self.allow_rotation = allow_rotation
+        self.skyline = [(0, 0, width)]  # (x, y, width) segments from left to right
+
+    def _fit(self, index, width, height):
+        """Lowest y at which a width x height rectangle fits starting at segment ``index``."""
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+        y = 0
+        remaining = width
+        while remaining > 0:
+            segment_x, segment_y, segment_width = self.skyline[index]
+            y = max(y, segment_y)
+            if y + height > self.height:
+                return None
+            remaining -= segment_width
+            index += 1
+        return y
+
+    def insert(self, width, height):
+        """Place a width x height rectangle; returns (x, y, rotated) or None if it does not fit."""
+        best = None
+        best_score = (math.inf, math.inf)
+        orientations = [(width, height, False)]
+        if self.allow_rotation and width != height:
+            orientations.append((height, width, True))
+
+        for index, (segment_x, _, segment_width) in enumerate(self.skyline):
+            for w, h, rotated in orientations:
+                y = self._fit(index, w, h)
+                if y is not None and (y + h, segment_width) < best_score:
+                    best_score = (y + h, segment_width)
+                    best = (index, segment_x, y, w, h, rotated)
+
+        if best is None:
+            return None
+        index, x, y, w, h, rotated = best
+        self._add_segment(index, x, y + h, w)
+        return x, y, rotated
+
+    def _add_segment(self, index, x, y, width):
+        """Raise the skyline to y over [x, x + width) and merge equal-height neighbours."""
+        self.skyline.insert(index, (x, y, width))
+        i = index + 1
+        while i < len(self.skyline):
+            segment_x, segment_y, segment_width = self.skyline[i]
+            overlap = x + width - segment_x
+            if overlap <= 0:
+                break
+            if overlap < segment_width:
+                self.skyline[i] = (segment_x + overlap, segment_y, segment_width - overlap)
+                break
+            del self.skyline[i]
+
+        merged = [self.skyline[0]]
+        for segment in self.skyline[1:]:
+            last_x, last_y, last_width = merged[-1]
+            if segment[1] == last_y:
+                merged[-1] = (last_x, last_y, last_width + segment[2])
+            else:
+                merged.append(segment)
+        self.skyline = merged
+
+
+PACKERS = {
+    'maxrects': MaxRectsPacker,
+    'skyline': SkylinePacker,
+}
+
+
+class PackResult:
+    """Atlas size and per-texture placements (in input order) produced by ``pack``."""
+
+    def __init__(self, width, height, placements, padding):
+        self.width = width
+        self.height = height
+        self.placements = placements
+        self.padding = padding
+
+    @property
+    def used_area(self):
+        return sum(p.width * p.height for p in self.placements)
+
+    @property
+    def efficiency(self):
+        """Fraction of the atlas covered by texture pixels."""
+        return self.used_area / (self.width * self.height) if self.placements else 0.0
+
+
+def next_power_of_two(value):
+    return 1 << max(0, int(value) - 1).bit_length()
+
+
+def _pack_into(sizes, order, width, height, method, allow_rotation):
+    """Pack padded sizes into one bin; returns {index: (x, y, rotated)} or None if any does not fit."""
+    packer = PACKERS[method](width, height, allow_rotation)
+    positions = {}
+    for index in order:
+        position = packer.insert(*sizes[index])
+        if position is None:
+            return None
+        positions[index] = position
+    return positions
+
+
+def _used_extent(sizes, positions):
+    """Width and height actually covered by the placed rectangles."""
+    right = bottom = 0
+    for index, (x, y, rotated) in positions.items():
+        w, h = sizes[index]
+        if rotated:
+            w, h = h, w
+        right = max(right, x + w)
+        bottom = max(bottom, y + h)
+    return right, bottom
+
+
+def pack(sizes, method='maxrects', padding=0, allow_rotation=False, power_of_two=False, fixed_size=None,
+         max_size=None):
+    """Pack (width, height) texture sizes into the smallest atlas that holds them all.
+
+    ``padding`` pixels are kept free around each texture (for bleed / mip filtering).
+    ``fixed_size`` forces a square atlas of that size; ``power_of_two`` rounds the
+    atlas dimensions up to powers of two; ``max_size`` caps both dimensions.
+    Raises PackingError if the textures cannot fit.
+    """
+    if method not in PACKERS:
+        raise ValueError(f"Unknown packing method {method!r}, expected one of {', '.join(PACKERS)}")
+    if not sizes:
+        return PackResult(0, 0, [], padding)
+
+    padded = [(w + 2 * padding, h + 2 * padding) for w, h in sizes]
+    # Placing the largest rectangles first gives the tightest results for both packers
+    order = sorted(range(len(padded)), key=lambda i: (max(padded[i]), padded[i][0] * padded[i][1]), reverse=True)
+    widest = max(min(w, h) if allow_rotation else w for w, h in padded)
+    total_area = sum(w * h for w, h in padded)
+
+    candidates = []  # (bin width, bin heights to try in turn)
+    if fixed_size:
+        candidates.append((fixed_size, [fixed_size]))
+    else:
+        # Try a handful of bin widths around the square root of the total area. The bin only
+        # has to be tall enough, as the atlas is trimmed to what was used; the second height
+        # is a fallback that always fits.
+        tallest = max(max(w, h) if allow_rotation else h for w, h in padded)
+        stacked = sum(max(w, h) for w, h in padded)
+        lower = max(widest, int(math.sqrt(total_area)))
+        widths = {max(widest, int(lower * factor)) for factor in (0.8, 0.9, 1.0, 1.1, 1.25, 1.5)}
+        # A very tall texture sets the atlas height, so also try the narrower width that height implies
+        if total_area / tallest < lower:
+            widths.add(max(widest, int(total_area / tallest)))
+        if power_of_two:
+            widths = {next_power_of_two(w) for w in widths}
+        if max_size:
+            widths = {w for w in widths if w <= max_size} | {max_size}
+        for width in sorted(widths):
+            heights = [max(tallest, int(total_area / width * 2)), stacked]
+            if max_size:
+                heights = sorted({min(h, max_size) for h in heights})
+            candidates.append((width, heights))
+
+    best = None
+    for bin_width, bin_heights in candidates:
+        for bin_height in bin_heights:
+            positions = _pack_into(padded, order, bin_width, bin_height, method, allow_rotation)
+            if positions is not None:
+                break
+        else:
+            continue
+        if fixed_size:
+            width = height = fixed_size
+        else:
+            width, height = _used_extent(padded, positions)
+            if power_of_two:
+                width, height = next_power_of_two(width), next_power_of_two(height)
+            if max_size and max(width, height) > max_size:
+                continue
+        # Smallest area wins, the squarer atlas on a tie
+        if best is None or (width * height, max(width, height)) < (best[0] * best[1], max(best[0], best[1])):
+            best = (width, height, positions)
+
+    if best is None:
+        limit = fixed_size or max_size
+        raise PackingError(f"{len(sizes)} textures do not fit in a {limit}x{limit} atlas")
+
+    width, height, positions = best
+    placements = []
+    for index, (w, h) in enumerate(sizes):
+        x, y, rotated = positions[index]
+        if rotated:
+            w, h = h, w
+        placements.append(Placement(x + padding, y + padding, w, h, rotated))
+    return PackResult(width, height, placements, padding)
+
+
+def pack_pages(sizes, method='maxrects', padding=0, allow_rotation=False, power_of_two=False, fixed_size=None,
+               max_size=None):
+    """Pack texture sizes onto as many pages as needed when one atlas would exceed the size limit.
+
+    Pages are at most ``fixed_size`` (or ``max_size``) square. Returns a list of
+    (texture indices, PackResult) per page, with placements in the order of the indices.
+    """
+    options = dict(method=method, padding=padding, allow_rotation=allow_rotation, power_of_two=power_of_two,
+                   fixed_size=fixed_size)
+    page_size = fixed_size or max_size
+    all_indices = list(range(len(sizes)))
+    if not page_size or not sizes:
+        return [(all_indices, pack(sizes, **options))]
+    try:
+        return [(all_indices, pack(sizes, max_size=page_size, **options))]
+    except PackingError:
+        pass
+
+    # Fill pages one at a time: each page takes every remaining texture that still fits,
+    # largest first, then gets repacked on its own to trim it down
+    padded = [(w + 2 * padding, h + 2 * padding) for w, h in sizes]
+    remaining = sorted(all_indices, key=lambda i: (max(padded[i]), padded[i][0] * padded[i][1]), reverse=True)
+    pages = []
+    while remaining:
+        packer = PACKERS[method](page_size, page_size, allow_rotation)
+        placed = []
+        leftover = []
+        for index in remaining:
+            (placed if packer.insert(*padded[index]) is not None else leftover).append(index)
+        if not placed:
+            w, h = sizes[remaining[0]]
+            raise PackingError(f"A {w}x{h} texture is larger than the {page_size}x{page_size} page size")
+        placed.sort()
+        pages.append((placed, pack([sizes[i] for i in placed], max_size=page_size, **options)))
+        remaining = leftover
+    return pages
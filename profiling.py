@@ -0,0 +1,155 @@
+"""Always-on timing hooks and counters for the hot paths, cheap enough for normal sessions.
+
+Spans (``timed`` functions and ``span`` blocks) and counters go into bounded ring
+buffers, so a long session never grows memory and recording costs about a
+microsecond per span. The buffers can be shown live (see the GUI's stats overlay)
+or exported as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev).
+
+Set TEXTURE_RIPPER_PROFILE=0 to turn recording off entirely.
+"""
+from collections import deque
+import functools
+import json
+import os
+import threading
+import time
+
+MAX_EVENTS = 50000  # Spans and counter samples kept for trace export
+RECENT_SPANS = 256  # Durations kept per span name for live stats
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Profiler:
+    """Records named spans and counters from any thread."""
+
+    def __init__(self, enabled=True, max_events=MAX_EVENTS):
+        self.enabled = enabled
+        self.origin = time.perf_counter_ns()
+        # ('X', name, thread id, start ns, duration ns) spans and ('C', name, ns, total) counter samples
+        self.events = deque(maxlen=max_events)
+        self.recent = {}  # name -> deque of (end ns, duration ns)
+        self.counters = {}  # name -> running total
+        self.lock = threading.Lock()  # Only guards counter totals; deque appends are atomic
+
+    def record(self, name, start, end):
+        """Add a finished span; ``start`` and ``end`` are perf_counter_ns() readings."""
+        duration = end - start
+        self.events.append(('X', name, threading.get_ident(), start, duration))
+        recent = self.recent.get(name)
+        if recent is None:
+            recent = self.recent.setdefault(name, deque(maxlen=RECENT_SPANS))
+        recent.append((end, duration))
+
+    def span(self, name):
+        """Context manager timing a block: ``with PROFILER.span('save'): ...``."""
+        return _Span(self, name) if self.enabled else _NO_SPAN
+
+    def count(self, name, amount=1):
+        """Add ``amount`` to a counter, e.g. resizes done or bytes allocated."""
+        if not self.enabled:
+            return
+        with self.lock:
+            total = self.counters[name] = self.counters.get(name, 0) + amount
+        self.events.append(('C', name, time.perf_counter_ns(), total))
+
+    def stats(self, *names, window=2.0):
+        """(count, mean ms, max ms, last ms) of spans named any of ``names`` that ended in the last ``window`` s.
+
+        ``last`` is the most recent span even if it is older than the window; all are 0 if none was recorded.
+        """
+        entries = [entry for name in names for entry in list(self.recent.get(name, ()))]
+        if not entries:
+            return 0, 0.0, 0.0, 0.0
+        since = time.perf_counter_ns() - int(window * 1e9)
+        durations = [duration for end, duration in entries if end >= since]
+        last = max(entries)[1] / 1e6
+        if not durations:
+            return 0, 0.0, 0.0, last
+        return len(durations), sum(durations) / len(durations) / 1e6, max(durations) / 1e6, last
+
+    def clear(self):
+        self.events.clear()
+        self.recent = {}
+        with self.lock:
+            self.counters = {}
+
+    def chrome_trace(self):
+        """The recorded events in Chrome's trace event format, with counter totals and span stats alongside."""
+        pid = os.getpid()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        thread_ids = {}  # Small, stable ids read better in trace viewers than raw idents
+        trace_events = []
+        for event in list(self.events):
+            if event[0] == 'X':
+                _, name, ident, start, duration = event
+                tid = thread_ids.setdefault(ident, len(thread_ids) + 1)
+                trace_events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                                     'ts': (start - self.origin) / 1000, 'dur': duration / 1000})
+            else:
+                _, name, timestamp, total = event
+                trace_events.append({'name': name, 'ph': 'C', 'pid': pid, 'tid': 0,
+                                     'ts': (timestamp - self.origin) / 1000, 'args': {name: total}})
+        for ident, tid in thread_ids.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': thread_names.get(ident, f"thread {ident}")}})
+
+        summary = {}
+        for name, recent in list(self.recent.items()):
+            durations = sorted(duration / 1e6 for _, duration in recent)
+            summary[name] = {'count': len(durations), 'median_ms': durations[len(durations) // 2],
+                             'max_ms': durations[-1]}
+        with self.lock:
+            counters = dict(self.counters)
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                'otherData': {'counters': counters, 'recent_spans': summary}}
+
+    def export(self, path):
+        """Write ``chrome_trace()`` to a JSON file."""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        os.replace(temp_path, path)
+
+
+PROFILER = Profiler(enabled=os.environ.get("TEXTURE_RIPPER_PROFILE", "1") != "0")
+
+
+def timed(name):
+    """Decorator recording every call of a function as a span named ``name``."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                PROFILER.record(name, start, time.perf_counter_ns())
+        return wrapper
+    return decorate
@@ -0,0 +1,199 @@
+"""Mip pyramid and tile cache for viewport-only rendering of large images."""
+from collections import OrderedDict
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from profiling import PROFILER
+from source_image import temp_memmap
+
+TILE_SIZE = 256  # Display tiles are TILE_SIZE x TILE_SIZE canvas pixels
+TILE_CACHE_BYTES = 128 * 1024 * 1024  # Default memory cap for rendered tiles
+LEVEL_MEMORY_BYTES = 512 * 1024 * 1024  # Larger pyramid levels are kept in temporary files
+STRIP_BYTES = 64 * 1024 * 1024  # Source rows read at a time while building a level
+
+
+def halve(pixels, memory_limit=LEVEL_MEMORY_BYTES):
+    """2x box-filtered copy of an image, built a strip of rows at a time.
+
+    Odd last rows/columns are dropped so every output pixel averages exactly 2x2
+    input pixels, which also makes the strips line up exactly. Only one strip of
+    ``pixels`` is read at a time, so memory-mapped sources are never fully paged in.
+    """
+    height, width = pixels.shape[:2]
+    out_height, out_width = max(1, height // 2), max(1, width // 2)
+    if height < 2 or width < 2:
+        return cv2.resize(np.ascontiguousarray(pixels), (out_width, out_height), interpolation=cv2.INTER_AREA)
+
+    shape = (out_height, out_width) + pixels.shape[2:]
+    out_bytes = out_height * out_width * (pixels.shape[2] if pixels.ndim == 3 else 1)
+    result = temp_memmap(shape, pixels.dtype) if out_bytes > memory_limit else np.empty(shape, pixels.dtype)
+    PROFILER.count("pyramid bytes", out_bytes)
+
+    # Each output row reads two input rows, each twice as wide
+    rows_per_strip = max(1, STRIP_BYTES // (4 * (out_bytes // out_height)))
+    for y in range(0, out_height, rows_per_strip):
+        rows = min(rows_per_strip, out_height - y)
+        strip = np.ascontiguousarray(pixels[2 * y:2 * (y + rows), :2 * out_width])
+        result[y:y + rows] = cv2.resize(strip, (out_width, rows), interpolation=cv2.INTER_AREA)
+    return result
+
+
+class ImagePyramid:
+    """Precomputed 2x mip levels of an image; level 0 is the source pixels themselves.
+
+    Level n covers the top-left ``2**n * size`` source pixels exactly, so its scale
+    is exactly ``0.5**n``. Levels bigger than ``memory_limit`` go to temporary files.
+    Levels keep the source's channel order; ``bgr`` records which one that is.
+    """
+
+    def __init__(self, pixels, min_size=TILE_SIZE, memory_limit=LEVEL_MEMORY_BYTES, bgr=False):
+        self.bgr = bgr
+        self.levels = [pixels]
+        # Halve until the whole image fits in a single tile
+        while max(self.levels[-1].shape[:2]) > min_size:
+            self.levels.append(halve(self.levels[-1], memory_limit))
+
+    @property
+    def width(self):
+        return self.levels[0].shape[1]
+
+    @property
+    def height(self):
+        return self.levels[0].shape[0]
+
+    @property
+    def nbytes(self):
+        """Memory held by the downscaled levels (level 0 is shared with the source, file-backed levels are not counted)."""
+        return sum(level.nbytes for level in self.levels[1:] if not isinstance(level, np.memmap))
+
+    def level_scale(self, level):
+        """(x, y) size of a level relative to level 0."""
+        return 0.5 ** level, 0.5 ** level
+
+    def level_for_scale(self, scale):
+        """Coarsest level that still has at least one pixel per display pixel at ``scale``."""
+        if scale >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / scale)))
+        return min(level, len(self.levels) - 1)
+
+
+class TileCache:
+    """LRU cache of rendered tiles, bounded by the memory the tiles occupy."""
+
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()  # key -> (tile, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return a cached tile (marking it most recently used) or None."""
+        entry = self.tiles.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tiles.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, tile, nbytes):
+        """Store a tile, evicting the least recently used ones to stay under the cap."""
+        if key in self.tiles:
+            self.nbytes -= self.tiles.pop(key)[1]
+        self.tiles[key] = (tile, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            _, (_, evicted_bytes) = self.tiles.popitem(last=False)
+            self.nbytes -= evicted_bytes
+
+    def clear(self):
+        self.tiles.clear()
+        self.nbytes = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TileRenderer:
+    """Renders the tiles of a pyramid that intersect a viewport at a given display scale.
+
+    Tile (tx, ty) covers display pixels [tx * tile_size, (tx + 1) * tile_size) of the
+    image scaled by ``scale``; its canvas position is that plus the pan offset.
+    """
+
+    def __init__(self, pyramid, cache=None, tile_size=TILE_SIZE):
+        self.pyramid = pyramid
+        self.cache = cache if cache is not None else TileCache()
+        self.tile_size = tile_size
+
+    def display_size(self, scale):
+        """Size of the whole image in display pixels at ``scale``."""
+        return (max(1, int(round(self.pyramid.width * scale))),
+                max(1, int(round(self.pyramid.height * scale))))
+
+    def visible_tiles(self, scale, offset_x, offset_y, view_width, view_height):
+        """List the (tx, ty) indices of tiles that intersect the viewport."""
+        display_width, display_height = self.display_size(scale)
+        size = self.tile_size
+        first_x = max(0, int(math.floor(-offset_x / size)))
+        first_y = max(0, int(math.floor(-offset_y / size)))
+        last_x = min(int(math.ceil(display_width / size)), int(math.ceil((view_width - offset_x) / size)))
+        last_y = min(int(math.ceil(display_height / size)), int(math.ceil((view_height - offset_y) / size)))
+        return [(tx, ty) for ty in range(first_y, last_y) for tx in range(first_x, last_x)]
+
+    def tile_position(self, tx, ty, offset_x, offset_y):
+        """Canvas coordinates of a tile's top-left corner."""
+        return int(round(offset_x)) + tx * self.tile_size, int(round(offset_y)) + ty * self.tile_size
+
+    def render_tile(self, scale, tx, ty):
+        """Return the tile as a PIL image, resampling it from the pyramid on a cache miss."""
+        key = (scale, tx, ty)
+        tile = self.cache.get(key)
+        if tile is None:
+            pixels = self._resample_tile(scale, tx, ty)
+            if self.pyramid.bgr:
+                cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB, dst=pixels)
+            tile = Image.fromarray(pixels)
+            self.cache.put(key, tile, tile.width * tile.height * 4)  # PIL stores RGB as 32-bit pixels
+            PROFILER.count("tile resizes")
+            PROFILER.count("tile bytes", tile.width * tile.height * 4)
+        return tile
+
+    def _resample_tile(self, scale, tx, ty):
+        """Resample one tile from the closest pyramid level at or above the display resolution."""
+        display_width, display_height = self.display_size(scale)
+        size = self.tile_size
+        x0, y0 = tx * size, ty * size
+        tile_width = min(size, display_width - x0)
+        tile_height = min(size, display_height - y0)
+
+        level = self.pyramid.level_for_scale(scale)
+        pixels = self.pyramid.levels[level]
+        level_height, level_width = pixels.shape[:2]
+        level_sx, level_sy = self.pyramid.level_scale(level)
+
+        # Level pixels per display pixel; below 2 except past the coarsest level
+        step_x = level_sx / scale
+        step_y = level_sy / scale
+
+        # Only read the window of the level under this tile, plus a small interpolation margin
+        margin = 2
+        src_x0 = max(0, int(math.floor(x0 * step_x)) - margin)
+        src_y0 = max(0, int(math.floor(y0 * step_y)) - margin)
+        src_x1 = min(level_width, int(math.ceil((x0 + tile_width) * step_x)) + margin)
+        src_y1 = min(level_height, int(math.ceil((y0 + tile_height) * step_y)) + margin)
+        window = np.ascontiguousarray(pixels[src_y0:src_y1, src_x0:src_x1])
+
+        # Map tile pixel centres to window coordinates so neighbouring tiles line up exactly
+        matrix = np.array([[step_x, 0, (x0 + 0.5) * step_x - 0.5 - src_x0],
+                           [0, step_y, (y0 + 0.5) * step_y - 0.5 - src_y0]], dtype=np.float64)
+        return cv2.warpAffine(window, matrix, (tile_width, tile_height),
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_REPLICATE)
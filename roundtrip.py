@@ -0,0 +1,200 @@
+"""Headless round-trip check of saved texture maps: `python roundtrip.py`.
+
+Packs synthetic textures into a multi-page map, saves it in every format,
+compression and alpha setting with both manifests, then reads everything back
+independently (Pillow and OpenCV for the pages, ``decode_manifest`` for the
+binary manifest) and compares it with what was saved. Exits with 1 on any mismatch.
+"""
+import json
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from atlas import TextureAtlas, page_paths, save_atlas
+import encoders
+from encoders import COMPRESSIONS, FORMATS_WITH_ALPHA, SAVE_FORMATS
+from manifest import BINARY_EXTENSION, decode_manifest
+
+JPEG_TOLERANCE = 20.0  # Largest mean absolute error accepted from JPEG: catches swapped channels or shifted rows
+
+
+def synthetic_atlas(seed=0):
+    """A map of noisy gradient textures of assorted sizes, spread over several pages."""
+    rng = np.random.default_rng(seed)
+    textures = {}
+    for i in range(12):
+        width, height = int(rng.integers(20, 400)), int(rng.integers(20, 400))
+        gradient = (np.arange(width)[None, :, None] + np.arange(height)[:, None, None] * 2 + [0, 60, 120]) % 256
+        noise = rng.integers(0, 24, (height, width, 3))
+        textures[f"texture_{i:02d}"] = Image.fromarray(((gradient + noise) % 256).astype(np.uint8))
+    atlas = TextureAtlas(padding=2, bleed=True, allow_rotation=True, max_size=512)
+    atlas.set_textures(textures)
+    return atlas
+
+
+def synthetic_sources(atlas):
+    """Manifest sources: most textures get a quad, one of them a curve, one neither."""
+    sources = {}
+    for i, key in enumerate(atlas.textures):
+        if i == 0:
+            continue
+        quad = [(10.5 + i, 20.25), (400.0 + i, 18.0), (410.75, 300.5 + i), (5.0, 310.0)]
+        sources[key] = {'image': f"photos/photo_{i % 3}.jpg", 'quad': quad}
+        if i == 1:
+            sources[key]['curve'] = {'kind': 'bezier', 'handles': [(100.0 + i, 0.0)] * 8}
+    return sources
+
+
+def read_dds(path):
+    """RGBA pixels of an uncompressed 32-bit BGRA DDS file, parsed by hand."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b"DDS ":
+        raise ValueError("missing DDS magic")
+    height, width = np.frombuffer(data, dtype="<u4", count=2, offset=12)
+    pixels = np.frombuffer(data, dtype=np.uint8, offset=128).reshape(height, width, 4)
+    return cv2.cvtColor(pixels, cv2.COLOR_BGRA2RGBA)
+
+
+def png_stream_problem(path):
+    """Check a PNG's chunk CRCs and zlib checksum strictly, which Pillow and libpng only warn about."""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset, compressed = 8, []
+    while offset < len(data):
+        length, kind = struct.unpack_from(">I4s", data, offset)
+        body = data[offset + 8:offset + 8 + length]
+        (crc,) = struct.unpack_from(">I", data, offset + 8 + length)
+        if crc != zlib.crc32(body, zlib.crc32(kind)):
+            return f"bad CRC in a {kind.decode()} chunk"
+        if kind == b"IDAT":
+            compressed.append(body)
+        offset += 12 + length
+    try:
+        zlib.decompress(b"".join(compressed))
+    except zlib.error as e:
+        return f"bad zlib stream: {e}"
+    return None
+
+
+def decoded_pages(path, image_format):
+    """Each reader's view of a saved page, as RGB or RGBA arrays: {reader name: pixels}."""
+    with Image.open(path) as image:
+        image.load()
+        decoded = {'pillow': np.asarray(image.convert(image.mode if image.mode in ('RGB', 'RGBA') else 'RGB'))}
+    if image_format == 'dds':
+        decoded['raw'] = read_dds(path)
+    else:
+        pixels = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if pixels is None:
+            raise ValueError("OpenCV could not read it")
+        decoded['opencv'] = cv2.cvtColor(pixels, cv2.COLOR_BGRA2RGBA if pixels.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+    return decoded
+
+
+def compare_pixels(expected, actual, image_format):
+    """Problem with a decoded page, or None if it matches."""
+    if actual.shape[:2] != expected.shape[:2]:
+        return f"size {actual.shape[1]}x{actual.shape[0]}, expected {expected.shape[1]}x{expected.shape[0]}"
+    if actual.shape[2] != expected.shape[2]:
+        # DDS always stores alpha and WebP leaves it out of fully opaque pages: either way it must be opaque
+        alpha = actual[..., 3] if actual.shape[2] == 4 else expected[..., 3]
+        if (alpha != 255).any():
+            return f"{actual.shape[2]} channels, expected {expected.shape[2]}"
+        actual, expected = actual[..., :3], expected[..., :3]
+    error = np.abs(actual.astype(np.int16) - expected).mean()
+    if image_format == 'jpeg':
+        return f"mean error {error:.2f}" if error > JPEG_TOLERANCE else None
+    return f"{np.count_nonzero(actual != expected)} values differ" if error else None
+
+
+def compare_manifests(expected, actual):
+    """Problems with a decoded binary manifest compared with the JSON one."""
+    problems = []
+    if actual['pages'] != expected['pages']:
+        problems.append("pages differ")
+    if len(actual['textures']) != len(expected['textures']):
+        return problems + [f"{len(actual['textures'])} textures, expected {len(expected['textures'])}"]
+    for want, got in zip(expected['textures'], actual['textures']):
+        for field in ('key', 'page', 'x', 'y', 'width', 'height', 'rotated', 'image'):
+            if want.get(field) != got.get(field):
+                problems.append(f"{want['key']}: {field} {got.get(field)!r}, expected {want.get(field)!r}")
+        if not np.allclose(got['uv'], want['uv'], atol=1e-6):
+            problems.append(f"{want['key']}: uv differs")
+        if ('quad' in want) != ('quad' in got) or ('curve' in want) != got.get('curved', False):
+            problems.append(f"{want['key']}: quad or curve flag lost")
+        elif 'quad' in want:
+            if not np.allclose(got['quad'], want['quad'], atol=1e-3):
+                problems.append(f"{want['key']}: quad differs")
+            if not np.allclose(got['homography'], want['homography'], rtol=1e-12, atol=1e-12):
+                problems.append(f"{want['key']}: homography differs")
+    return problems
+
+
+def check(atlas, sources, directory, extension, compression, alpha):
+    """Save the map once and return the problems found reading it back."""
+    image_format = SAVE_FORMATS[extension]
+    path = os.path.join(directory, f"map_{compression}_{'alpha' if alpha else 'opaque'}{extension}")
+    saved = save_atlas(atlas, path, sources, binary=True, compression=compression, alpha=alpha)
+
+    problems = []
+    paths = page_paths(path, len(atlas.pages))
+    for page_index, page_path in enumerate(paths):
+        expected = np.asarray(atlas.render_page(page_index, alpha and image_format in FORMATS_WITH_ALPHA))
+        if os.path.getsize(page_path) != saved['pages'][page_index]['bytes']:
+            problems.append(f"page {page_index + 1}: reported size is not the file size")
+        if image_format == 'png':
+            problem = png_stream_problem(page_path)
+            if problem:
+                problems.append(f"page {page_index + 1}: {problem}")
+        try:
+            decoded = decoded_pages(page_path, image_format)
+        except (OSError, ValueError) as e:
+            problems.append(f"page {page_index + 1}: unreadable: {e}")
+            continue
+        for reader, pixels in decoded.items():
+            problem = compare_pixels(expected, pixels, image_format)
+            if problem:
+                problems.append(f"page {page_index + 1} ({reader}): {problem}")
+
+    root = os.path.splitext(path)[0]
+    with open(root + ".json") as f:
+        manifest = json.load(f)
+    with open(root + BINARY_EXTENSION, "rb") as f:
+        problems += compare_manifests(manifest, decode_manifest(f.read()))
+    return problems
+
+
+def main():
+    encoders.PNG_CHUNK_BYTES = 64 * 1024  # Split even these small pages into many PNG chunks
+    atlas = synthetic_atlas()
+    sources = synthetic_sources(atlas)
+    sizes = ", ".join(f"{page.width}x{page.height}" for page in atlas.pages)
+    print(f"round trip: {len(atlas.textures)} textures on {len(atlas.pages)} pages ({sizes})")
+
+    extensions = {}  # One extension per format, e.g. .jpg but not .jpeg
+    for extension, image_format in SAVE_FORMATS.items():
+        extensions.setdefault(image_format, extension)
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in extensions.values():
+            for compression in COMPRESSIONS:
+                for alpha in (False, True):
+                    problems = check(atlas, sources, directory, extension, compression, alpha)
+                    label = f"{extension[1:]} {compression}{' alpha' if alpha else ''}"
+                    print(f"{label:>24}: {'ok' if not problems else 'FAILED'}")
+                    for problem in problems:
+                        print(f"{'':>26}{problem}")
+                    failures += bool(problems)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
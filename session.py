@@ -0,0 +1,271 @@
+"""Project files and the on-disk cache of extracted textures.
+
+A project stores its images (paths and fingerprints), every selection set's image,
+points (and curve, for curved selections) and the quad and curve its texture was
+extracted from, and the packing settings; textures are not stored. On load they
+come back as ``LazyTexture``s, which only know their size until the pixels are
+needed (to draw a map page or save), and then come from the texture cache or are
+re-warped from the source.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from curves import curve_key, curve_output_size, warp_source_curve
+from extraction import DEFAULT_WARP_QUALITY, WARP_QUALITIES, order_points, quad_output_size, warp_source_quad
+
+PROJECT_VERSION = 3  # Older versions still load: 1 had a single image, 2 had no curved selections
+PROJECT_EXTENSION = ".trproj"
+FINGERPRINT_CHUNK = 1024 * 1024  # Bytes hashed from each end of the image file
+
+
+def image_fingerprint(path):
+    """Quick content hash of an image file: its size plus its first and last MiB.
+
+    Reading a few MiB instead of the whole file keeps this instant for huge scans,
+    and still changes whenever the image is re-exported or edited.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_CHUNK))
+        if size > FINGERPRINT_CHUNK:
+            f.seek(max(FINGERPRINT_CHUNK, size - FINGERPRINT_CHUNK))
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
+
+
+def default_cache_dir():
+    """Per-user folder for cached textures."""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "texture_ripper", "textures")
+
+
+def texture_cache_key(image_hash, quad, size, *extra):
+    """Cache key for the texture warped from ``quad`` of an image at ``size``.
+
+    ``extra`` holds anything else that changes the pixels (e.g. the warp quality).
+    """
+    coords = ",".join(f"{value:.3f}" for point in quad for value in point)
+    text = f"{image_hash}|{coords}|{size[0]}x{size[1]}|" + "|".join(str(value) for value in extra)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def texture_cache_extra(quality, curve=None):
+    """The ``extra`` cache key values of a texture: its warp quality, plus the curve of a curved selection."""
+    if curve is None:
+        return (quality,)
+    return (quality, curve_key((), curve))
+
+
+class TextureDiskCache:
+    """Extracted textures stored as PNG files, one per cache key."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_cache_dir()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".png")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        """Return the cached texture as a PIL image, or None."""
+        try:
+            with Image.open(self.path(key)) as image:
+                texture = image.convert("RGB")
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return texture
+
+    def put(self, key, texture):
+        """Store a texture; failures (read-only or full disk) only cost a later re-warp."""
+        path = self.path(key)
+        temp_path = path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Fast compression: the cache is read far more often than it is written
+            texture.save(temp_path, format="PNG", compress_level=1)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+
+class LazyTexture:
+    """Texture that is re-warped from its source only when its pixels are needed.
+
+    Its size is known straight from the quad, so the map can be packed without
+    touching any pixels. ``get_source`` returns the SourceImage to warp from.
+    """
+
+    def __init__(self, quad, get_source, image_hash, cache, quality=DEFAULT_WARP_QUALITY, curve=None):
+        self.quad = [tuple(point) for point in quad]
+        self.get_source = get_source
+        self.image_hash = image_hash
+        self.cache = cache
+        self.quality = quality
+        self.curve = curve
+        if curve is None:
+            self.size = quad_output_size(order_points(np.array(self.quad, dtype=np.float32)))
+        else:
+            self.size = curve_output_size(self.quad, curve)
+        self.image = None
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def cache_key(self):
+        return texture_cache_key(self.image_hash, self.quad, self.size, *texture_cache_extra(self.quality, self.curve))
+
+    def materialize(self):
+        """The texture as a PIL image: from memory, then the disk cache, then a fresh warp."""
+        if self.image is None:
+            key = self.cache_key
+            image = self.cache.get(key) if self.cache is not None else None
+            if image is None or image.size != self.size:
+                if self.curve is None:
+                    pixels = warp_source_quad(self.get_source(), self.quad, self.quality)
+                else:
+                    pixels = warp_source_curve(self.get_source(), self.quad, self.curve, self.quality)
+                image = Image.fromarray(pixels)
+                if self.cache is not None:
+                    self.cache.put(key, image)
+            self.image = image
+        return self.image
+
+
+def stored_image_path(image_path, project_path):
+    """Image path as written to a project: relative to the project when possible, with forward slashes."""
+    try:
+        stored_path = os.path.relpath(image_path, os.path.dirname(os.path.abspath(project_path)))
+    except ValueError:
+        stored_path = os.path.abspath(image_path)  # Different drive on Windows
+    return stored_path.replace(os.sep, "/")
+
+
+def has_texture(selection_set):
+    """Whether a selection set has a texture, and the quad it was extracted from, to restore on load."""
+    return selection_set.get('texture') is not None and bool(selection_set.get('quad'))
+
+
+def save_project(path, images, selection_sets, settings, current_index=None):
+    """Write a project file.
+
+    ``images`` lists {'path', 'hash'} for every image in the session; each selection
+    set's 'image' is an index into it. Only sets that still have a texture keep
+    their quad, so textures cleared from the map stay cleared.
+    """
+    project = {
+        'version': PROJECT_VERSION,
+        'images': [{'path': stored_image_path(image['path'], path), 'hash': image['hash']} for image in images],
+        'settings': settings,
+        'current_set': current_index,
+        'sets': [{'image': selection_set['image'],
+                  'points': [list(point) for point in selection_set['points']],
+                  'quad': [list(point) for point in selection_set['quad']] if has_texture(selection_set) else None,
+                  'quality': selection_set.get('quality', DEFAULT_WARP_QUALITY),
+                  'curve': selection_set.get('curve'),
+                  'quad_curve': selection_set.get('quad_curve') if has_texture(selection_set) else None}
+                 for selection_set in selection_sets],
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(project, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def load_project(path):
+    """Read a project file, resolving image paths to absolute ones."""
+    with open(path) as f:
+        project = json.load(f)
+    version = project.get('version')
+    if version not in (1, 2, PROJECT_VERSION):
+        raise ValueError(f"Unsupported project version {version!r}")
+
+    # Version 1 projects had one image that every set came from
+    images = [project['image']] if version == 1 else project['images']
+    project_dir = os.path.dirname(os.path.abspath(path))
+    images = [{'path': os.path.normpath(os.path.join(project_dir, image['path'])), 'hash': image.get('hash')}
+              for image in images]
+    sets = []
+    for entry in project['sets']:
+        points = [(float(x), float(y)) for x, y in entry['points']]
+        quad = [(float(x), float(y)) for x, y in entry['quad']] if entry.get('quad') else None
+        quality = entry.get('quality', DEFAULT_WARP_QUALITY)
+        image = entry.get('image', 0)
+        try:
+            curve = load_curve(entry.get('curve'))
+            quad_curve = load_curve(entry.get('quad_curve'))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: {e}")
+        if len(points) > 4 or (quad is not None and len(quad) != 4):
+            raise ValueError(f"{path}: a selection set needs at most 4 points and a 4-point quad")
+        if curve is not None and len(points) != 4:
+            raise ValueError(f"{path}: a curved selection set needs 4 points")
+        if quality not in WARP_QUALITIES:
+            raise ValueError(f"{path}: unknown warp quality {quality!r}")
+        if image not in range(len(images)):
+            raise ValueError(f"{path}: a selection set refers to image {image!r}, which is not in the project")
+        sets.append({'image': image, 'points': points, 'quad': quad, 'quality': quality, 'curve': curve,
+                     'quad_curve': quad_curve if quad is not None else None})
+    return {
+        'images': images,
+        'settings': project.get('settings', {}),
+        'current_set': project.get('current_set'),
+        'sets': sets,
+    }
+
+
+def load_curve(entry):
+    """A selection set's 'curve' from a project file, checked and with tuple points; None for straight sets."""
+    if entry is None:
+        return None
+    kind = entry.get('kind')
+    if kind == 'bezier':
+        handles = [(float(x), float(y)) for x, y in entry['handles']]
+        if len(handles) != 8:
+            raise ValueError("a Bezier selection needs 8 handles")
+        return {'kind': 'bezier', 'handles': handles}
+    if kind == 'mesh':
+        columns, rows = int(entry['columns']), int(entry['rows'])
+        points = [(float(x), float(y)) for x, y in entry['points']]
+        if columns < 1 or rows < 1 or len(points) != (columns + 1) * (rows + 1):
+            raise ValueError(f"a {columns}x{rows} mesh needs {(columns + 1) * (rows + 1)} points")
+        return {'kind': 'mesh', 'columns': columns, 'rows': rows, 'points': points}
+    raise ValueError(f"unknown selection shape {kind!r}")
+
+
+def cache_textures(selection_sets, images, cache):
+    """Store the extracted textures that are not cached yet, so the next load needs no warps.
+
+    ``images`` is the session's list of {'path', 'hash'} that the sets' 'image' indices refer to.
+    """
+    for selection_set in selection_sets:
+        texture = selection_set.get('texture')
+        quad = selection_set.get('quad')
+        if texture is None or quad is None:
+            continue
+        if isinstance(texture, LazyTexture):
+            continue  # Already cached when it was materialized, or never needed
+        image_hash = images[selection_set['image']]['hash']
+        key = texture_cache_key(image_hash, quad, texture.size,
+                                *texture_cache_extra(selection_set.get('quality', DEFAULT_WARP_QUALITY),
+                                                     selection_set.get('quad_curve')))
+        if key not in cache:
+            cache.put(key, texture)
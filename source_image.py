@@ -0,0 +1,297 @@
+"""Decoded source images shared by the display and extraction paths."""
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sys
+import tempfile
+import threading
+import weakref
+
+import cv2
+import numpy as np
+
+try:
+    import tifffile
+except ImportError:  # Optional: only needed to stream TIFFs larger than STREAM_THRESHOLD_BYTES
+    tifffile = None
+
+# TIFFs that decode to more than this are memory-mapped instead of decoded into RAM
+STREAM_THRESHOLD_BYTES = 1024 * 1024 * 1024
+# Decoded images kept in memory at once in a multi-image session
+SOURCE_CACHE_BYTES = 1024 * 1024 * 1024
+
+
+def temp_memmap(shape, dtype=np.uint8):
+    """A writable array backed by an anonymous temporary file instead of RAM."""
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=shape)
+
+
+def rgb_view(array):
+    """View an 8-bit gray, RGB or RGBA array as H x W x 3 RGB without copying it."""
+    if array.dtype != np.uint8:
+        raise ValueError(f"Only 8-bit images can be memory-mapped, got {array.dtype}")
+    if array.ndim == 3 and array.shape[2] == 1:
+        array = array[..., 0]
+    if array.ndim == 2:
+        # Repeat the gray channel with a zero stride
+        return np.lib.stride_tricks.as_strided(array, shape=array.shape + (3,), strides=array.strides + (0,),
+                                               writeable=False)
+    if array.ndim == 3 and array.shape[2] in (3, 4):
+        return array[..., :3]
+    raise ValueError(f"Unsupported image shape {array.shape}")
+
+
+class SourceImage:
+    """A single pixel buffer for one loaded image.
+
+    Both the canvas display and the perspective warp read from ``pixels``, so an
+    image file is decoded exactly once per load. Decoded files keep OpenCV's BGR
+    channel order (``bgr``); ``read_region`` and the display tiles convert only
+    the pixels they use, so the whole frame is never converted. For ``.npy`` files and large TIFFs
+    ``pixels`` is memory-mapped from disk, so images larger than RAM can be opened;
+    only the parts that are read (via ``read_region`` or the pyramid) are paged in.
+    """
+
+    def __init__(self, pixels, path=None, mapped=False, bgr=False):
+        self.pixels = pixels
+        self.path = path
+        self.mapped = mapped  # pixels live on disk rather than in RAM
+        self.bgr = bgr  # pixels are in BGR rather than RGB order
+        self.height, self.width = pixels.shape[:2]
+
+    @classmethod
+    def open(cls, path):
+        """Open an image file as an RGB array, memory-mapping it where the format allows."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".npy":
+            return cls.open_npy(path)
+        if extension in (".tif", ".tiff") and tifffile is not None:
+            source = cls.open_tiff(path)
+            if source is not None:
+                return source
+        return cls.decode(path)
+
+    @classmethod
+    def open_npy(cls, path):
+        """Memory-map a raw H x W (x 1/3/4) uint8 array saved with numpy.save; channels are RGB(A)."""
+        return cls(rgb_view(np.load(path, mmap_mode="r")), path, mapped=True)
+
+    @classmethod
+    def open_tiff(cls, path):
+        """Memory-map a large 8-bit TIFF, or None to decode it like any other image.
+
+        Uncompressed, contiguous TIFFs are mapped directly; others (e.g. tiled and
+        compressed) are decoded tile by tile into a temporary file. Planar (channel
+        first) TIFFs are viewed channel last without copying; layouts that are not a
+        single gray or color image (e.g. stacks of pages) fall back to decoding.
+        """
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            if series.dtype != np.uint8 or series.size < STREAM_THRESHOLD_BYTES:
+                return None
+            axes, shape = series.axes, series.shape
+            planar = len(shape) == 3 and axes[0] in "SC" and shape[0] in (1, 3, 4)
+            if not (axes == "YX" or (len(shape) == 3 and axes[-1] in "SC" and shape[2] in (1, 3, 4)) or planar):
+                return None
+            try:
+                pixels = tifffile.memmap(path, mode="r")
+            except ValueError:
+                pixels = series.asarray(out=temp_memmap(series.shape, series.dtype))
+        if planar:
+            pixels = np.moveaxis(pixels, 0, -1)
+        return cls(rgb_view(pixels), path, mapped=True)
+
+    @classmethod
+    def decode(cls, path):
+        """Decode an image file into a BGR array in memory."""
+        # imdecode on the raw bytes copes with non-ASCII paths on Windows, unlike cv2.imread
+        data = np.fromfile(path, dtype=np.uint8)
+        pixels = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        del data
+        if pixels is None:
+            raise ValueError(f"Unsupported or corrupt image file: {path}")
+        return cls(pixels, path, bgr=True)
+
+    @property
+    def size(self):
+        """(width, height) in pixels, matching PIL's ``Image.size``."""
+        return self.width, self.height
+
+    @property
+    def nbytes(self):
+        """Memory held by the decoded pixels; memory-mapped pixels are only paged in as needed."""
+        return 0 if self.mapped else self.pixels.nbytes
+
+    def read_region(self, x0, y0, x1, y1):
+        """Contiguous RGB copy (or in-memory view) of the pixels in [x0, x1) x [y0, y1), clipped to the image."""
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(self.width, int(x1)), min(self.height, int(y1))
+        window = self.pixels[y0:y1, x0:x1]
+        if self.bgr:
+            # The conversion doubles as the copy, so BGR sources cost nothing extra here
+            return cv2.cvtColor(window, cv2.COLOR_BGR2RGB)
+        return np.ascontiguousarray(window)
+
+
+class SourceCache:
+    """Opened SourceImages by path, with their display pyramids once built; the least
+    recently used are dropped beyond a memory budget.
+
+    Memory-mapped sources cost nothing against the budget, their in-memory pyramid
+    levels do. A source that was dropped
+    but is still in use elsewhere (the displayed image, a running extraction) is
+    picked up again instead of being decoded a second time. Safe to use from several
+    threads; each image is decoded by one thread at a time while others stay available.
+    """
+
+    def __init__(self, max_bytes=SOURCE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.sources = OrderedDict()  # path -> SourceImage, least recently used first
+        self.pyramids = {}  # path -> ImagePyramid of the cached source, once built
+        self.nbytes = 0
+        self.live = weakref.WeakValueDictionary()  # path -> every SourceImage still referenced somewhere
+        self.lock = threading.Lock()
+        # path -> [lock held while that image is being decoded, threads holding or waiting for it]
+        self.path_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self.sources
+
+    def get(self, path):
+        """The SourceImage for an image file, opening it if it is not in memory."""
+        path = os.path.abspath(path)
+        with self._path_lock(path):
+            with self.lock:
+                source = self.sources.get(path) or self.live.get(path)
+                if source is not None:
+                    self.hits += 1
+                    self._insert(path, source)
+                    return source
+            # Decode outside the cache lock so other images can be fetched meanwhile
+            source = SourceImage.open(path)
+            with self.lock:
+                self.misses += 1
+                self._insert(path, source)
+            return source
+
+    def get_pyramid(self, path):
+        """The SourceImage of an image file and its ImagePyramid, building the pyramid only if it is not cached.
+
+        Switching back to an image then costs neither a decode nor a mip build.
+        """
+        from pyramid import ImagePyramid  # pyramid imports this module
+
+        path = os.path.abspath(path)
+        source = self.get(path)
+        with self._path_lock(path):
+            with self.lock:
+                pyramid = self.pyramids.get(path)
+            if pyramid is not None and pyramid.levels[0] is source.pixels:
+                return source, pyramid
+            pyramid = ImagePyramid(source.pixels, bgr=source.bgr)
+            with self.lock:
+                if self.sources.get(path) is source:
+                    self.nbytes += pyramid.nbytes - (self.pyramids[path].nbytes if path in self.pyramids else 0)
+                    self.pyramids[path] = pyramid
+                    self._evict()
+            return source, pyramid
+
+    @contextmanager
+    def _path_lock(self, path):
+        """Hold the lock of one image; it is forgotten once no thread holds or waits for it."""
+        with self.lock:
+            entry = self.path_locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.path_locks[path]
+
+    def _insert(self, path, source):
+        """Store or refresh a source as most recently used, then evict down to the budget. Needs the lock."""
+        if path in self.sources:
+            self.sources.move_to_end(path)
+            return
+        self.sources[path] = source
+        self.live[path] = source
+        self.nbytes += source.nbytes
+        self._evict()
+
+    def _evict(self):
+        """Drop the least recently used sources, with their pyramids, until within the budget. Needs the lock."""
+        while self.nbytes > self.max_bytes and len(self.sources) > 1:
+            path, evicted = self.sources.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            pyramid = self.pyramids.pop(path, None)
+            if pyramid is not None:
+                self.nbytes -= pyramid.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.sources.clear()
+            self.pyramids.clear()
+            self.nbytes = 0
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes, or None if unavailable."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS but in kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def format_bytes(num_bytes):
+    """Human readable byte count, e.g. '120.6 MB'."""
+    if num_bytes is None:
+        return "n/a"
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes} B"
+        num_bytes /= 1024
+
+
+def memory_report(source):
+    """One-line summary of the decoded source size and the process peak memory."""
+    if source is None:
+        return f"Peak memory: {format_bytes(peak_rss_bytes())}"
+    if source.mapped:
+        return (f"{source.width}x{source.height} memory-mapped, "
+                f"peak memory: {format_bytes(peak_rss_bytes())}")
+    return (f"{source.width}x{source.height} decoded ({format_bytes(source.nbytes)}), "
+            f"peak memory: {format_bytes(peak_rss_bytes())}")
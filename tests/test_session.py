@@ -0,0 +1,56 @@
+"""Project files: what is saved is what comes back."""
+from types import SimpleNamespace
+
+import pytest
+
+from session import load_project, save_project
+
+QUAD = [(10.0, 10.0), (90.0, 12.0), (88.0, 70.0), (12.0, 68.0)]
+
+
+def extracted_set(image=0):
+    return {'image': image, 'points': list(QUAD), 'texture': object(), 'quad': list(QUAD), 'quality': 'bilinear',
+            'curve': None, 'quad_curve': None}
+
+
+def save_and_load(tmp_path, selection_sets, settings=None):
+    image_path = tmp_path / "photo.png"
+    image_path.write_bytes(b"")
+    project_path = str(tmp_path / "project.trproj")
+    save_project(project_path, [{'path': str(image_path), 'hash': "hash"}], selection_sets, settings or {})
+    return load_project(project_path)
+
+
+def test_extracted_quads_are_saved(tmp_path):
+    project = save_and_load(tmp_path, [extracted_set()])
+    assert project['sets'][0]['quad'] == QUAD
+
+
+def test_packing_and_output_settings_are_saved(tmp_path):
+    settings = {'method': 'maxrects', 'padding': 4,
+                'output': {'format': '.webp', 'compression': 'smallest', 'alpha': True, 'binary_manifest': True}}
+    assert save_and_load(tmp_path, [extracted_set()], settings)['settings'] == settings
+
+
+def test_sets_without_texture_save_no_quad(tmp_path):
+    selection_set = extracted_set()
+    selection_set['texture'] = None
+    project = save_and_load(tmp_path, [selection_set])
+    assert project['sets'][0]['quad'] is None
+    assert project['sets'][0]['points'] == QUAD
+
+
+def test_cleared_map_stays_cleared_after_save_and_load(tmp_path, monkeypatch):
+    texture_ripper = pytest.importorskip("texture_ripper")
+    monkeypatch.setattr(texture_ripper.messagebox, "showinfo", lambda *args: None)
+    app = SimpleNamespace(selection_sets=[extracted_set(), extracted_set()], map_page=3,
+                          worker=SimpleNamespace(cancel_all=lambda kind: None),
+                          atlas=SimpleNamespace(clear=lambda: None), run_map_job=lambda *args: None)
+
+    texture_ripper.TextureRipperApp.clear_map(app)
+    assert all(selection_set['quad'] is None for selection_set in app.selection_sets)
+
+    project = save_and_load(tmp_path, app.selection_sets)
+    # restore_project only recreates textures for sets with a quad
+    assert [entry['quad'] for entry in project['sets']] == [None, None]
+    assert [entry['points'] for entry in project['sets']] == [QUAD, QUAD]
@@ -1,8 +1,41 @@
-import tkinter as tk
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
-import cv2
-import numpy as np
+import os
+import sys
+import time
+
+from PIL import Image
+
+from atlas import DEFAULT_ATLAS_OPTIONS, TextureAtlas, save_atlas
+from curves import (CURVE_SHAPES, RemapCache, copy_curve, curve_handles, curve_polylines, curve_shape, make_curve,
+                    move_handle, warp_curve_preview, warp_source_curve)
+from encoders import COMPRESSIONS, DEFAULT_COMPRESSION, SAVE_FILETYPES, SAVE_FORMATS
+from extraction import DEFAULT_WARP_QUALITY, WARP_QUALITIES, warp_quad_preview, warp_source_quad, warp_source_quads
+from packing import PACKERS, PackingError
+from profiling import PROFILER, timed
+from pyramid import TileCache, TileRenderer
+from session import (PROJECT_EXTENSION, LazyTexture, TextureDiskCache, cache_textures, image_fingerprint,
+                     load_project, save_project)
+from source_image import SourceCache, format_bytes, memory_report
+from workers import BackgroundWorker
+
+# `python texture_ripper.py batch ...` runs without a GUI, so Tk is never imported in that
+# process or in the batch worker processes that re-import this module on spawn
+HEADLESS = sys.argv[1:2] == ["batch"]
+
+if not HEADLESS:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+    from PIL import ImageTk
+
+FRAME_INTERVAL_MS = 16  # Drag updates are coalesced to at most one per display frame
+# Large scans can be opened as tiled TIFFs or raw .npy arrays, which are memory-mapped instead of decoded
+IMAGE_FILETYPES = [("Image Files", "*.png;*.jpg;*.jpeg;*.bmp;*.tif;*.tiff;*.npy")]
+PREVIEW_SIZE = 200  # Live preview of the current quad fits in PREVIEW_SIZE x PREVIEW_SIZE
+STATS_INTERVAL_MS = 500  # Refresh interval of the stats overlay (F3)
+# Spans shown in the stats overlay, UI thread first, once they have been recorded
+OVERLAY_SPANS = ["display_image", "update_tiles", "draw_grid", "drag_frame", "update_preview", "extract_texture",
+                 "extract_all", "update_texture_map", "display_texture_map", "save_texture_map", "load_image"]
+ATLAS_SIZE_CHOICES = ["Auto", "Power of two", "1024", "2048", "4096", "8192"]
+MAX_SIZE_CHOICES = ["2048", "4096", "8192", "16384", "Unlimited"]
 
 class TextureRipperApp:
     def __init__(self, root):
@@ -10,9 +43,25 @@ class TextureRipperApp:
         self.root.title("Texture Ripper")
 
         # Initialize variables
-        self.image = None
-        self.image_path = None
-        self.canvas_image = None
+        self.source = None  # Decoded pixels of the shown image, shared by display and extraction
+        # Every image in the session as {'path', 'hash'}; the hash is the file's fingerprint and keys the
+        # texture cache. Selection sets refer to their image by index.
+        self.images = []
+        self.current_image = None  # Index of the image shown on the canvas
+        self.source_cache = SourceCache()  # Opened images, within a memory budget
+        self.texture_cache = TextureDiskCache()  # Extracted textures kept on disk between sessions
+        self.remap_cache = RemapCache()  # Lookup grids of curved selections, rebuilt when their points move
+        self.tile_cache = TileCache()  # LRU of rendered display tiles, capped in memory
+        self.tile_renderer = None  # Renders visible tiles from the image pyramid
+        self.canvas_tiles = {}  # (tx, ty) -> (canvas item, PhotoImage) for tiles on the canvas
+        self.redraw_pending = None  # after_idle id of a scheduled tile refresh
+        # Selection set index -> {'points': [oval ids], 'lines': [line ids], 'handles': [oval ids],
+        # 'curves': [line ids]}; handles and curves are only drawn for curved selections
+        self.grid_items = {}
+        self.shown_grid_index = None  # Selection set whose grid items are currently visible
+        self.selected_point = None  # Index of the grabbed corner, or ('handle', i) for a curve's control point
+        self.drag_pending = None  # after id of the coalesced drag update
+        self.drag_moved = False  # Whether the selected point moved since it was grabbed
         self.selection_sets = []  # List of selection sets
         self.current_selection_set_index = None
         self.zoom_level = 1.0  # Default zoom level (1.0 = no zoom)
@@ -21,8 +70,12 @@ class TextureRipperApp:
         self.pan_start_x = 0  # For tracking the starting point of the pan
         self.pan_start_y = 0
         self.is_panning = False  # Whether we are currently panning
-        self.map_image = None  # Composite image (map) of all extracted textures
+        self.atlas = TextureAtlas()  # Composite image (map) of all extracted textures, keyed by set index
+        self.map_page = 0  # Page of the map shown on the extracted canvas
+        # Only jobs on the worker's serial thread touch the atlas; the UI reads this summary of it
+        self.map_info = {'pages': [], 'efficiency': 0.0}
         self.zoom_active = False  # Whether zoom mode is active
+        self.stats_after = None  # after id of the next stats overlay refresh while it is shown
 
         # Create the main frames
         self.main_frame = tk.Frame(root)
@@ -36,9 +89,31 @@ class TextureRipperApp:
         self.canvas = tk.Canvas(self.main_frame, width=self.canvas_width, height=self.canvas_height, bg='gray')
         self.canvas.pack(side=tk.LEFT)
 
-        # Create area for displaying the extracted texture map
-        self.extracted_canvas = tk.Canvas(self.main_frame, width=400, height=400, bg="gray")
-        self.extracted_canvas.pack(side=tk.LEFT, padx=10)
+        # Create area for displaying the extracted texture map, one page at a time
+        self.map_frame = tk.Frame(self.main_frame)
+        self.map_frame.pack(side=tk.LEFT, padx=10)
+
+        self.extracted_canvas = tk.Canvas(self.map_frame, width=400, height=400, bg="gray")
+        self.extracted_canvas.pack(side=tk.TOP)
+
+        self.page_frame = tk.Frame(self.map_frame)
+        self.page_frame.pack(side=tk.TOP, pady=5)
+
+        self.prev_page_button = tk.Button(self.page_frame, text="<", command=self.prev_map_page)
+        self.prev_page_button.pack(side=tk.LEFT, padx=5)
+
+        self.page_label = tk.Label(self.page_frame, text="")
+        self.page_label.pack(side=tk.LEFT, padx=5)
+
+        self.next_page_button = tk.Button(self.page_frame, text=">", command=self.next_map_page)
+        self.next_page_button.pack(side=tk.LEFT, padx=5)
+
+        # Live low-resolution preview of the current quad, updated while dragging its corners
+        self.preview_label = tk.Label(self.map_frame, text="Preview")
+        self.preview_label.pack(side=tk.TOP)
+
+        self.preview_canvas = tk.Canvas(self.map_frame, width=PREVIEW_SIZE, height=PREVIEW_SIZE, bg="gray")
+        self.preview_canvas.pack(side=tk.TOP)
 
         # Button frame to hold buttons
         self.button_frame = tk.Frame(root)
@@ -51,6 +126,13 @@ class TextureRipperApp:
         self.load_button = tk.Button(self.first_row_frame, text="Load Image", command=self.load_image)
         self.load_button.pack(side=tk.LEFT, padx=5)
 
+        # Images loaded so far; selection sets from all of them go into the same map
+        tk.Label(self.first_row_frame, text="Image:").pack(side=tk.LEFT)
+        self.image_var = tk.StringVar(value="")
+        self.image_menu = tk.OptionMenu(self.first_row_frame, self.image_var, "")
+        self.image_menu.config(width=20)
+        self.image_menu.pack(side=tk.LEFT, padx=5)
+
         self.add_selection_set_button = tk.Button(self.first_row_frame, text="Add Selection Set", command=self.add_selection_set)
         self.add_selection_set_button.pack(side=tk.LEFT, padx=5)
 
@@ -60,6 +142,15 @@ class TextureRipperApp:
         self.next_selection_set_button = tk.Button(self.first_row_frame, text="Next Set", command=self.next_selection_set)
         self.next_selection_set_button.pack(side=tk.LEFT, padx=5)
 
+        self.extract_all_button = tk.Button(self.first_row_frame, text="Extract All", command=self.extract_all)
+        self.extract_all_button.pack(side=tk.LEFT, padx=5)
+
+        self.open_project_button = tk.Button(self.first_row_frame, text="Open Project", command=self.open_project)
+        self.open_project_button.pack(side=tk.LEFT, padx=5)
+
+        self.save_project_button = tk.Button(self.first_row_frame, text="Save Project", command=self.save_project)
+        self.save_project_button.pack(side=tk.LEFT, padx=5)
+
         # Second row buttons
         self.second_row_frame = tk.Frame(self.button_frame)
         self.second_row_frame.pack(side=tk.TOP, pady=5)
@@ -67,9 +158,37 @@ class TextureRipperApp:
         self.extract_button = tk.Button(self.second_row_frame, text="Extract Texture", command=self.extract_texture)
         self.extract_button.pack(side=tk.LEFT, padx=5)
 
+        # Resampling used by Extract Texture; mipmap avoids aliasing on strongly foreshortened quads
+        tk.Label(self.second_row_frame, text="Quality:").pack(side=tk.LEFT)
+        self.quality_var = tk.StringVar(value=DEFAULT_WARP_QUALITY)
+        self.quality_menu = tk.OptionMenu(self.second_row_frame, self.quality_var, *WARP_QUALITIES)
+        self.quality_menu.pack(side=tk.LEFT, padx=5)
+
+        # Bezier edges or a control mesh let curved surfaces (bottles, pillars) unwrap in one pass
+        tk.Label(self.second_row_frame, text="Shape:").pack(side=tk.LEFT)
+        self.shape_var = tk.StringVar(value=CURVE_SHAPES[0])
+        self.shape_menu = tk.OptionMenu(self.second_row_frame, self.shape_var, *CURVE_SHAPES, command=self.set_shape)
+        self.shape_menu.pack(side=tk.LEFT, padx=5)
+
         self.save_button = tk.Button(self.second_row_frame, text="Save As", command=self.save_texture_map)
         self.save_button.pack(side=tk.LEFT, padx=5)
 
+        # Also write the manifest in compact binary form when saving
+        self.binary_manifest_var = tk.BooleanVar(value=False)
+        self.binary_manifest_check = tk.Checkbutton(self.second_row_frame, text="Binary Manifest",
+                                                    variable=self.binary_manifest_var)
+        self.binary_manifest_check.pack(side=tk.LEFT, padx=5)
+
+        # Encoding effort when saving (the format follows the file extension), and transparent unused space
+        tk.Label(self.second_row_frame, text="Compression:").pack(side=tk.LEFT)
+        self.compression_var = tk.StringVar(value=DEFAULT_COMPRESSION)
+        self.compression_menu = tk.OptionMenu(self.second_row_frame, self.compression_var, *COMPRESSIONS)
+        self.compression_menu.pack(side=tk.LEFT, padx=5)
+        self.alpha_var = tk.BooleanVar(value=False)
+        self.alpha_check = tk.Checkbutton(self.second_row_frame, text="Alpha", variable=self.alpha_var)
+        self.alpha_check.pack(side=tk.LEFT, padx=5)
+        self.map_extension = ".png"  # Format of the last saved map, offered first by the save dialog
+
         self.reset_button = tk.Button(self.second_row_frame, text="Reset View", command=self.reset_view)
         self.reset_button.pack(side=tk.LEFT, padx=5)
 
@@ -79,6 +198,58 @@ class TextureRipperApp:
         self.clear_map_button = tk.Button(self.second_row_frame, text="Clear Map", command=self.clear_map)
         self.clear_map_button.pack(side=tk.LEFT, padx=5)
 
+        # Third row: texture map packing settings
+        self.packing_frame = tk.Frame(self.button_frame)
+        self.packing_frame.pack(side=tk.TOP, pady=5)
+
+        tk.Label(self.packing_frame, text="Packing:").pack(side=tk.LEFT)
+        self.packer_var = tk.StringVar(value=DEFAULT_ATLAS_OPTIONS['method'])
+        self.packer_menu = tk.OptionMenu(self.packing_frame, self.packer_var, *PACKERS,
+                                         command=self.on_atlas_setting_changed)
+        self.packer_menu.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(self.packing_frame, text="Padding:").pack(side=tk.LEFT)
+        self.padding_var = tk.IntVar(value=DEFAULT_ATLAS_OPTIONS['padding'])
+        self.padding_spinbox = tk.Spinbox(self.packing_frame, from_=0, to=64, width=3, textvariable=self.padding_var,
+                                          command=self.on_atlas_setting_changed)
+        self.padding_spinbox.pack(side=tk.LEFT, padx=5)
+
+        self.bleed_var = tk.BooleanVar(value=DEFAULT_ATLAS_OPTIONS['bleed'])
+        self.bleed_check = tk.Checkbutton(self.packing_frame, text="Bleed", variable=self.bleed_var,
+                                          command=self.on_atlas_setting_changed)
+        self.bleed_check.pack(side=tk.LEFT, padx=5)
+
+        self.rotate_var = tk.BooleanVar(value=DEFAULT_ATLAS_OPTIONS['allow_rotation'])
+        self.rotate_check = tk.Checkbutton(self.packing_frame, text="Allow Rotation", variable=self.rotate_var,
+                                           command=self.on_atlas_setting_changed)
+        self.rotate_check.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(self.packing_frame, text="Map Size:").pack(side=tk.LEFT)
+        self.atlas_size_var = tk.StringVar(value=ATLAS_SIZE_CHOICES[0])
+        self.atlas_size_menu = tk.OptionMenu(self.packing_frame, self.atlas_size_var, *ATLAS_SIZE_CHOICES,
+                                             command=self.on_atlas_setting_changed)
+        self.atlas_size_menu.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(self.packing_frame, text="Max Page Size:").pack(side=tk.LEFT)
+        self.max_size_var = tk.StringVar(value=str(DEFAULT_ATLAS_OPTIONS['max_size']))
+        self.max_size_menu = tk.OptionMenu(self.packing_frame, self.max_size_var, *MAX_SIZE_CHOICES,
+                                           command=self.on_atlas_setting_changed)
+        self.max_size_menu.pack(side=tk.LEFT, padx=5)
+
+        # Status bar for image and memory information, with progress of background work
+        self.status_frame = tk.Frame(root)
+        self.status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 5))
+
+        self.progress = ttk.Progressbar(self.status_frame, mode='determinate', length=150)
+        self.progress.pack(side=tk.RIGHT)
+
+        self.status_label = tk.Label(self.status_frame, text="", anchor=tk.W)
+        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        # Decoding, warping, packing and thumbnails run in the background to keep the window responsive
+        self.worker = BackgroundWorker(root, on_progress=self.show_progress)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
         # Bind mouse events for adding points, panning, zooming, and dragging
         self.canvas.bind("<Button-1>", self.add_or_select_point)
         self.canvas.bind("<B1-Motion>", self.drag_point)
@@ -96,56 +267,332 @@ class TextureRipperApp:
         self.root.bind("<Control_R>", self.enable_zoom_mode)
         self.root.bind("<KeyRelease-Control_L>", self.disable_zoom_mode)
         self.root.bind("<KeyRelease-Control_R>", self.disable_zoom_mode)
+        self.root.bind("<F3>", self.toggle_stats_overlay)
+        self.root.bind("<Shift-F3>", self.export_trace)
 
     def load_image(self):
-        """Load an image file."""
-        self.image_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.bmp")])
-        if not self.image_path:
-            return
-        try:
-            self.image = Image.open(self.image_path)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to open image:\n{e}")
+        """Add an image to the session and show it; selection sets on the other images are kept."""
+        image_path = filedialog.askopenfilename(filetypes=IMAGE_FILETYPES)
+        if not image_path:
             return
+        image_path = os.path.abspath(image_path)
+        for index, image in enumerate(self.images):
+            if image['path'] == image_path:
+                self.select_image(index)
+                return
+
+        def loaded(source, image_hash, pyramid):
+            self.images.append({'path': image_path, 'hash': image_hash})
+            self.show_image(len(self.images) - 1, source, pyramid)
+            # Automatically add the first selection set
+            self.add_selection_set(first_set=True)
+            self.update_status()
+
+        self.open_image(image_path, loaded)
+
+    @timed("load_image")
+    def decode_image(self, image_path, image_hash=None):
+        """Open an image through the source cache, fingerprint it unless ``image_hash`` is known,
+        and build its pyramid (or reuse the cached one). Runs on a worker thread."""
+        # Decoded and mip-mapped once; both are reused until the cache's memory budget pushes them out
+        source, pyramid = self.source_cache.get_pyramid(image_path)
+        if image_hash is None:
+            image_hash = image_fingerprint(image_path)
+        return source, image_hash, pyramid
+
+    def open_image(self, image_path, on_loaded, image_hash=None):
+        """Decode an image in the background, then call on_loaded(source, image_hash, pyramid)."""
+        self.status_label.config(text=f"Loading {os.path.basename(image_path)}...")
+        self.worker.submit(('load',), self.decode_image, image_path, image_hash,
+                           on_done=lambda result: on_loaded(*result),
+                           on_error=lambda e: messagebox.showerror("Error", f"Failed to open image:\n{e}"))
+
+    def show_image(self, index, source, pyramid):
+        """Display one of the session's images, resetting the view; selection sets and the map are kept.
+
+        No selection set is current afterwards; callers pick one on this image.
+        """
+        self.current_image = index
+        self.source = source
+
+        # Tiles for the old image are no longer valid
+        self.tile_cache.clear()
+        self.tile_renderer = TileRenderer(pyramid, self.tile_cache)
 
         # Reset variables
         self.zoom_level = 1.0
         self.canvas_offset_x = 0
         self.canvas_offset_y = 0
-        self.selection_sets = []
         self.current_selection_set_index = None
-        self.map_image = None
-        self.extracted_canvas.delete("all")
+        self.selected_point = None
         self.canvas.delete("all")
+        self.canvas_tiles = {}
+        self.grid_items = {}
+        self.shown_grid_index = None
 
         # Get image dimensions
-        self.img_width, self.img_height = self.image.size
+        self.img_width, self.img_height = self.source.size
 
         # Adjust canvas size based on image size while maintaining aspect ratio
         self.scale = min(self.canvas_width / self.img_width, self.canvas_height / self.img_height)
         self.canvas.config(width=self.canvas_width, height=self.canvas_height)
 
+        self.refresh_image_menu()
         self.display_image()
+        self.update_status()
 
-        # Automatically add the first selection set
-        self.add_selection_set(first_set=True)
+    def switch_image(self, index, on_shown=None):
+        """Show another of the session's images (decoding it again if it left the source cache), then call on_shown."""
+        if index == self.current_image:
+            if on_shown is not None:
+                on_shown()
+            return
+        image = self.images[index]
+
+        def loaded(source, image_hash, pyramid):
+            self.show_image(index, source, pyramid)
+            if on_shown is not None:
+                on_shown()
+
+        self.open_image(image['path'], loaded, image['hash'])
+
+    def image_label(self, index):
+        """Name of an image in the Image menu; numbered, as photos from different folders often share names."""
+        return f"{index + 1}: {os.path.basename(self.images[index]['path'])}"
+
+    def refresh_image_menu(self):
+        """List the session's images in the Image menu, with the shown one selected."""
+        menu = self.image_menu["menu"]
+        menu.delete(0, "end")
+        for index in range(len(self.images)):
+            menu.add_command(label=self.image_label(index), command=lambda index=index: self.select_image(index))
+        self.image_var.set(self.image_label(self.current_image) if self.current_image is not None else "")
+
+    def select_image(self, index):
+        """Show an image from the Image menu, with its last selection set (or a new one) current."""
+        sets = [i for i, selection_set in enumerate(self.selection_sets) if selection_set['image'] == index]
+        if sets:
+            self.select_set(sets[-1])
+        else:
+            self.switch_image(index, lambda: self.add_selection_set(first_set=True))
 
+    def select_set(self, index):
+        """Make a selection set current, first showing its image if another one is displayed."""
+        def select():
+            self.current_selection_set_index = index
+            self.selected_point = None
+            self.draw_grid()
+
+        self.switch_image(self.selection_sets[index]['image'], select)
+
+    def reset_session(self):
+        """Forget every image, selection set and texture, e.g. before opening a project."""
+        self.worker.cancel_all('extract')
+        self.remap_cache.clear()
+        self.images = []
+        self.current_image = None
+        self.selection_sets = []
+        self.current_selection_set_index = None
+        self.map_page = 0
+        self.run_map_job(self.atlas.clear)
+
+    def open_project(self):
+        """Load a project: its images, selection sets, and packing and output settings.
+
+        Textures are not re-extracted up front; each one is read from the texture
+        cache or re-warped the first time its map page is shown or saved.
+        """
+        project_path = filedialog.askopenfilename(filetypes=[("Texture Ripper Projects", "*" + PROJECT_EXTENSION)])
+        if not project_path:
+            return
+        try:
+            project = load_project(project_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to open project:\n{e}")
+            return
+
+        images = project['images']
+        for image in images:
+            if not os.path.exists(image['path']):
+                messagebox.showwarning("Warning", f"Image not found:\n{image['path']}\n\nPlease locate it.")
+                image_path = filedialog.askopenfilename(filetypes=IMAGE_FILETYPES)
+                if not image_path:
+                    return
+                image['path'] = os.path.abspath(image_path)
+
+        # Fingerprinting reads a couple of MiB per image, so it runs in the background too
+        self.status_label.config(text=f"Opening {os.path.basename(project_path)}...")
+        self.worker.submit(('load',), lambda: [image_fingerprint(image['path']) for image in images],
+                           on_done=lambda hashes: self.restore_project(project, hashes),
+                           on_error=lambda e: messagebox.showerror("Error", f"Failed to open project:\n{e}"))
+
+    def restore_project(self, project, image_hashes):
+        """Recreate a project's images, selection sets and map; ``image_hashes`` are the images' current fingerprints."""
+        changed = [os.path.basename(image['path']) for image, image_hash in zip(project['images'], image_hashes)
+                   if image['hash'] and image['hash'] != image_hash]
+        if changed:
+            messagebox.showwarning("Warning", "These images have changed since the project was saved; their "
+                                              "textures will be extracted again:\n" + "\n".join(changed))
+
+        self.reset_session()
+        self.images = [{'path': image['path'], 'hash': image_hash}
+                       for image, image_hash in zip(project['images'], image_hashes)]
+        self.apply_atlas_options(project['settings'])
+        self.apply_output_options(project['settings'].get('output', {}))
+        for entry in project['sets']:
+            image = self.images[entry['image']]
+            texture = None
+            if entry['quad'] is not None:
+                texture = LazyTexture(entry['quad'], lambda path=image['path']: self.source_cache.get(path),
+                                      image['hash'], self.texture_cache, entry['quality'], entry['quad_curve'])
+            self.selection_sets.append({'image': entry['image'], 'points': entry['points'], 'texture': texture,
+                                        'quad': entry['quad'], 'quality': entry['quality'], 'curve': entry['curve'],
+                                        'quad_curve': entry['quad_curve']})
+        self.update_texture_map()
+
+        current = project['current_set']
+        if current in range(len(self.selection_sets)):
+            self.select_set(current)
+        elif self.selection_sets:
+            self.select_set(0)
+        else:
+            self.select_image(0)
+
+    def save_project(self):
+        """Save the image references, selection sets, and packing and output settings to a project file."""
+        if self.source is None:
+            messagebox.showwarning("Warning", "Please load an image first.")
+            return
+        project_path = filedialog.asksaveasfilename(defaultextension=PROJECT_EXTENSION,
+                                                    filetypes=[("Texture Ripper Projects", "*" + PROJECT_EXTENSION)])
+        if not project_path:
+            return
+        try:
+            save_project(project_path, self.images, self.selection_sets,
+                         dict(self.atlas_options(), output=self.output_options()), self.current_selection_set_index)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save project:\n{e}")
+            return
+        # Cache the extracted textures so reopening the project needs no warping
+        self.worker.submit(None, cache_textures, list(self.selection_sets), list(self.images), self.texture_cache)
+        messagebox.showinfo("Success", "Project saved successfully.")
+
+    def update_status(self):
+        """Show the loaded image, memory usage and texture map packing in the status bar."""
+        status = memory_report(self.source)
+        if len(self.images) > 1:
+            status += (f" | {len(self.images)} images, {len(self.source_cache)} in memory "
+                       f"({format_bytes(self.source_cache.nbytes)})")
+        pages = self.map_info['pages']
+        if len(pages) == 1:
+            status += f" | Map {pages[0][0]}x{pages[0][1]}, {self.map_info['efficiency']:.0%} packed"
+        elif pages:
+            status += f" | Map {len(pages)} pages, {self.map_info['efficiency']:.0%} packed"
+        self.status_label.config(text=status)
+
+    def show_progress(self, finished, submitted):
+        """Reflect background work in the progress bar; empty when idle."""
+        self.progress.config(maximum=max(1, submitted), value=finished)
+
+    def toggle_stats_overlay(self, event=None):
+        """Show or hide recent timings, tile cache and memory stats over the image (F3)."""
+        if self.stats_after is not None:
+            self.root.after_cancel(self.stats_after)
+            self.stats_after = None
+            self.canvas.delete("stats")
+        else:
+            self.update_stats_overlay()
+
+    def update_stats_overlay(self):
+        """Redraw the stats overlay and schedule its next refresh."""
+        lines = []
+        for name in OVERLAY_SPANS:
+            count, mean, peak, last = PROFILER.stats(name)
+            if last:
+                lines.append(f"{name}: {last:.1f} ms, last 2 s: {count}x avg {mean:.1f} max {peak:.1f}")
+        counters = PROFILER.counters
+        lines.append(f"tiles: {self.tile_cache.hit_rate:.0%} cache hits, {format_bytes(self.tile_cache.nbytes)} cached, "
+                     f"{counters.get('tile resizes', 0)} resized, {counters.get('thumbnail resizes', 0)} map resizes")
+        lines.append(f"allocated: tiles {format_bytes(counters.get('tile bytes', 0))}, "
+                     f"warps {format_bytes(counters.get('warp bytes', 0))}, "
+                     f"pyramids {format_bytes(counters.get('pyramid bytes', 0))}")
+        lines.append(memory_report(self.source))
+        lines.append(f"images: {len(self.source_cache)}/{len(self.images)} in memory "
+                     f"({format_bytes(self.source_cache.nbytes)}), {self.source_cache.hits} cache hits, "
+                     f"{self.source_cache.misses} decodes")
+        if len(self.remap_cache):
+            lines.append(f"curve grids: {len(self.remap_cache)} ({format_bytes(self.remap_cache.nbytes)}), "
+                         f"{self.remap_cache.hits} reused, {self.remap_cache.misses} built")
+        lines.append(f"background jobs: {self.worker.submitted - self.worker.finished} pending")
+
+        self.canvas.delete("stats")
+        text = self.canvas.create_text(8, 8, anchor=tk.NW, text="\n".join(lines), fill="white",
+                                       font="TkFixedFont", tags="stats")
+        bounds = self.canvas.bbox(text)
+        if bounds:
+            backdrop = self.canvas.create_rectangle(bounds[0] - 4, bounds[1] - 4, bounds[2] + 4, bounds[3] + 4,
+                                                    fill="black", outline="", tags="stats")
+            self.canvas.tag_lower(backdrop, text)
+        self.stats_after = self.root.after(STATS_INTERVAL_MS, self.update_stats_overlay)
+
+    def export_trace(self, event=None):
+        """Save the recorded timings as a Chrome trace (Shift+F3), viewable in chrome://tracing or Perfetto."""
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Trace Files", "*.json")])
+        if not file_path:
+            return
+        try:
+            PROFILER.export(file_path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to export the trace:\n{e}")
+            return
+        messagebox.showinfo("Success", "Trace exported successfully.")
+
+    def close(self):
+        """Stop background work and close the window."""
+        self.worker.shutdown()
+        self.root.destroy()
+
+    @timed("display_image")
     def display_image(self):
         """Display the image on the canvas, accounting for zoom and panning."""
-        if self.image:
-            # Calculate scaled dimensions
-            scaled_width = int(self.img_width * self.scale * self.zoom_level)
-            scaled_height = int(self.img_height * self.scale * self.zoom_level)
-
-            # Resize the image
-            resized_image = self.image.resize((scaled_width, scaled_height), Image.LANCZOS)
-            self.canvas_image = ImageTk.PhotoImage(resized_image)
-
-            # Clear the canvas and display the image
-            self.canvas.delete("all")
-            self.canvas.create_image(self.canvas_offset_x, self.canvas_offset_y, anchor=tk.NW, image=self.canvas_image)
+        if self.source:
+            # The zoom level changed (or the view was reset), so every tile on the canvas is stale
+            self.canvas.delete("tile")
+            self.canvas_tiles = {}
+            self.update_tiles()
             self.draw_grid()
 
+    @timed("update_tiles")
+    def update_tiles(self):
+        """Add the tiles that became visible and drop the ones that scrolled out of view."""
+        self.redraw_pending = None
+        if self.tile_renderer is None:
+            return
+        scale = self.scale * self.zoom_level
+        visible = self.tile_renderer.visible_tiles(scale, self.canvas_offset_x, self.canvas_offset_y,
+                                                   self.canvas_width, self.canvas_height)
+
+        for key in set(self.canvas_tiles) - set(visible):
+            item, _ = self.canvas_tiles.pop(key)
+            self.canvas.delete(item)
+
+        for tx, ty in visible:
+            if (tx, ty) in self.canvas_tiles:
+                continue
+            # Only tiles that intersect the canvas are resampled, straight from the closest pyramid level
+            tile_image = ImageTk.PhotoImage(self.tile_renderer.render_tile(scale, tx, ty))
+            x, y = self.tile_renderer.tile_position(tx, ty, self.canvas_offset_x, self.canvas_offset_y)
+            item = self.canvas.create_image(x, y, anchor=tk.NW, image=tile_image, tags="tile")
+            self.canvas_tiles[(tx, ty)] = (item, tile_image)  # Keep reference
+
+        # Keep the image underneath the selection grid
+        self.canvas.tag_lower("tile")
+
+    def schedule_tile_update(self):
+        """Coalesce tile refreshes so a burst of pan events costs one update."""
+        if self.redraw_pending is None:
+            self.redraw_pending = self.root.after_idle(self.update_tiles)
+
     def image_to_canvas_coords(self, x, y):
         """Convert image coordinates to canvas coordinates."""
         canvas_x = x * self.scale * self.zoom_level + self.canvas_offset_x
@@ -158,33 +605,117 @@ class TextureRipperApp:
         img_y = (y - self.canvas_offset_y) / (self.scale * self.zoom_level)
         return img_x, img_y
 
+    @timed("draw_grid")
     def draw_grid(self):
-        """Draw the quadrilateral grid for the current selection set."""
-        self.canvas.delete("grid")
-        if self.current_selection_set_index is not None:
-            selection_set = self.selection_sets[self.current_selection_set_index]
-            points = selection_set['points']
-            # Draw primary points
-            for i, point in enumerate(points):
-                canvas_x, canvas_y = self.image_to_canvas_coords(*point)
-                self.canvas.create_oval(canvas_x - 5, canvas_y - 5, canvas_x + 5, canvas_y + 5,
-                                        outline='red', width=2, tags="grid")
-
-            if len(points) == 4:
-                # Draw lines between points
-                for i in range(4):
-                    p1 = points[i]
-                    p2 = points[(i + 1) % 4]
+        """Draw the quadrilateral grid for the current selection set.
+
+        Each selection set keeps its own canvas items, which are moved in place with
+        ``canvas.coords`` instead of being deleted and recreated on every update.
+        """
+        index = self.current_selection_set_index
+        if self.shown_grid_index is not None and self.shown_grid_index != index:
+            # Hide the previous set's handles rather than deleting them
+            self.canvas.itemconfig(f"grid{self.shown_grid_index}", state=tk.HIDDEN)
+        self.shown_grid_index = index
+        if index is None:
+            return
 
-                    # Draw straight lines
-                    canvas_x1, canvas_y1 = self.image_to_canvas_coords(*p1)
-                    canvas_x2, canvas_y2 = self.image_to_canvas_coords(*p2)
-                    self.canvas.create_line(canvas_x1, canvas_y1, canvas_x2, canvas_y2,
-                                            fill='green', width=2, tags="grid")
+        selection_set = self.selection_sets[index]
+        points = selection_set['points']
+        curve = selection_set.get('curve')
+        items = self.grid_items.setdefault(index, {'points': [], 'lines': [], 'handles': [], 'curves': []})
+        tags = ("grid", f"grid{index}")
+        self.shape_var.set(curve_shape(curve))
+
+        # Primary points: reuse existing ovals, create missing ones, drop extras
+        for i, point in enumerate(points):
+            if i < len(items['points']):
+                self.canvas.coords(items['points'][i], *self.point_handle_coords(point))
+            else:
+                items['points'].append(self.canvas.create_oval(*self.point_handle_coords(point),
+                                                               outline='red', width=2, tags=tags))
+        for item in items['points'][len(points):]:
+            self.canvas.delete(item)
+        del items['points'][len(points):]
+
+        # Lines between points; curved selections draw their outline instead
+        if len(points) == 4 and curve is None:
+            for i in range(4):
+                coords = self.edge_coords(points, i)
+                if i < len(items['lines']):
+                    self.canvas.coords(items['lines'][i], *coords)
+                else:
+                    items['lines'].append(self.canvas.create_line(*coords, fill='green', width=2, tags=tags))
+        else:
+            for item in items['lines']:
+                self.canvas.delete(item)
+            items['lines'] = []
+        self.draw_curve(index)
+
+        self.canvas.itemconfig(f"grid{index}", state=tk.NORMAL)
+        self.update_preview()
+
+    def draw_curve(self, index):
+        """Draw a curved selection's outline, mesh lines or handle arms, and its control point handles.
+
+        Like the primary points, the items are moved in place and only created or
+        deleted when their number changes.
+        """
+        selection_set = self.selection_sets[index]
+        curve = selection_set.get('curve')
+        items = self.grid_items[index]
+        tags = ("grid", f"grid{index}")
+        lines, handles = [], []
+        if curve is not None and len(selection_set['points']) == 4:
+            for polyline in curve_polylines(selection_set['points'], curve):
+                canvas_x, canvas_y = self.image_to_canvas_coords(polyline[:, 0], polyline[:, 1])
+                lines.append([value for point in zip(canvas_x, canvas_y) for value in point])
+            handles = [self.point_handle_coords(point, 4) for _, point in curve_handles(curve)]
+
+        for kind, all_coords, create in (
+                ('curves', lines, lambda coords: self.canvas.create_line(*coords, fill='green', width=2, tags=tags)),
+                ('handles', handles, lambda coords: self.canvas.create_oval(*coords, outline='blue', width=2,
+                                                                            tags=tags))):
+            for i, coords in enumerate(all_coords):
+                if i < len(items[kind]):
+                    self.canvas.coords(items[kind][i], *coords)
+                else:
+                    items[kind].append(create(coords))
+            for item in items[kind][len(all_coords):]:
+                self.canvas.delete(item)
+            del items[kind][len(all_coords):]
+
+    def point_handle_coords(self, point, radius=5):
+        """Canvas bounding box of the handle drawn around an image point."""
+        canvas_x, canvas_y = self.image_to_canvas_coords(*point)
+        return canvas_x - radius, canvas_y - radius, canvas_x + radius, canvas_y + radius
+
+    def edge_coords(self, points, i):
+        """Canvas coordinates of the straight edge from point i to the next point."""
+        canvas_x1, canvas_y1 = self.image_to_canvas_coords(*points[i])
+        canvas_x2, canvas_y2 = self.image_to_canvas_coords(*points[(i + 1) % 4])
+        return canvas_x1, canvas_y1, canvas_x2, canvas_y2
+
+    def move_grid_point(self, i):
+        """Update only the handle of point i and the two edges that meet at it."""
+        index = self.current_selection_set_index
+        points = self.selection_sets[index]['points']
+        items = self.grid_items.get(index)
+        if items is None or i >= len(items['points']):
+            self.draw_grid()
+            return
+        self.canvas.coords(items['points'][i], *self.point_handle_coords(points[i]))
+        if items['lines']:
+            for edge in (i - 1) % 4, i:
+                self.canvas.coords(items['lines'][edge], *self.edge_coords(points, edge))
 
     def add_selection_set(self, first_set=False):
-        """Add a new selection set."""
-        selection_set = {'points': [], 'texture': None}
+        """Add a new selection set on the shown image."""
+        if self.current_image is None:
+            messagebox.showwarning("Warning", "Please load an image first.")
+            return
+        selection_set = {'image': self.current_image, 'points': [], 'texture': None, 'quad': None,
+                         'quality': DEFAULT_WARP_QUALITY, 'curve': None, 'quad_curve': None}
         self.selection_sets.append(selection_set)
         self.current_selection_set_index = len(self.selection_sets) - 1
         self.selected_point = None
@@ -193,20 +724,17 @@ class TextureRipperApp:
             messagebox.showinfo("Info", f"Added new selection set {self.current_selection_set_index + 1}")
 
     def prev_selection_set(self):
-        """Switch to the previous selection set."""
-        if self.selection_sets and self.current_selection_set_index > 0:
-            self.current_selection_set_index -= 1
-            self.selected_point = None
-            self.draw_grid()
+        """Switch to the previous selection set, showing its image if it is on another one."""
+        if self.current_selection_set_index is not None and self.current_selection_set_index > 0:
+            self.select_set(self.current_selection_set_index - 1)
         else:
             messagebox.showinfo("Info", "No previous selection set.")
 
     def next_selection_set(self):
-        """Switch to the next selection set."""
-        if self.selection_sets and self.current_selection_set_index < len(self.selection_sets) - 1:
-            self.current_selection_set_index += 1
-            self.selected_point = None
-            self.draw_grid()
+        """Switch to the next selection set, showing its image if it is on another one."""
+        if self.current_selection_set_index is not None and \
+                self.current_selection_set_index < len(self.selection_sets) - 1:
+            self.select_set(self.current_selection_set_index + 1)
         else:
             messagebox.showinfo("Info", "No next selection set.")
 
@@ -230,8 +758,10 @@ class TextureRipperApp:
             points.append((x, y))
             self.draw_grid()
         else:
-            # Otherwise, check if a primary point is selected for dragging
-            for i, point in enumerate(points):
+            # Otherwise, check if a primary point, then a curve's control point, is selected for dragging
+            grabbable = list(enumerate(points)) + [(('handle', i), point)
+                                                   for i, point in curve_handles(selection_set.get('curve'))]
+            for i, point in grabbable:
                 canvas_x, canvas_y = self.image_to_canvas_coords(*point)
                 if abs(canvas_x - event.x) < 10 and abs(canvas_y - event.y) < 10:
                     self.selected_point = i
@@ -253,28 +783,114 @@ class TextureRipperApp:
             x = max(0, min(x, self.img_width))
             y = max(0, min(y, self.img_height))
 
-            points[index] = (x, y)
-            self.draw_grid()
+            if isinstance(index, tuple):
+                move_handle(selection_set['curve'], index[1], (x, y))
+            else:
+                points[index] = (x, y)
+            self.drag_moved = True
+            # An extraction still running for this set would be of the old quad
+            self.worker.cancel(('extract', self.current_selection_set_index))
+
+            # Motion events arrive faster than the display refreshes; redraw at most once per frame
+            if self.drag_pending is None:
+                self.drag_pending = self.root.after(FRAME_INTERVAL_MS, self.flush_drag, index)
+
+    @timed("drag_frame")
+    def flush_drag(self, index):
+        """Apply the latest dragged position to the canvas."""
+        self.drag_pending = None
+        if self.current_selection_set_index is not None:
+            if not isinstance(index, tuple):
+                self.move_grid_point(index)
+            if self.selection_sets[self.current_selection_set_index].get('curve') is not None:
+                # A curve's outline bends as a whole when any of its points moves
+                self.draw_curve(self.current_selection_set_index)
+            self.update_preview()
 
     def release_point(self, event):
-        """Release the dragged point."""
+        """Release the dragged point, re-extracting the texture at full resolution if it was extracted before."""
+        if self.drag_pending is not None:
+            # Show the final position right away instead of waiting for the frame timer
+            self.root.after_cancel(self.drag_pending)
+            self.flush_drag(self.selected_point)
+        index = self.current_selection_set_index
+        if self.drag_moved and index is not None and self.selection_sets[index]['texture'] is not None:
+            self.extract_set(index)
+        self.drag_moved = False
+        self.selected_point = None
+
+    @timed("update_preview")
+    def update_preview(self):
+        """Warp the current quad from a downscaled pyramid level into the preview panel.
+
+        Costs about as much as the preview's own pixels, so it runs on every drag frame;
+        the full-resolution warp waits for release or Extract Texture.
+        """
+        index = self.current_selection_set_index
+        points = self.selection_sets[index]['points'] if index is not None else []
+        curve = self.selection_sets[index].get('curve') if index is not None else None
+        self.preview_canvas.delete("all")
+        if len(points) != 4 or self.tile_renderer is None:
+            self.preview_label.config(text="Preview")
+            return
+
+        start = time.perf_counter()
+        pyramid = self.tile_renderer.pyramid
+        if curve is None:
+            pixels = warp_quad_preview(pyramid.levels, points, PREVIEW_SIZE, PREVIEW_SIZE, pyramid.bgr)
+        else:
+            pixels = warp_curve_preview(pyramid.levels, points, curve, PREVIEW_SIZE, PREVIEW_SIZE, pyramid.bgr)
+        preview = Image.fromarray(pixels)
+        preview_tk = ImageTk.PhotoImage(preview)
+        self.preview_canvas.create_image((PREVIEW_SIZE - preview.width) // 2, (PREVIEW_SIZE - preview.height) // 2,
+                                         anchor=tk.NW, image=preview_tk)
+        self.preview_canvas.image = preview_tk  # Keep reference
+        self.preview_label.config(text=f"Preview ({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+    def set_shape(self, shape):
+        """Make the current selection straight, Bezier-edged or a control mesh, keeping its outline.
+
+        Switching shapes starts the new one from the current outline, so e.g. a mesh
+        can be laid over a Bezier selection and refined.
+        """
+        index = self.current_selection_set_index
+        if index is None or len(self.selection_sets[index]['points']) != 4:
+            messagebox.showwarning("Warning", "Please select exactly 4 points.")
+            self.shape_var.set(curve_shape(self.selection_sets[index].get('curve')) if index is not None
+                               else CURVE_SHAPES[0])
+            return
+        selection_set = self.selection_sets[index]
+        if shape == curve_shape(selection_set.get('curve')):
+            return
+        selection_set['points'], selection_set['curve'] = make_curve(selection_set['points'],
+                                                                     selection_set.get('curve'), shape)
         self.selected_point = None
+        self.draw_grid()
+        if selection_set['texture'] is not None:
+            self.extract_set(index)
 
     def clear_points(self):
         """Clear the selected points in the current selection set."""
         if self.current_selection_set_index is not None:
+            # An extraction still running for this set would put its texture back
+            self.worker.cancel(('extract', self.current_selection_set_index))
             self.selection_sets[self.current_selection_set_index]['points'] = []
-            self.canvas.delete("grid")
-            self.display_image()
+            self.selection_sets[self.current_selection_set_index]['curve'] = None
+            self.selected_point = None
+            self.draw_grid()
         else:
             messagebox.showwarning("Warning", "No selection set to clear.")
 
     def clear_map(self):
         """Clear the extracted textures and reset the map."""
+        self.worker.cancel_all('extract')
         for selection_set in self.selection_sets:
+            # Forget the quad too, or saving a project would bring the texture back on load
             selection_set['texture'] = None
-        self.map_image = None
-        self.extracted_canvas.delete("all")
+            selection_set['quad'] = None
+            selection_set['quad_curve'] = None
+        self.map_page = 0
+        self.run_map_job(self.atlas.clear)
         messagebox.showinfo("Info", "Texture map cleared.")
 
     def zoom_image(self, event):
@@ -337,7 +953,11 @@ class TextureRipperApp:
             self.canvas_offset_y += delta_y
             self.pan_start_x = event.x
             self.pan_start_y = event.y
-            self.display_image()
+
+            # Move what is already on the canvas; only newly exposed tiles need rendering
+            self.canvas.move("tile", delta_x, delta_y)
+            self.canvas.move("grid", delta_x, delta_y)
+            self.schedule_tile_update()
 
     def end_pan(self, event):
         """End panning when the middle or right mouse button is released."""
@@ -350,21 +970,6 @@ class TextureRipperApp:
         self.canvas_offset_y = 0
         self.display_image()
 
-    def order_points(self, pts):
-        """Order points in the following order: top-left, top-right, bottom-right, bottom-left."""
-        rect = np.zeros((4, 2), dtype="float32")
-
-        # Sum and diff of points
-        s = pts.sum(axis=1)
-        diff = np.diff(pts, axis=1)
-
-        rect[0] = pts[np.argmin(s)]  # Top-left has smallest sum
-        rect[2] = pts[np.argmax(s)]  # Bottom-right has largest sum
-        rect[1] = pts[np.argmin(diff)]  # Top-right has smallest difference
-        rect[3] = pts[np.argmax(diff)]  # Bottom-left has largest difference
-
-        return rect
-
     def extract_texture(self):
         """Extract the texture using the selected quadrilateral points."""
         if self.current_selection_set_index is None:
@@ -378,130 +983,307 @@ class TextureRipperApp:
             messagebox.showwarning("Warning", "Please select exactly 4 points.")
             return
 
-        if not self.image_path:
+        if self.source is None:
             messagebox.showerror("Error", "No image loaded.")
             return
 
-        src_img = cv2.imread(self.image_path)
-        if src_img is None:
-            messagebox.showerror("Error", "Failed to load the image for processing.")
-            return
-
-        # Convert the image to RGB
-        src_img_rgb = cv2.cvtColor(src_img, cv2.COLOR_BGR2RGB)
-
-        # Use perspective transform for quadrilateral
-        src_pts = np.array(points, dtype=np.float32)
-        src_pts = self.order_points(src_pts)
-
-        # Determine the size of the output image
-        (tl, tr, br, bl) = src_pts
-
-        width_top = np.linalg.norm(tr - tl)
-        width_bottom = np.linalg.norm(br - bl)
-        max_width = int(max(width_top, width_bottom))
-
-        height_left = np.linalg.norm(bl - tl)
-        height_right = np.linalg.norm(br - tr)
-        max_height = int(max(height_left, height_right))
-
-        dst_pts = np.array([
-            [0, 0],
-            [max_width - 1, 0],
-            [max_width - 1, max_height - 1],
-            [0, max_height - 1]
-        ], dtype=np.float32)
-
-        # Compute the perspective transform matrix
-        M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-
-        # Warp the image using the perspective transform
-        warped = cv2.warpPerspective(src_img_rgb, M, (max_width, max_height))
-
-        # Convert back to PIL Image and store in the selection set
-        extracted_image = Image.fromarray(warped)
-        selection_set['texture'] = extracted_image
-
-        # Update the texture map
-        self.update_texture_map()
+        self.extract_set(self.current_selection_set_index)
 
         # Points remain for further editing
 
-    def update_texture_map(self):
-        """Update the composite texture map with all extracted textures."""
-        textures = [s['texture'] for s in self.selection_sets if s['texture'] is not None]
-        if not textures:
+    def extract_all(self):
+        """Extract every selection set that has four points, on every image, in one pass.
+
+        Each image is read once (through the source cache) and its quads are split
+        into one chunk per core; each chunk's straight quads are ordered, sized and
+        warped together, its curved ones through their cached lookup grids. The map
+        is rebuilt once when every chunk is done, rather than once per set.
+        """
+        indices = [i for i, selection_set in enumerate(self.selection_sets) if len(selection_set['points']) == 4]
+        if not indices:
+            messagebox.showwarning("Warning", "No selection set has 4 points to extract.")
             return
+        # Everything is re-extracted, so earlier single and bulk extractions are obsolete
+        self.worker.cancel_all('extract')
+        quality = self.quality_var.get()
+        source_cache = self.source_cache
+        remap_cache = self.remap_cache
+
+        by_image = {}
+        for index in indices:
+            by_image.setdefault(self.selection_sets[index]['image'], []).append(index)
+        chunks = []
+        for image, image_indices in by_image.items():
+            chunk_size = -(-len(image_indices) // (os.cpu_count() or 1))
+            for start in range(0, len(image_indices), chunk_size):
+                chunk_indices = image_indices[start:start + chunk_size]
+                chunk = [self.selection_sets[i] for i in chunk_indices]
+                chunks.append((self.images[image]['path'], chunk,
+                               [list(selection_set['points']) for selection_set in chunk],
+                               [copy_curve(selection_set.get('curve')) for selection_set in chunk],
+                               [self.worker.generation(('extract', i)) for i in chunk_indices],
+                               chunk_indices))
+        remaining = [len(chunks)]
+
+        @timed("extract_all")
+        def warp(image_path, quads, curves, owners):
+            # One decode per image, shared by its chunks; the cache reopens it if it was pushed out
+            source = source_cache.get(image_path)
+            straight = [i for i, curve in enumerate(curves) if curve is None]
+            textures = dict(zip(straight, warp_source_quads(source, [quads[i] for i in straight], quality)))
+            for i, curve in enumerate(curves):
+                if curve is not None:
+                    textures[i] = warp_source_curve(source, quads[i], curve, quality, remap_cache, owners[i])
+            return [Image.fromarray(textures[i]) for i in range(len(quads))]
+
+        def chunk_finished():
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                self.update_texture_map()
+
+        def done(selection_sets, quads, curves, generations, indices, textures):
+            for selection_set, points, curve, generation, index, texture in zip(
+                    selection_sets, quads, curves, generations, indices, textures):
+                # A set edited, or extracted on its own (say at another quality), while its chunk was
+                # warping keeps its newer texture
+                if (selection_set['points'] == points and selection_set.get('curve') == curve
+                        and self.worker.generation(('extract', index)) == generation):
+                    selection_set['texture'] = texture
+                    selection_set['quad'] = points
+                    selection_set['quad_curve'] = curve
+                    selection_set['quality'] = quality
+            chunk_finished()
+
+        def failed(e):
+            messagebox.showerror("Error", f"Failed to extract textures:\n{e}")
+            chunk_finished()
+
+        for number, (image_path, selection_sets, quads, curves, generations, indices) in enumerate(chunks):
+            owners = [id(selection_set) for selection_set in selection_sets]
+            self.worker.submit(('extract', 'all', number), warp, image_path, quads, curves, owners,
+                               on_done=lambda textures, chunk=(selection_sets, quads, curves, generations, indices):
+                               done(*chunk, textures),
+                               on_error=failed)
+
+    def extract_set(self, index):
+        """Warp one selection set's quad in the background and put the texture in the map when done.
+
+        Editing the quad or extracting it again before the warp finishes discards this result.
+        """
+        selection_set = self.selection_sets[index]
+        points = list(selection_set['points'])
+        curve = copy_curve(selection_set.get('curve'))
+        quality = self.quality_var.get()
+        image_path = self.images[selection_set['image']]['path']
+        source_cache = self.source_cache
+        remap_cache = self.remap_cache
+
+        @timed("extract_texture")
+        def warp():
+            # The set may be on an image that is not shown; the cache reopens it if it was pushed out
+            source = source_cache.get(image_path)
+            # Use perspective transform for quadrilateral (or the curve's lookup grid), reading only
+            # the source around it, and convert back to a PIL Image
+            if curve is not None:
+                return Image.fromarray(warp_source_curve(source, points, curve, quality, remap_cache,
+                                                         id(selection_set)))
+            return Image.fromarray(warp_source_quad(source, points, quality))
+
+        def done(extracted_image):
+            # Store in the selection set, with the quad (and curve) it came from for the map's manifest
+            selection_set['texture'] = extracted_image
+            selection_set['quad'] = points
+            selection_set['quad_curve'] = curve
+            selection_set['quality'] = quality
+            # Update the texture map; only this set's region changes
+            self.update_texture_map(index)
+
+        self.worker.submit(('extract', index), warp, on_done=done,
+                           on_error=lambda e: messagebox.showerror("Error", f"Failed to extract texture:\n{e}"))
+
+    def update_texture_map(self, index=None):
+        """Update the composite texture map with the extracted textures.
+
+        With ``index`` only that selection set's texture is re-placed in the map;
+        otherwise the map is rebuilt from every selection set.
+        """
+        if index is not None:
+            # Show the page the texture landed on
+            self.run_map_job(self.atlas.set_texture, index, self.selection_sets[index]['texture'], show_key=index)
+        else:
+            options = self.atlas_options()
+            textures = {i: selection_set['texture'] for i, selection_set in enumerate(self.selection_sets)
+                        if selection_set['texture'] is not None}
+
+            def rebuild():
+                self.atlas.options.update(options)
+                self.atlas.set_textures(textures)
+
+            self.run_map_job(rebuild)
+
+    def run_map_job(self, change, *args, show_key=None):
+        """Change the texture map on the worker's serial thread, then display the result.
+
+        Every map change goes through here, so changes apply in order and the atlas
+        is never touched from two threads. ``show_key`` switches to the page that
+        texture is on.
+        """
+        def failed(e):
+            if isinstance(e, PackingError):
+                messagebox.showerror("Error", f"Failed to pack the texture map:\n{e}")
+            else:
+                messagebox.showerror("Error", f"Failed to update the texture map:\n{e}")
 
-        # Define the map dimensions
-        # For simplicity, we'll arrange textures in a grid
-        texture_widths = [img.width for img in textures]
-        texture_heights = [img.height for img in textures]
-        max_texture_width = max(texture_widths)
-        max_texture_height = max(texture_heights)
-
-        # Calculate grid size
-        num_textures = len(textures)
-        grid_cols = int(np.ceil(np.sqrt(num_textures)))
-        grid_rows = int(np.ceil(num_textures / grid_cols))
-
-        map_width = grid_cols * max_texture_width
-        map_height = grid_rows * max_texture_height
-
-        # Create a new blank image for the map
-        self.map_image = Image.new('RGB', (map_width, map_height), color=(0, 0, 0))
-
-        # Paste each texture into the map
-        for idx, texture in enumerate(textures):
-            row = idx // grid_cols
-            col = idx % grid_cols
-            x_offset = col * max_texture_width
-            y_offset = row * max_texture_height
-
-            # Center the texture in the grid cell
-            x_center = x_offset + (max_texture_width - texture.width) // 2
-            y_center = y_offset + (max_texture_height - texture.height) // 2
-
-            self.map_image.paste(texture, (x_center, y_center))
-
-        # Display the updated texture map
-        self.display_texture_map()
-
-    def display_texture_map(self):
-        """Display the texture map on the extracted canvas."""
-        if self.map_image:
-            # Calculate aspect ratio and fit the image to the extracted canvas (400x400)
-            canvas_width, canvas_height = 400, 400
-            map_width, map_height = self.map_image.size
-            ratio = min(canvas_width / map_width, canvas_height / map_height)
-            new_width = int(map_width * ratio)
-            new_height = int(map_height * ratio)
-
-            # Resize while preserving aspect ratio
-            img_resized = self.map_image.resize((new_width, new_height), Image.LANCZOS)
-            extracted_image_tk = ImageTk.PhotoImage(img_resized)
-
-            # Clear the canvas and display the resized image
+        self.worker.submit(None, timed("update_texture_map")(change), *args, on_error=failed, serial=True)
+        self.display_texture_map(show_key)
+
+    def atlas_options(self):
+        """Packing settings for the texture map, as chosen in the packing row."""
+        try:
+            padding = max(0, int(self.padding_var.get()))
+        except (tk.TclError, ValueError):
+            padding = 0
+        atlas_size = self.atlas_size_var.get()
+        max_size = self.max_size_var.get()
+        return {
+            'method': self.packer_var.get(),
+            'padding': padding,
+            'bleed': self.bleed_var.get(),
+            'allow_rotation': self.rotate_var.get(),
+            'power_of_two': atlas_size == "Power of two",
+            'fixed_size': int(atlas_size) if atlas_size.isdigit() else None,
+            'max_size': int(max_size) if max_size.isdigit() else None,
+        }
+
+    def apply_atlas_options(self, options):
+        """Set the packing row from saved packing settings."""
+        options = {**DEFAULT_ATLAS_OPTIONS, **options}
+        self.packer_var.set(options['method'] if options['method'] in PACKERS else DEFAULT_ATLAS_OPTIONS['method'])
+        self.padding_var.set(options['padding'])
+        self.bleed_var.set(options['bleed'])
+        self.rotate_var.set(options['allow_rotation'])
+        if options['power_of_two']:
+            self.atlas_size_var.set("Power of two")
+        elif options['fixed_size']:
+            self.atlas_size_var.set(str(options['fixed_size']))
+        else:
+            self.atlas_size_var.set("Auto")
+        self.max_size_var.set(str(options['max_size']) if options['max_size'] else "Unlimited")
+
+    def output_options(self):
+        """How the texture map is saved: format, compression, alpha and the binary manifest."""
+        return {
+            'format': self.map_extension,
+            'compression': self.compression_var.get(),
+            'alpha': self.alpha_var.get(),
+            'binary_manifest': self.binary_manifest_var.get(),
+        }
+
+    def apply_output_options(self, options):
+        """Set the save settings from saved output settings; missing or unknown values get the defaults."""
+        self.map_extension = options.get('format') if options.get('format') in SAVE_FORMATS else ".png"
+        compression = options.get('compression')
+        self.compression_var.set(compression if compression in COMPRESSIONS else DEFAULT_COMPRESSION)
+        self.alpha_var.set(bool(options.get('alpha', False)))
+        self.binary_manifest_var.set(bool(options.get('binary_manifest', False)))
+
+    def on_atlas_setting_changed(self, *args):
+        """Repack the texture map when a packing setting changes."""
+        options = self.atlas_options()
+        self.run_map_job(lambda: self.atlas.configure(**options))
+
+    @timed("display_texture_map")
+    def map_view(self, page, show_key=None):
+        """Summary of the map and a thumbnail of one page. Runs on the worker's serial thread."""
+        # Fit the page to the extracted canvas (400x400); only regions that changed are re-thumbnailed
+        pages = self.atlas.pages
+        if show_key in self.atlas.slots:
+            page = self.atlas.slots[show_key][0]
+        page = max(0, min(page, len(pages) - 1))
+        thumbnail = self.atlas.thumbnail(page, 400, 400)
+        return {
+            'pages': [(p.width, p.height) for p in pages],
+            'efficiency': self.atlas.efficiency,
+            'page': page,
+            # A copy, as later map jobs keep drawing into the atlas's own thumbnail
+            'thumbnail': thumbnail.copy() if thumbnail is not None else None,
+        }
+
+    def display_texture_map(self, show_key=None):
+        """Display the current page of the texture map, once pending map changes are done."""
+        self.worker.submit(('map',), self.map_view, self.map_page, show_key, on_done=self.show_texture_map,
+                           serial=True)
+
+    def show_texture_map(self, view):
+        """Put a map_view result on the extracted canvas and status bar."""
+        self.map_info = view
+        pages = view['pages']
+        self.map_page = view['page']
+        self.page_label.config(text=f"Page {self.map_page + 1}/{len(pages)}" if len(pages) > 1 else "")
+        self.update_status()
+
+        thumbnail = view['thumbnail']
+        if thumbnail is None:
             self.extracted_canvas.delete("all")
-            self.extracted_canvas.create_image((canvas_width - new_width) // 2, (canvas_height - new_height) // 2,
-                                               anchor=tk.NW, image=extracted_image_tk)
-            self.extracted_canvas.image = extracted_image_tk  # Keep reference
+            return
+        extracted_image_tk = ImageTk.PhotoImage(thumbnail)
+
+        # Clear the canvas and display the resized image
+        canvas_width, canvas_height = 400, 400
+        self.extracted_canvas.delete("all")
+        self.extracted_canvas.create_image((canvas_width - thumbnail.width) // 2, (canvas_height - thumbnail.height) // 2,
+                                           anchor=tk.NW, image=extracted_image_tk)
+        self.extracted_canvas.image = extracted_image_tk  # Keep reference
+
+    def prev_map_page(self):
+        """Show the previous page of the texture map."""
+        if self.map_page > 0:
+            self.map_page -= 1
+            self.display_texture_map()
+
+    def next_map_page(self):
+        """Show the next page of the texture map."""
+        if self.map_page < len(self.map_info['pages']) - 1:
+            self.map_page += 1
+            self.display_texture_map()
 
     def save_texture_map(self):
-        """Save the texture map to a user-specified location."""
-        if self.map_image:
-            file_path = filedialog.asksaveasfilename(defaultextension=".png",
-                                                     filetypes=[("PNG Files", "*.png"), ("JPEG Files", "*.jpg;*.jpeg")])
+        """Save the texture map to a user-specified location.
+
+        Multi-page maps are written as numbered files (name_1.png, name_2.png, ...)
+        next to a name.json manifest of where each texture is and which quad of the
+        source image it came from. The format follows the chosen extension (PNG,
+        lossless WebP, JPEG or uncompressed DDS). Pages are rendered and encoded
+        in the background.
+        """
+        if self.map_info['pages']:
+            # The last used format comes first, so the dialog suggests it
+            pattern = "*" + self.map_extension
+            filetypes = sorted(SAVE_FILETYPES, key=lambda filetype: pattern not in filetype[1].split(";"))
+            file_path = filedialog.asksaveasfilename(defaultextension=self.map_extension, filetypes=filetypes)
             if file_path:
-                try:
-                    self.map_image.save(file_path)
-                    messagebox.showinfo("Success", "Texture map saved successfully.")
-                except Exception as e:
-                    messagebox.showerror("Error", f"Failed to save texture map:\n{e}")
+                extension = os.path.splitext(file_path)[1].lower()
+                if extension in SAVE_FORMATS:
+                    self.map_extension = extension
+                sources = {i: {'image': self.images[selection_set['image']]['path'], 'quad': selection_set['quad'],
+                               'curve': selection_set.get('quad_curve')}
+                           for i, selection_set in enumerate(self.selection_sets)}
+                self.worker.submit(None, timed("save_texture_map")(save_atlas), self.atlas, file_path, sources,
+                                   self.binary_manifest_var.get(), self.compression_var.get(), self.alpha_var.get(),
+                                   serial=True,
+                                   on_done=lambda saved: messagebox.showinfo(
+                                       "Success", f"Texture map saved successfully ({len(saved['pages'])} page(s), "
+                                                  f"{format_bytes(saved['bytes'])}, and manifest) in "
+                                                  f"{saved['seconds']:.1f}s."),
+                                   on_error=lambda e: messagebox.showerror("Error", f"Failed to save texture map:\n{e}"))
         else:
             messagebox.showwarning("Warning", "No texture map to save.")
 
 if __name__ == "__main__":
+    if HEADLESS:
+        from batch import main
+        sys.exit(main(sys.argv[2:]))
+
     root = tk.Tk()
     app = TextureRipperApp(root)
     root.mainloop()
@@ -0,0 +1,130 @@
+"""Background jobs for the GUI: slow work runs on threads, results come back on the Tk thread.
+
+Tk may only be touched from the thread running the mainloop, so workers never call
+back into the UI. Finished jobs are queued and a ``root.after`` poll hands each
+result to its callback on the Tk thread.
+
+OpenCV releases the GIL while decoding and warping, so the pool runs those in
+parallel across every core. Jobs that share state (everything touching the texture
+map) go on the single ``serial`` thread instead, which runs them in submission order.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import traceback
+
+POLL_INTERVAL_MS = 15  # How often finished jobs are collected while any are running
+
+
+class BackgroundWorker:
+    """Runs jobs off the Tk thread, dropping the results of jobs that went stale.
+
+    Jobs are submitted under a key, e.g. ('extract', 3). Submitting another job under
+    the same key, or calling ``cancel(key)``, makes earlier jobs for that key stale:
+    they are skipped if they have not started, and their results are discarded.
+    """
+
+    def __init__(self, root, max_workers=None, on_progress=None):
+        self.root = root
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                       thread_name_prefix="texture-ripper")
+        self.serial = ThreadPoolExecutor(max_workers=1, thread_name_prefix="texture-ripper-map")
+        self.on_progress = on_progress  # Called with (finished, submitted) while busy, (0, 0) when idle
+        self.results = queue.Queue()
+        self.generations = {}  # key -> generation of the latest job submitted under it
+        self.futures = {}  # key -> future of that job
+        self.submitted = 0
+        self.finished = 0
+        self.poll_id = None
+
+    @property
+    def busy(self):
+        return self.finished < self.submitted
+
+    def submit(self, key, function, *args, on_done=None, on_error=None, serial=False):
+        """Run ``function(*args)`` in the background; ``on_done(result)`` or ``on_error(exception)`` then
+        run on the Tk thread unless the job went stale first. ``key`` None means the job never goes stale."""
+        generation = None
+        if key is not None:
+            generation = self.generations[key] = self.generations.get(key, 0) + 1
+            previous = self.futures.get(key)
+            if previous is not None:
+                previous.cancel()
+
+        future = (self.serial if serial else self.pool).submit(function, *args)
+        if key is not None:
+            self.futures[key] = future
+        future.add_done_callback(lambda f: self.results.put((key, generation, f, on_done, on_error)))
+
+        self.submitted += 1
+        self.report_progress()
+        if self.poll_id is None:
+            self.poll_id = self.root.after(POLL_INTERVAL_MS, self.poll)
+        return future
+
+    def cancel(self, key):
+        """Make every job submitted under ``key`` so far stale."""
+        if key in self.generations:
+            self.generations[key] += 1
+            future = self.futures.pop(key, None)
+            if future is not None:
+                future.cancel()
+
+    def cancel_all(self, kind):
+        """Cancel every key whose first element is ``kind``, e.g. all ('extract', i) jobs."""
+        for key in list(self.generations):
+            if isinstance(key, tuple) and key and key[0] == kind:
+                self.cancel(key)
+
+    def generation(self, key):
+        """Counter that changes whenever a job is submitted or cancelled under ``key``."""
+        return self.generations.get(key, 0)
+
+    def is_current(self, key, generation):
+        return key is None or self.generations.get(key) == generation
+
+    def poll(self):
+        """Hand finished jobs to their callbacks; keeps polling while any are running.
+
+        ``poll_id`` stays set while the callbacks run, so jobs they submit do not
+        schedule a second poll; the next one is scheduled once they are done.
+        """
+        try:
+            while True:
+                try:
+                    key, generation, future, on_done, on_error = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                self.finished += 1
+                if future.cancelled() or not self.is_current(key, generation):
+                    continue
+                if self.futures.get(key) is future:
+                    del self.futures[key]
+
+                error = future.exception()
+                if error is None:
+                    if on_done is not None:
+                        on_done(future.result())
+                elif on_error is not None:
+                    on_error(error)
+                else:
+                    traceback.print_exception(type(error), error, error.__traceback__)
+        finally:
+            if self.busy:
+                self.poll_id = self.root.after(POLL_INTERVAL_MS, self.poll)
+            else:
+                self.poll_id = None
+                self.submitted = self.finished = 0
+            self.report_progress()
+
+    def report_progress(self):
+        if self.on_progress is not None:
+            self.on_progress(self.finished, self.submitted)
+
+    def shutdown(self):
+        """Drop queued jobs and stop accepting new ones; running jobs finish in the background."""
+        if self.poll_id is not None:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.serial.shutdown(wait=False, cancel_futures=True)